@@ -1,11 +1,17 @@
 import os
+import random
 import re
+import sys
 import time
 import xml.etree.ElementTree as ET
 
 import edlib
 import pdfplumber
 
+# utils (coordinates sidecar file) is in the parent directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import get_coords_sidecar_path, write_coords_sidecar
+
 PATH_TO_XML_FILES = "D:\\diplomska-data\\raw-data\\kranjska-xml"
 PATH_TO_PDF_FILES = "D:\\diplomska-data\\raw-data\\kranjska-pdf"
 OUTPUT_FILE = "D:\\diplomska-data\\first-parsing\\second-attempt"
@@ -13,6 +19,10 @@ OUTPUT_FILE = "D:\\diplomska-data\\first-parsing\\second-attempt"
 # Set to True if you want to visualize the coordinates on the PDF and save the images into a folder
 VISUALIZE_COORDINATES_FROM_XML = False
 VISUALIZATION_FILE = "D:\\diplomska-data\\visualizations\\first-parsing\\second-attempt"
+# Pages (0-based) that are always rendered, even if there are no coordinates on them
+VISUALIZATION_PAGES: list[int] = []
+# Set to number of pages if you want to render only a random sample of pages with coordinates (for QA)
+VISUALIZATION_SAMPLE_SIZE = -1  # set to -1 if you want to render all pages with coordinates
 
 SKIP_FILES_TO =  0 # set to 0 if you want to convert all files
 MAX_FILES = -1  # set to -1 if you want to convert all files
@@ -21,8 +31,13 @@ MAX_FILES = -1  # set to -1 if you want to convert all files
 # Target -> word from the xml; Best match -> word from the pdf; Similarity -> similarity between the two words
 PRINT_ALIGNMENT = False
 
+# Set to True if you want to write the coordinates into a binary sidecar file next to the XML (read by the parsers)
+# instead of x0/y0/x1/y1... attributes of the word elements
+WRITE_COORDINATES_TO_SIDECAR = False
+
 # Namespace
 TEI = "http://www.tei-c.org/ns/1.0"
+XML_ID = "{http://www.w3.org/XML/1998/namespace}id"
 
 # Tags in the XML files
 SEGMENT_TAG = "{" + TEI + "}seg"
@@ -34,6 +49,14 @@ PUNCTUATION_TAG = "{" + TEI + "}pc"
 # Characters that are 100% not in the xml files ()
 CHARACTERS_TO_REMOVE: set[str] = {'@', '#', '$', '^', '&', '*', '<', '>', '­', '-'}
 
+# Length of exact k-mer seeds used to shortlist positions of session start and end notes in the PDF
+SESSION_SEED_LENGTH = 8
+
+# Time saved by seeded search is estimated for every record. If you want to measure it by comparing seeded search for
+# session start and end notes with alignment over the whole PDF set this to True (slow, alignment over the whole PDF is
+# done in addition to seeded search)
+COMPARE_SESSION_BOUNDARIES = False
+
 # Additional equalities for Edlib to improve alignment
 ADDIDIONAL_EQUALITIES: list[tuple[str, str]] = [
     ('m', 'n'), ('n', 'm'),
@@ -46,18 +69,52 @@ ADDIDIONAL_EQUALITIES: list[tuple[str, str]] = [
 ]
 
 
-def visualize_xml(xml_root: ET.Element, xml_path: str, pdf_path: str) -> None:
+def visualize_xml(xml_root: ET.Element, xml_path: str, pdf_path: str, word_boxes: dict = None) -> None:
     xml_elements = get_elements_by_tags(xml_root, {WORD_TAG, PUNCTUATION_TAG})
 
     base_name = os.path.basename(xml_path).replace('.tei.xml', '')
 
-    # Make a list of images of each page in the PDF
-    images = []
+    # Group rectangles by page first, so we only rasterize pages that are actually needed
+    if word_boxes is not None:
+        boxes_by_page: dict[int, list[tuple[float, float, float, float]]] = {}
+        for boxes_of_word in word_boxes.values():
+            for page, x0, y0, x1, y1 in boxes_of_word:
+                boxes_by_page.setdefault(page, []).append((x0, y0, x1, y1))
+    else:
+        boxes_by_page: dict[int, list[tuple[float, float, float, float]]] = get_boxes_by_page(xml_elements)
+
+    pages_to_render: list[int] = sorted(boxes_by_page.keys())
+    if VISUALIZATION_SAMPLE_SIZE != -1:
+        # Seeded with the file name, so the same pages are sampled on every run
+        pages_to_render = sorted(random.Random(base_name).sample(pages_to_render,
+                                                                 min(VISUALIZATION_SAMPLE_SIZE, len(pages_to_render))))
+    pages_to_render = sorted(set(pages_to_render) | set(VISUALIZATION_PAGES))
+
+    if not os.path.exists(os.path.join(VISUALIZATION_FILE, base_name)):
+        os.makedirs(os.path.join(VISUALIZATION_FILE, base_name))
+
+    # Render, draw and save one page at a time, so only one image is held in memory
     with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
-            images.append(page.to_image(resolution=150))
+        for page_num in pages_to_render:
+            if not 0 <= page_num < len(pdf.pages):
+                print(f"visualize_xml(): page {page_num} does not exist in '{pdf_path}'")
+                continue
+
+            pdf_page = pdf.pages[page_num]
+            image = pdf_page.to_image(resolution=150)
+            for box in boxes_by_page.get(page_num, []):
+                image.draw_rect(box, stroke_width=1)
+
+            image.save(os.path.join(VISUALIZATION_FILE, base_name, f"{base_name}_{page_num}.png"), )
+
+            del image
+            pdf_page.close()
+
+
+# Collects rectangles of the words in the XML and groups them by page
+def get_boxes_by_page(xml_elements: list[ET.Element]) -> dict[int, list[tuple[float, float, float, float]]]:
+    boxes_by_page: dict[int, list[tuple[float, float, float, float]]] = {}
 
-    # For each word in the XML draw a rectangle around it on the PDF
     for xml_element in xml_elements:
 
         # Skip elements that are considered as noise
@@ -75,17 +132,13 @@ def visualize_xml(xml_root: ET.Element, xml_path: str, pdf_path: str) -> None:
             for x0, y0, x1, y1 in zip(x_coords[::2], y_coords[::2], x_coords[1::2], y_coords[1::2]):
                 page_num = fromPage if i == 0 else toPage
 
-                images[page_num].draw_rect((x0, y0, x1, y1), stroke_width=1)
+                boxes_by_page.setdefault(page_num, []).append((x0, y0, x1, y1))
                 i += 1
         except:
             print(
                 f"visualize_xml(): COORD ERROR with word: '{xml_element.text}', {xml_element.attrib.get('{' + TEI + '}id')}")
 
-    # Save the images
-    if not os.path.exists(os.path.join(VISUALIZATION_FILE, base_name)):
-        os.makedirs(os.path.join(VISUALIZATION_FILE, base_name))
-    for i, image in enumerate(images):
-        image.save(os.path.join(VISUALIZATION_FILE, base_name, f"{base_name}_{i}.png"), )
+    return boxes_by_page
 
 
 def get_associated_pdf(xml_path: str) -> str:
@@ -126,6 +179,104 @@ def get_position_of_target_in_sequence(target: str, sequence: str, last_occurren
     return results['locations'][occurrence]
 
 
+# Alignment over the whole sequence, number of aligned chars and time spent in Edlib are added to alignment_stats
+def get_position_of_target_in_sequence_timed(target: str, sequence: str, last_occurrence: bool,
+                                             alignment_stats: dict) -> tuple[int, int]:
+    time_start = time.time()
+    location: tuple[int, int] = get_position_of_target_in_sequence(target, sequence, last_occurrence)
+    alignment_stats["aligned_chars"] += len(sequence)
+    alignment_stats["alignment_time"] += time.time() - time_start
+
+    return location
+
+
+# Maps chars that are equal for Edlib (ADDIDIONAL_EQUALITIES) to a single representative, so exact search agrees with Edlib
+def get_equalities_translation_table() -> dict[int, str]:
+    representatives: dict[str, str] = {}
+    for a, b in ADDIDIONAL_EQUALITIES:
+        representative_a = representatives.get(a, a)
+        representative_b = representatives.get(b, b)
+        if representative_a == representative_b:
+            continue
+        for char, representative in list(representatives.items()):
+            if representative == representative_b:
+                representatives[char] = representative_a
+        representatives[a] = representative_a
+        representatives[b] = representative_a
+
+    return str.maketrans(representatives)
+
+
+# Finds the target in the sequence by aligning only small windows around positions where k-mers of the target occur.
+# Non-overlapping seeds are used, so (pigeonhole principle) any match with fewer edits than there are seeds contains at
+# least one exact seed. If the best match is not guaranteed to be found that way, we align over the whole sequence.
+# Number of aligned chars and time spent in Edlib are added to alignment_stats.
+def get_position_of_target_in_sequence_seeded(target: str, sequence: str, last_occurrence: bool = False,
+                                               alignment_stats: dict = None) -> tuple[int, int]:
+    alignment_stats = alignment_stats if alignment_stats is not None else {}
+    alignment_stats.setdefault("aligned_chars", 0)
+    alignment_stats.setdefault("alignment_time", 0.0)
+
+    translation_table = get_equalities_translation_table()
+    seeded_target: str = target.translate(translation_table)
+    seeded_sequence: str = sequence.translate(translation_table)
+
+    seed_offsets: list[int] = list(range(0, len(seeded_target) - SESSION_SEED_LENGTH + 1, SESSION_SEED_LENGTH))
+    margin: int = max(len(target) // 2, SESSION_SEED_LENGTH)
+
+    # Collect windows around candidate positions of the target
+    windows: list[tuple[int, int]] = []
+    for seed_offset in seed_offsets:
+        seed: str = seeded_target[seed_offset:seed_offset + SESSION_SEED_LENGTH]
+        position: int = seeded_sequence.find(seed)
+        while position != -1:
+            candidate_start: int = position - seed_offset
+            windows.append((max(candidate_start - margin, 0),
+                            min(candidate_start + len(target) + margin, len(sequence))))
+            position = seeded_sequence.find(seed, position + 1)
+
+    # Merge overlapping windows
+    merged_windows: list[list[int]] = []
+    for window_start, window_end in sorted(windows):
+        if merged_windows and window_start <= merged_windows[-1][1]:
+            merged_windows[-1][1] = max(merged_windows[-1][1], window_end)
+        else:
+            merged_windows.append([window_start, window_end])
+
+    # Seeding does not help if the windows cover most of the sequence
+    if not merged_windows or sum(end - start for start, end in merged_windows) > len(sequence) // 2:
+        return get_position_of_target_in_sequence_timed(target, sequence, last_occurrence, alignment_stats)
+
+    best_distance: int = -1
+    best_locations: list[tuple[int, int]] = []
+    time_start = time.time()
+    for window_start, window_end in merged_windows:
+        results: dict = edlib.align(
+            target,
+            sequence[window_start:window_end],
+            task="path",
+            mode="HW",
+            additionalEqualities=ADDIDIONAL_EQUALITIES
+        )
+
+        if best_distance == -1 or results['editDistance'] < best_distance:
+            best_distance = results['editDistance']
+            best_locations = []
+        if results['editDistance'] == best_distance:
+            best_locations.extend((window_start + start, window_start + end) for start, end in results['locations'])
+    alignment_stats["aligned_chars"] += sum(end - start for start, end in merged_windows)
+    alignment_stats["alignment_time"] += time.time() - time_start
+
+    # The best match is guaranteed only if it has fewer edits than seeds and it fits into the margin
+    if best_distance >= len(seed_offsets) or best_distance > margin:
+        return get_position_of_target_in_sequence_timed(target, sequence, last_occurrence, alignment_stats)
+
+    best_locations.sort(key=lambda location: location[1])
+    occurrence = 0 if not last_occurrence else -1
+
+    return best_locations[occurrence]
+
+
 def get_chars_from_pdf(pdf_path: str) -> list[dict]:
     pdf_chars: list[dict] = []
 
@@ -159,8 +310,30 @@ def get_session_content(pdf_chars: list[dict], session_start_str: str, session_e
     sequence: str = "".join([char['text'] for char in pdf_chars])
     sequence = re.sub(r'\s+', '', sequence)
 
-    session_start_idx: int = get_position_of_target_in_sequence(session_start_str, sequence)[0]
-    session_end_idx: int = get_position_of_target_in_sequence(session_end_str, sequence, last_occurrence=True)[1]
+    time_start = time.time()
+    alignment_stats: dict = {}
+    session_start_idx: int = get_position_of_target_in_sequence_seeded(session_start_str, sequence,
+                                                                       alignment_stats=alignment_stats)[0]
+    session_end_idx: int = get_position_of_target_in_sequence_seeded(session_end_str, sequence, last_occurrence=True,
+                                                                     alignment_stats=alignment_stats)[1]
+    time_seeded = time.time() - time_start
+
+    # Edlib time grows linearly with the length of the aligned text, so alignment of both notes over the whole PDF
+    # would take about alignment_time * (2 * len(sequence)) / aligned_chars
+    aligned_chars: int = max(alignment_stats["aligned_chars"], 1)
+    time_full_estimate = alignment_stats["alignment_time"] * 2 * len(sequence) / aligned_chars
+    print(f"get_session_content(): Found session start and end in {time_seeded} seconds, aligned "
+          f"{alignment_stats['aligned_chars']} of {2 * len(sequence)} chars, "
+          f"estimated {time_full_estimate - time_seeded} seconds saved")
+
+    if COMPARE_SESSION_BOUNDARIES:
+        time_start = time.time()
+        full_start_idx: int = get_position_of_target_in_sequence(session_start_str, sequence)[0]
+        full_end_idx: int = get_position_of_target_in_sequence(session_end_str, sequence, last_occurrence=True)[1]
+        time_full = time.time() - time_start
+        print(f"get_session_content(): Alignment over whole PDF took {time_full} seconds, "
+              f"saved {time_full - time_seeded} seconds, "
+              f"same result: {(full_start_idx, full_end_idx) == (session_start_idx, session_end_idx)}")
 
     # Necessary parameters for filtering out the session content
     first_page: int = pdf_chars[session_start_idx]['page_number']
@@ -237,8 +410,12 @@ def align_pdf_with_xml(xml_sentences: list[ET.Element], pdf_chars: list[dict]) -
     return filtered_pdf_chars
 
 
-# Adds coordinates to the xml element
-def add_metadata(xml_element: ET.Element, pdf_chars: list[dict]) -> None:
+# Adds coordinates to the xml element (or to word_boxes, if coordinates are written into the sidecar file)
+def add_metadata(xml_element: ET.Element, pdf_chars: list[dict], word_boxes: dict = None) -> None:
+    if word_boxes is not None:
+        add_word_boxes(xml_element, pdf_chars, word_boxes)
+        return
+
     coord_counter: int = 0
     for i, char in enumerate(pdf_chars):
         if i == 0:
@@ -268,8 +445,35 @@ def add_metadata(xml_element: ET.Element, pdf_chars: list[dict]) -> None:
             xml_element.set('toPage', str(char['page_number'] - 1))
 
 
+# Stores rectangles (page, x0, y0, x1, y1) of the word into word_boxes, they are written into the coordinates
+# sidecar file instead of XML attributes (same rectangles as the x0/y0/x1/y1... attributes). Pages stay in the XML,
+# they also mark words whose coordinates are in the sidecar file.
+def add_word_boxes(xml_element: ET.Element, pdf_chars: list[dict], word_boxes: dict[str, list[tuple]]) -> None:
+    word_id: str = xml_element.attrib.get(XML_ID)
+    if not pdf_chars or word_id is None:
+        return
+
+    from_page: int = pdf_chars[0]['page_number'] - 1
+    to_page: int = pdf_chars[-1]['page_number'] - 1
+    xml_element.set('fromPage', str(from_page))
+    xml_element.set('toPage', str(to_page))
+
+    points: list[tuple[float, float]] = [(pdf_chars[0]['x0'], pdf_chars[0]['top'])]
+    for char, next_char in zip(pdf_chars, pdf_chars[1:]):
+        if abs(int(char['bottom']) - int(next_char['bottom'])) >= 4:
+            # end of previous part of the word and start of new part of the word
+            points.append((char['x1'], char['bottom']))
+            points.append((next_char['x0'], next_char['top']))
+    points.append((pdf_chars[-1]['x1'], pdf_chars[-1]['bottom']))
+
+    word_boxes[word_id] = [
+        (from_page if i == 0 else to_page, round(x0, 2), round(y0, 2), round(x1, 2), round(y1, 2))
+        for i, ((x0, y0), (x1, y1)) in enumerate(zip(points[::2], points[1::2]))
+    ]
+
+
 # Extracts coordinates for each word in a sentence
-def parse_words(pdf_chars: list[dict], xml_sentence: ET.Element):
+def parse_words(pdf_chars: list[dict], xml_sentence: ET.Element, word_boxes: dict = None):
     elements_in_sentence: list[ET.Element] = get_elements_by_tags(xml_sentence, {WORD_TAG, PUNCTUATION_TAG})
 
     sequence: str = "".join([re.sub(r'\s+', '', char["text"]) for char in pdf_chars])
@@ -319,7 +523,7 @@ def parse_words(pdf_chars: list[dict], xml_sentence: ET.Element):
                 f"Target: {target: <25} Best match: {sequence[best_match_start:best_match_end + 1]: <25} Similarity: {similarity_curr:.2f}")
 
         # Add coordinates to xml element
-        add_metadata(xml_element, pdf_chars[best_match_start:best_match_end + 1])
+        add_metadata(xml_element, pdf_chars[best_match_start:best_match_end + 1], word_boxes)
 
 
 def parse_record(xml_path: str, pdf_path: str) -> None:
@@ -358,6 +562,9 @@ def parse_record(xml_path: str, pdf_path: str) -> None:
     # Add the coordinates to the XML content
     print("parse_record(): Adding metadata to XML")
 
+    # Coordinates of words, if they are written into the sidecar file
+    word_boxes: dict = {} if WRITE_COORDINATES_TO_SIDECAR else None
+
     best_match_end: int = 0
     search_area_start: int = 0
     sequence: str = "".join([char['text'] for char in session_pdf_content])
@@ -399,14 +606,16 @@ def parse_record(xml_path: str, pdf_path: str) -> None:
         if xml_element.tag == NOTE_TAG:
             continue
 
-        parse_words(session_pdf_content[best_match_start:best_match_end + 1], xml_element)
+        parse_words(session_pdf_content[best_match_start:best_match_end + 1], xml_element, word_boxes)
 
     # Save the updated XML content
     save_xml_tree(xml_tree, os.path.join(OUTPUT_FILE, os.path.basename(xml_path)))
+    if word_boxes is not None:
+        write_coords_sidecar(word_boxes, get_coords_sidecar_path(os.path.join(OUTPUT_FILE, os.path.basename(xml_path))))
 
     if VISUALIZE_COORDINATES_FROM_XML:
         print("parse_record(): Visualizing coordinates")
-        visualize_xml(xml_root, xml_path, pdf_path)
+        visualize_xml(xml_root, xml_path, pdf_path, word_boxes)
 
 
 def main() -> None:
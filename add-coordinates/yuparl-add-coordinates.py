@@ -1,5 +1,7 @@
 import os
+import random
 import re
+import sys
 import time
 import xml.etree.ElementTree as ET
 from typing import Callable
@@ -9,6 +11,10 @@ from cyrtranslit import to_latin, to_cyrillic
 
 import pdfplumber
 
+# utils (coordinates sidecar file) is in the parent directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import get_coords_sidecar_path, write_coords_sidecar
+
 PATH_TO_XML_FILES = "/home/davidlocal/raw-data/yu1Parl.TEI.ana"
 PATH_TO_PDF_FILES = "/home/davidlocal/raw-data/yu1Parl-source"
 PATH_TO_WORD_FILES = "/home/davidlocal/raw-data/yu1Parl-source"
@@ -17,6 +23,10 @@ OUTPUT_FILE = "/home/davidlocal/raw-data/yuparl-xml-enriched"
 # Set to True if you want to visualize the coordinates on the PDF and save the images into a folder
 VISUALIZE_COORDINATES_FROM_XML = True
 VISUALIZATION_FILE = "/home/davidlocal/raw-data/yuparl-visualizations"
+# Pages (0-based) that are always rendered, even if there are no coordinates on them
+VISUALIZATION_PAGES: list[int] = []
+# Set to number of pages if you want to render only a random sample of pages with coordinates (for QA)
+VISUALIZATION_SAMPLE_SIZE = -1  # set to -1 if you want to render all pages with coordinates
 
 SKIP_FILES_TO = 0  # set to 0 if you want to convert all files
 MAX_FILES = -1  # set to -1 if you want to convert all files
@@ -25,9 +35,14 @@ MAX_FILES = -1  # set to -1 if you want to convert all files
 # Target -> word from the xml; Best match -> word from the pdf; Similarity -> similarity between the two words
 PRINT_ALIGNMENT = False
 
+# Set to True if you want to write the coordinates into a binary sidecar file next to the XML (read by the parsers)
+# instead of x0/y0/x1/y1... attributes of the word elements
+WRITE_COORDINATES_TO_SIDECAR = False
+
 # Namespace
 TEI = "http://www.tei-c.org/ns/1.0"
 NAMESPACE = "http://www.w3.org/XML/1998/namespace"
+XML_ID = "{" + NAMESPACE + "}id"
 
 # Tags in the XML files
 SEGMENT_TAG = "{" + TEI + "}seg"
@@ -44,10 +59,7 @@ CHARACTERS_TO_REMOVE: set[str] = {'@', '#', '$', '^', '&', '*', '<', '>', '­'}
 SEQUENCE_OF_CHARS_TO_REMOVE = {'.', '-', '_'}
 
 
-def get_associated_pdf(xml_path: str) -> str:
-    xml_tree = ET.parse(xml_path)
-    xml_root: ET.Element = xml_tree.getroot()
-
+def get_associated_pdf(xml_root: ET.Element) -> str:
     pdf_title_element: ET.Element = xml_root.find(".//tei:title[@type='pdf']", {"tei": TEI})
 
     pdf_path: str = pdf_title_element.text.replace('../yu1Parl-source', PATH_TO_PDF_FILES)
@@ -55,15 +67,68 @@ def get_associated_pdf(xml_path: str) -> str:
     return pdf_path
 
 
-def get_elements_by_tags(root: ET.Element, wanted_tags: set[str]) -> list[ET.Element]:
-    elements = []
-    for child in root:
-        if child.tag in wanted_tags:
-            elements.append(child)
-        else:
-            elements.extend(get_elements_by_tags(child, wanted_tags))
+# Parses the XML only once, the tree is used to find associated PDF and then passed on to parse_record
+def load_record(xml_path: str) -> tuple[ET.ElementTree, str]:
+    time_start = time.time()
+
+    xml_tree: ET.ElementTree = ET.parse(xml_path)
+    pdf_path: str = get_associated_pdf(xml_tree.getroot())
+
+    time_end = time.time()
+    print(f"load_record(): Parsed XML in {time_end - time_start} seconds")
+
+    return xml_tree, pdf_path
+
+
+# Indexes the record in a single iterative pre-order pass:
+# 'tokens' - flat list of all w/pc elements in document order,
+# 'ranges' - for each seg/s/note the range [start, end) of its w/pc descendants in 'tokens',
+# 'segments' - top-most seg/note elements of the record,
+# 'segment_children' - for each segment its top-most s/note elements
+def build_element_index(xml_root: ET.Element) -> dict:
+    tokens: list[ET.Element] = []
+    ranges: dict[ET.Element, tuple[int, int]] = {}
+    segments: list[ET.Element] = []
+    segment_children: dict[ET.Element, list[ET.Element]] = {}
+
+    # (element, enclosing segment, is inside of sentence or note, is exiting the element)
+    stack: list[tuple[ET.Element, ET.Element, bool, bool]] = [(child, None, False, False) for child in
+                                                              reversed(xml_root)]
+    while stack:
+        element, segment, in_sentence, is_exit = stack.pop()
+
+        if is_exit:
+            ranges[element] = (ranges[element][0], len(tokens))
+            continue
+
+        if element.tag in {WORD_TAG, PUNCTUATION_TAG}:
+            tokens.append(element)
+            continue
+
+        if element.tag in {SEGMENT_TAG, SENTENCE_TAG, NOTE_TAG}:
+            ranges[element] = (len(tokens), len(tokens))
+            stack.append((element, segment, in_sentence, True))
 
-    return elements
+        if segment is None and element.tag in {SEGMENT_TAG, NOTE_TAG}:
+            segments.append(element)
+            segment_children[element] = []
+            segment = element
+        elif segment is not None and not in_sentence and element.tag in {SENTENCE_TAG, NOTE_TAG}:
+            segment_children[segment].append(element)
+            in_sentence = True
+
+        stack.extend((child, segment, in_sentence, False) for child in reversed(element))
+
+    return {"tokens": tokens, "ranges": ranges, "segments": segments, "segment_children": segment_children}
+
+
+# Returns w/pc elements of the seg/s/note element (whole record if element is None)
+def get_tokens(element_index: dict, element: ET.Element = None) -> list[ET.Element]:
+    if element is None:
+        return element_index["tokens"]
+
+    start, end = element_index["ranges"][element]
+    return element_index["tokens"][start:end]
 
 
 def get_chars_from_pdf(pdf_path: str) -> list[dict]:
@@ -106,6 +171,82 @@ def get_converter_function1(xml_sentence: ET.Element) -> Callable:
     return to_cyrillic
 
 
+# Cache of already transliterated units (single chars and digraphs like 'lj', 'nj', 'dž')
+TRANSLITERATION_CACHE: dict[tuple[Callable, str], str] = {}
+
+
+def transliterate_unit(unit: str, converter_function: Callable) -> str:
+    key = (converter_function, unit)
+    if key not in TRANSLITERATION_CACHE:
+        TRANSLITERATION_CACHE[key] = converter_function(unit, "sr")
+
+    return TRANSLITERATION_CACHE[key]
+
+
+# Transliterates the sequence only once and keeps the mapping between original and transliterated chars.
+# 'starts' maps original char index -> index in 'text' (has one extra entry for the end of the sequence),
+# 'origins' and 'ends' map index in 'text' -> first and last original char of the transliterated unit
+def normalize_sequence(sequence: str, converter_function: Callable) -> dict:
+    text_parts: list[str] = []
+    starts: list[int] = []
+    origins: list[int] = []
+    ends: list[int] = []
+
+    normalized_length: int = 0
+    i: int = 0
+    while i < len(sequence):
+        unit_length: int = 1
+        converted: str = transliterate_unit(sequence[i], converter_function)
+
+        # Digraphs are transliterated into a single char (e.g. 'lj' -> 'љ'), so they have to be kept together
+        if i + 1 < len(sequence):
+            converted_pair: str = transliterate_unit(sequence[i:i + 2], converter_function)
+            if len(converted_pair) < len(converted) + len(transliterate_unit(sequence[i + 1], converter_function)):
+                converted = converted_pair
+                unit_length = 2
+
+        starts.extend([normalized_length] * unit_length)
+        origins.extend([i] * len(converted))
+        ends.extend([i + unit_length - 1] * len(converted))
+        text_parts.append(converted)
+
+        normalized_length += len(converted)
+        i += unit_length
+
+    starts.append(normalized_length)
+
+    return {"text": "".join(text_parts), "starts": starts, "origins": origins, "ends": ends}
+
+
+# Aligns already transliterated target with the window sequence[start:end] of the normalized sequence.
+# Locations in the result are mapped back to original char positions relative to the start of the window.
+def align_in_window(normalized_target: str, normalized_sequence: dict, start: int, end: int, mode: str = "HW") -> dict:
+    # Same semantics as slicing the original sequence with sequence[start:end]
+    start, end, _ = slice(start, end).indices(len(normalized_sequence["starts"]) - 1)
+    end = max(start, end)
+
+    window_start: int = normalized_sequence["starts"][start]
+    window_end: int = normalized_sequence["starts"][end]
+
+    result = edlib.align(
+        normalized_target,
+        normalized_sequence["text"][window_start:window_end],
+        task="path", mode=mode,
+    )
+
+    origins: list[int] = normalized_sequence["origins"]
+    ends: list[int] = normalized_sequence["ends"]
+    result["locations"] = [
+        (
+            None if location_start is None else max(origins[window_start + location_start] - start, 0),
+            None if location_end is None else ends[window_start + location_end] - start,
+        )
+        for location_start, location_end in result["locations"]
+    ]
+
+    return result
+
+
 def save_xml_tree(xml_tree: ET.ElementTree, output_file: str) -> None:
     ET.register_namespace('', TEI)
     xml_tree.write(output_file, encoding='utf-8')
@@ -198,18 +339,52 @@ def is_duplicate_note_element(element: ET.Element) -> bool:
     return element.tag == NOTE_TAG and element.attrib.get("subtype") == "latin"
 
 
-def visualize_xml(xml_root: ET.Element, xml_path: str, pdf_path: str) -> None:
-    xml_elements = get_elements_by_tags(xml_root, {WORD_TAG, PUNCTUATION_TAG})
+def visualize_xml(element_index: dict, xml_path: str, pdf_path: str, word_boxes: dict = None) -> None:
+    xml_elements = get_tokens(element_index)
 
     base_name = os.path.basename(xml_path).replace('.tei.xml', '')
 
-    # Make a list of images of each page in the PDF
-    images = []
+    # Group rectangles by page first, so we only rasterize pages that are actually needed
+    if word_boxes is not None:
+        boxes_by_page: dict[int, list[tuple[float, float, float, float]]] = {}
+        for boxes_of_word in word_boxes.values():
+            for page, x0, y0, x1, y1 in boxes_of_word:
+                boxes_by_page.setdefault(page, []).append((x0, y0, x1, y1))
+    else:
+        boxes_by_page: dict[int, list[tuple[float, float, float, float]]] = get_boxes_by_page(xml_elements)
+
+    pages_to_render: list[int] = sorted(boxes_by_page.keys())
+    if VISUALIZATION_SAMPLE_SIZE != -1:
+        # Seeded with the file name, so the same pages are sampled on every run
+        pages_to_render = sorted(random.Random(base_name).sample(pages_to_render,
+                                                                 min(VISUALIZATION_SAMPLE_SIZE, len(pages_to_render))))
+    pages_to_render = sorted(set(pages_to_render) | set(VISUALIZATION_PAGES))
+
+    if not os.path.exists(os.path.join(VISUALIZATION_FILE, base_name)):
+        os.makedirs(os.path.join(VISUALIZATION_FILE, base_name))
+
+    # Render, draw and save one page at a time, so only one image is held in memory
     with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
-            images.append(page.to_image(resolution=150))
+        for page_num in pages_to_render:
+            if not 0 <= page_num < len(pdf.pages):
+                print(f"visualize_xml(): page {page_num} does not exist in '{pdf_path}'")
+                continue
+
+            pdf_page = pdf.pages[page_num]
+            image = pdf_page.to_image(resolution=150)
+            for box in boxes_by_page.get(page_num, []):
+                image.draw_rect(box, stroke_width=1)
+
+            image.save(os.path.join(VISUALIZATION_FILE, base_name, f"{base_name}_{page_num}.png"), )
+
+            del image
+            pdf_page.close()
+
+
+# Collects rectangles of the words in the XML and groups them by page
+def get_boxes_by_page(xml_elements: list[ET.Element]) -> dict[int, list[tuple[float, float, float, float]]]:
+    boxes_by_page: dict[int, list[tuple[float, float, float, float]]] = {}
 
-    # For each word in the XML draw a rectangle around it on the PDF
     for xml_element in xml_elements:
 
         # Skip elements that are considered as noise
@@ -227,21 +402,21 @@ def visualize_xml(xml_root: ET.Element, xml_path: str, pdf_path: str) -> None:
             for x0, y0, x1, y1 in zip(x_coords[::2], y_coords[::2], x_coords[1::2], y_coords[1::2]):
                 page_num = fromPage if i == 0 else toPage
 
-                images[page_num].draw_rect((x0, y0, x1, y1), stroke_width=1)
+                boxes_by_page.setdefault(page_num, []).append((x0, y0, x1, y1))
                 i += 1
         except:
             print(
                 f"visualize_xml(): COORD ERROR with word: '{xml_element.text}', {xml_element.attrib.get('{' + TEI + '}id')}")
 
-    # Save the images
-    if not os.path.exists(os.path.join(VISUALIZATION_FILE, base_name)):
-        os.makedirs(os.path.join(VISUALIZATION_FILE, base_name))
-    for i, image in enumerate(images):
-        image.save(os.path.join(VISUALIZATION_FILE, base_name, f"{base_name}_{i}.png"), )
+    return boxes_by_page
 
 
-# Adds coordinates to the xml element
-def add_metadata_to_word_element(xml_element: ET.Element, pdf_chars: list[dict]) -> None:
+# Adds coordinates to the xml element (or to word_boxes, if coordinates are written into the sidecar file)
+def add_metadata_to_word_element(xml_element: ET.Element, pdf_chars: list[dict], word_boxes: dict = None) -> None:
+    if word_boxes is not None:
+        add_word_boxes(xml_element, pdf_chars, word_boxes)
+        return
+
     coord_counter: int = 0
 
     for i, char in enumerate(pdf_chars):
@@ -272,9 +447,38 @@ def add_metadata_to_word_element(xml_element: ET.Element, pdf_chars: list[dict])
             xml_element.set('toPage', str(char['page_number'] - 1))
 
 
-def parse_sentence(pdf_chars: list[dict], xml_sentence: ET.Element, converter_function: Callable) -> None:
-    xml_words: list[ET.Element] = get_elements_by_tags(xml_sentence, {WORD_TAG, PUNCTUATION_TAG})
+# Stores rectangles (page, x0, y0, x1, y1) of the word into word_boxes, they are written into the coordinates
+# sidecar file instead of XML attributes (same rectangles as the x0/y0/x1/y1... attributes). Pages stay in the XML,
+# they also mark words whose coordinates are in the sidecar file.
+def add_word_boxes(xml_element: ET.Element, pdf_chars: list[dict], word_boxes: dict[str, list[tuple]]) -> None:
+    word_id: str = xml_element.attrib.get(XML_ID)
+    if not pdf_chars or word_id is None:
+        return
+
+    from_page: int = pdf_chars[0]['page_number'] - 1
+    to_page: int = pdf_chars[-1]['page_number'] - 1
+    xml_element.set('fromPage', str(from_page))
+    xml_element.set('toPage', str(to_page))
+
+    points: list[tuple[float, float]] = [(pdf_chars[0]['x0'], pdf_chars[0]['top'])]
+    for char, next_char in zip(pdf_chars, pdf_chars[1:]):
+        if abs(int(char['bottom']) - int(next_char['bottom'])) >= 4:
+            # end of previous part of the word and start of new part of the word
+            points.append((char['x1'], char['bottom']))
+            points.append((next_char['x0'], next_char['top']))
+    points.append((pdf_chars[-1]['x1'], pdf_chars[-1]['bottom']))
+
+    word_boxes[word_id] = [
+        (from_page if i == 0 else to_page, round(x0, 2), round(y0, 2), round(x1, 2), round(y1, 2))
+        for i, ((x0, y0), (x1, y1)) in enumerate(zip(points[::2], points[1::2]))
+    ]
+
+
+def parse_sentence(pdf_chars: list[dict], xml_sentence: ET.Element, converter_function: Callable,
+                   element_index: dict, word_boxes: dict = None) -> None:
+    xml_words: list[ET.Element] = get_tokens(element_index, xml_sentence)
     sequence: str = "".join([char['text'] for char in pdf_chars])
+    normalized_sequence: dict = normalize_sequence(sequence, converter_function)
 
     # Define search area window
     search_from: int = 0
@@ -284,6 +488,7 @@ def parse_sentence(pdf_chars: list[dict], xml_sentence: ET.Element, converter_fu
     for i, xml_word in enumerate(xml_words):
 
         target: str = re.sub(r'\s+|\t|\n|\r', '', get_text_from_element(xml_word))
+        normalized_target: str = converter_function(target, "sr")
 
         similarity_curr: float = 0
         similarity_prev: float = -1
@@ -300,16 +505,9 @@ def parse_sentence(pdf_chars: list[dict], xml_sentence: ET.Element, converter_fu
             if resync:
                 search_area_end = -1
                 resync = False
-            search_area: str = sequence[search_area_start:search_area_end]
-
-
 
             # Perform alignment
-            result = edlib.align(
-                converter_function(target, "sr"),
-                converter_function(search_area, "sr"),
-                task="path", mode="HW",
-            )
+            result = align_in_window(normalized_target, normalized_sequence, search_area_start, search_area_end)
 
             # Update similarity values
             similarity_prev = similarity_curr
@@ -343,7 +541,7 @@ def parse_sentence(pdf_chars: list[dict], xml_sentence: ET.Element, converter_fu
         #     search_from -= (result['locations'][0][-1] + 1)
         #     continue
 
-        add_metadata_to_word_element(xml_word, pdf_chars[best_match_start: best_match_end])
+        add_metadata_to_word_element(xml_word, pdf_chars[best_match_start: best_match_end], word_boxes)
 
 
 """
@@ -434,8 +632,11 @@ def parse_segment(pdf_chars1: list[dict], xml_segment: ET.Element, converter_fun
 """
 
 
-def parse_segment(pdf_chars1: list[dict], xml_segment: ET.Element) -> None:
-    xml_senteces: list[ET.Element] = get_elements_by_tags(xml_segment, {SENTENCE_TAG, NOTE_TAG})
+# pdf_chars1 is a slice of the record chars that starts at 'offset', normalized_sequences holds the transliterated
+# record sequence for each converter function
+def parse_segment(pdf_chars1: list[dict], xml_segment: ET.Element, element_index: dict,
+                  normalized_sequences: dict[Callable, dict], offset: int, word_boxes: dict = None) -> None:
+    xml_senteces: list[ET.Element] = element_index["segment_children"][xml_segment]
     sequence: str = "".join([c['text'] for c in pdf_chars1])
 
     # Define search area window
@@ -448,6 +649,9 @@ def parse_segment(pdf_chars1: list[dict], xml_segment: ET.Element) -> None:
 
         target: str = re.sub(r'\s+|\t|\n|\r', '', get_text_from_element(xml_sentence))
 
+        converter_function: Callable = get_converter_function1(xml_sentence)
+        normalized_target: str = converter_function(target, "sr")
+
         similarity_curr: float = 0
         similarity_prev: float = -1
         BUFFER: int = min(max(len(target) // 3, 2), 40)
@@ -460,19 +664,13 @@ def parse_segment(pdf_chars1: list[dict], xml_segment: ET.Element) -> None:
             # adjust searching area while searching for the target sentence
             search_area_start: int = search_from
             search_area_end: int = min(search_area_start + len(target) + BUFFER, len(pdf_chars1))
-            search_area: str = sequence[search_area_start:search_area_end]
 
             is_sentence_on_one_page = len(
                 {char['page_number'] for char in pdf_chars1[search_area_start:search_area_end]}) == 1
 
-            converter_function: Callable = get_converter_function1(xml_sentence)
-
             # Perform alignment
-            result = edlib.align(
-                converter_function(target, "sr"),
-                converter_function(search_area, "sr"),
-                task="path", mode="HW",
-            )
+            result = align_in_window(normalized_target, normalized_sequences[converter_function],
+                                     offset + search_area_start, offset + search_area_end)
 
             # Update similarity values
             similarity_prev = similarity_curr
@@ -494,7 +692,7 @@ def parse_segment(pdf_chars1: list[dict], xml_segment: ET.Element) -> None:
             s_id = xml_sentence.attrib[
                 "{" + NAMESPACE + "}id"] if "{" + NAMESPACE + "}id" in xml_sentence.attrib else "note"
             print("Sn_idx:", i, "Sn_id:", s_id)
-            print("Src_a:", search_area)
+            print("Src_a:", sequence[search_area_start:search_area_end])
             print("Targt:", target)
 
         # Skip note tags and sentence elements with no children (invalid elements)
@@ -520,19 +718,19 @@ def parse_segment(pdf_chars1: list[dict], xml_segment: ET.Element) -> None:
         if PRINT_ALIGNMENT:
             print("Match2:", "".join([c["text"] for c in cleared_pdf_chars]))
 
-        parse_sentence(cleared_pdf_chars, xml_sentence, converter_function)
+        parse_sentence(cleared_pdf_chars, xml_sentence, converter_function, element_index, word_boxes)
 
         if PRINT_ALIGNMENT:
             print()
 
 
-def parse_record(xml_path: str, pdf_path: str) -> None:
-    xml_tree: ET.ElementTree = ET.parse(xml_path)
+def parse_record(xml_path: str, xml_tree: ET.ElementTree, pdf_path: str) -> None:
     xml_root: ET.Element = xml_tree.getroot()
 
     # 1. Get segments from XML
     print("parse_record(): Getting segments from XML")
-    xml_segments: list[ET.Element] = get_elements_by_tags(xml_root, {SEGMENT_TAG, NOTE_TAG})
+    element_index: dict = build_element_index(xml_root)
+    xml_segments: list[ET.Element] = element_index["segments"]
     # 1.1. Remove duplicate note elements
     xml_segments = [element for element in xml_segments if not is_duplicate_note_element(element)]
 
@@ -547,6 +745,15 @@ def parse_record(xml_path: str, pdf_path: str) -> None:
     print("parse_record(): Parsing segments")
     sequence: str = "".join([char['text'] for char in pdf_chars])
 
+    # 4.1. Transliterate the whole sequence once for each script direction
+    normalized_sequences: dict[Callable, dict] = {
+        to_latin: normalize_sequence(sequence, to_latin),
+        to_cyrillic: normalize_sequence(sequence, to_cyrillic),
+    }
+
+    # Coordinates of words, if they are written into the sidecar file
+    word_boxes: dict = {} if WRITE_COORDINATES_TO_SIDECAR else None
+
     # Define search area window
     search_from: int = 0
 
@@ -566,20 +773,16 @@ def parse_record(xml_path: str, pdf_path: str) -> None:
             resync = False
 
         if i < 3:
-            search_area: str = sequence
+            search_area_start = 0
+            search_area_end = len(sequence)
             search_from = 0
-        else:
-            search_area: str = sequence[search_area_start:search_area_end]
 
         segment_sentences: list[ET.Element] = xml_segment.findall(".//tei:s", {"tei": TEI})
         converter_function: Callable = get_converter_function(segment_sentences)
 
         # Perform alignment
-        result = edlib.align(
-            converter_function(target, "sr"),
-            converter_function(search_area, "sr"),
-            task="path", mode="HW",
-        )
+        result = align_in_window(converter_function(target, "sr"), normalized_sequences[converter_function],
+                                 search_area_start, search_area_end)
 
         similarity: float = 1 - result["editDistance"] / len(target)
 
@@ -611,22 +814,27 @@ def parse_record(xml_path: str, pdf_path: str) -> None:
             print()
 
         if similarity < 0.99:
+            segment_slice_start: int = max(segment_start - min(41, len(target) // 2), 0)
             parse_segment(pdf_chars[
-                          max(segment_start - min(41, len(target) // 2), 0): min(
+                          segment_slice_start: min(
                               segment_end + min(41, len(target) // 2),
                               len(pdf_chars))], xml_segment,
+                          element_index, normalized_sequences, segment_slice_start, word_boxes
                           )
         else:
-            parse_segment(pdf_chars[segment_start: segment_end], xml_segment)
+            parse_segment(pdf_chars[segment_start: segment_end], xml_segment, element_index, normalized_sequences,
+                          segment_start, word_boxes)
 
     # Save the updated XML content
     if not os.path.exists(OUTPUT_FILE):
         os.makedirs(OUTPUT_FILE)
     save_xml_tree(xml_tree, os.path.join(OUTPUT_FILE, os.path.basename(xml_path)))
+    if word_boxes is not None:
+        write_coords_sidecar(word_boxes, get_coords_sidecar_path(os.path.join(OUTPUT_FILE, os.path.basename(xml_path))))
 
     if VISUALIZE_COORDINATES_FROM_XML:
         print("parse_record(): Visualizing coordinates")
-        visualize_xml(xml_root, xml_path, pdf_path)
+        visualize_xml(element_index, xml_path, pdf_path, word_boxes)
 
 
 def main() -> None:
@@ -651,10 +859,10 @@ def main() -> None:
             continue
 
         print(f"Processing file: {xml_file}")
-        pdf_path: str = get_associated_pdf(xml_path)
+        xml_tree, pdf_path = load_record(xml_path)
 
         time_start = time.time()
-        parse_record(xml_path, pdf_path)
+        parse_record(xml_path, xml_tree, pdf_path)
         time_end = time.time()
 
         print(f"Time taken: {time_end - time_start} seconds")
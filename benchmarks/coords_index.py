@@ -0,0 +1,99 @@
+# Benchmark of utils.build_coords_index on the largest DZK XML file in the source directory.
+# Usage: python -m benchmarks.coords_index -s <directory with DZK XML files with coordinates>
+import argparse
+import os
+import time
+import xml.etree.ElementTree as ET
+
+from utils import build_coords_index, coordinates_to_dicts
+
+NAMESPACE_MAPPINGS = {"ns0": "http://www.tei-c.org/ns/1.0",
+                      "xml": "http://www.w3.org/XML/1998/namespace"}
+
+
+# previous implementation (two findall passes, attribute scans and a dict per box), used as a baseline
+def legacy_parse_coordinates(element):
+    coordinates = []
+
+    try:
+        from_page = int(element.get("fromPage"))
+        to_page = int(element.get("toPage"))
+        x_coords = [float(element.attrib.get(key)) for key in element.attrib.keys() if key.startswith("x")]
+        y_coords = [float(element.attrib.get(key)) for key in element.attrib.keys() if key.startswith("y")]
+        coords = list(zip(x_coords, y_coords))
+
+        for i in range(0, len(coords), 2):
+            rect_coords = coords[i:i + 2]
+            x0, y0 = rect_coords[0]
+            x1, y1 = rect_coords[1]
+
+            coordinates.append({
+                "page": from_page if from_page == to_page else (from_page if i == 0 else to_page),
+                "x0": x0,
+                "y0": y0,
+                "x1": x1,
+                "y1": y1
+            })
+    except Exception:
+        return []
+
+    return coordinates
+
+
+def legacy_build_coords_index(xml_root, namespace_mappings):
+    id_to_coords = {}
+    for tag in ("w", "pc"):
+        for el in xml_root.findall(f".//ns0:{tag}", namespace_mappings):
+            eid = el.attrib.get("{http://www.w3.org/XML/1998/namespace}id") or el.attrib.get("id")
+            if not eid:
+                continue
+            coords = legacy_parse_coordinates(el)
+            if coords:
+                id_to_coords[eid] = coords
+    return id_to_coords
+
+
+def get_largest_file(source):
+    files = [file for file in os.listdir(source) if file.endswith(".xml") and file.startswith("DezelniZborKranjski")]
+    if not files:
+        raise FileNotFoundError(f"No DZK XML files found in '{source}'")
+
+    return max(files, key=lambda file: os.path.getsize(os.path.join(source, file)))
+
+
+def time_function(function, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        time_start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - time_start)
+
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of building the coordinates index")
+    parser.add_argument('-s', '--source', type=str, required=True, help='Directory containing DZK XML files')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Number of repetitions (best time is reported)')
+    args = parser.parse_args()
+
+    file = get_largest_file(args.source)
+    path = os.path.join(args.source, file)
+    xml_root = ET.parse(path).getroot()
+
+    legacy_time, legacy_index = time_function(lambda: legacy_build_coords_index(xml_root, NAMESPACE_MAPPINGS),
+                                              args.repeat)
+    new_time, new_index = time_function(lambda: build_coords_index(xml_root, NAMESPACE_MAPPINGS), args.repeat)
+
+    number_of_boxes = sum(len(coords) for coords in new_index.values())
+    print(f"file: {file} ({os.path.getsize(path) / 1024 / 1024:.1f} MB)")
+    print(f"words with coordinates: {len(new_index)}, boxes: {number_of_boxes}")
+    print(f"legacy build_coords_index: {legacy_time:.3f} s")
+    print(f"build_coords_index:        {new_time:.3f} s ({legacy_time / new_time:.1f}x)")
+    same_coordinates = legacy_index == {eid: coordinates_to_dicts(coords) for eid, coords in new_index.items()}
+    print(f"same coordinates as legacy: {same_coordinates}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# Speed and output lengths of translation decoding profiles (DECODING_PROFILES in utils) on sentences from DZK XML
+# files. For every profile the same sentences are translated with the translator of parser_dzk (its cache is emptied
+# before each run), reported are output tokens/s, sentences/s and the distribution of output lengths (in tokens), outputs
+# that reached max_new_tokens of the longest source are counted as truncated.
+# Usage: python -m benchmarks.decoding_profiles -s <directory with DZK XML files> [-n <max sentences>] [-o <results>]
+import argparse
+import json
+import time
+
+import parser_dzk
+from benchmarks.tiered_translation import NLLB_TARGETS, load_sentences
+from instrumentation import percentile
+from utils import DECODING_PROFILES, ensure_translation_model_loaded, get_decoding_arguments, translate_sentences
+
+
+def count_tokens(texts):
+    return [len(input_ids) for input_ids in parser_dzk.translator["tokenizer"](texts)["input_ids"]]
+
+
+def run(sentences, profile_name):
+    parser_dzk.translator["decoding_profile"] = profile_name
+    parser_dzk.translator["cache"].clear()
+
+    translations = []
+    time_start = time.perf_counter()
+    for lang, texts in sentences.items():
+        translations.extend(translate_sentences(parser_dzk.translator, texts, *NLLB_TARGETS[lang]))
+    elapsed_time = time.perf_counter() - time_start
+
+    source_lengths = [length for texts in sentences.values() for length in count_tokens(texts)]
+    output_lengths = count_tokens(translations)
+    truncated = sum(output_length >= get_decoding_arguments(profile_name, max(source_lengths))["max_new_tokens"]
+                    for output_length in output_lengths)
+
+    return {
+        "time_s": round(elapsed_time, 3),
+        "sentences_per_s": round(len(translations) / max(elapsed_time, 1e-9), 2),
+        "tokens_per_s": round(sum(output_lengths) / max(elapsed_time, 1e-9), 1),
+        "output_tokens_p50": percentile(output_lengths, 50),
+        "output_tokens_p95": percentile(output_lengths, 95),
+        "output_tokens_max": max(output_lengths, default=0),
+        "output_source_ratio": round(sum(output_lengths) / max(sum(source_lengths), 1), 3),
+        "truncated": truncated
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of translation decoding profiles")
+    parser.add_argument('-s', '--source', type=str, required=True, help='Directory containing DZK XML files')
+    parser.add_argument('-n', '--max-sentences', type=int, default=500, help='Maximum number of sentences')
+    parser.add_argument('-o', '--output', type=str, default=None, help='Results file (JSON)')
+    args = parser.parse_args()
+
+    sentences = load_sentences(args.source, args.max_sentences)
+    print(f"{sum(len(texts) for texts in sentences.values())} sentences")
+
+    # model is loaded before measuring
+    ensure_translation_model_loaded(parser_dzk.translator)
+
+    results = {profile_name: run(sentences, profile_name) for profile_name in DECODING_PROFILES}
+
+    print(f"{'profile':<10}{'time s':>10}{'sent/s':>10}{'tok/s':>10}{'p50':>6}{'p95':>6}{'max':>6}{'ratio':>8}"
+          f"{'trunc':>7}")
+    for profile_name, result in results.items():
+        print(f"{profile_name:<10}{result['time_s']:>10.1f}{result['sentences_per_s']:>10.1f}"
+              f"{result['tokens_per_s']:>10.1f}{result['output_tokens_p50']:>6}{result['output_tokens_p95']:>6}"
+              f"{result['output_tokens_max']:>6}{result['output_source_ratio']:>8.2f}{result['truncated']:>7}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({"parameters": vars(args), "profiles": DECODING_PROFILES, "results": results}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+# Synthetic TEI meetings (in the shape of DZK XML files) and matching simple PDFs for benchmarks.
+# Words are laid out on PDF pages with a fixed-width approximation of Helvetica, the same layout is used for the
+# x0/y0/x1/y1 coordinates in the XML, so XML with coordinates and PDF describe the same text.
+import random
+import xml.etree.ElementTree as ET
+
+TEI = "http://www.tei-c.org/ns/1.0"
+XML_ID = "{http://www.w3.org/XML/1998/namespace}id"
+XML_LANG = "{http://www.w3.org/XML/1998/namespace}lang"
+
+SYLLABLES = ("ka", "ze", "lo", "mi", "ra", "ne", "po", "vi", "de", "sa", "to", "bu", "gre", "sta", "pri", "ver")
+PUNCTUATION = (",", ".", ";", ":")
+
+# page layout (in points, origin at the top left corner as in pdfplumber)
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+MARGIN = 50
+FONT_SIZE = 10
+CHAR_WIDTH = 5.5
+LINE_HEIGHT = 14
+
+# texts are ASCII only, so they can be written with the standard Helvetica font
+SESSION_START_TEXT = "Seja se pricne ob enajstih"
+SESSION_END_TEXT = "Seja se konca ob dveh"
+
+
+def random_word(rng):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 4)))
+
+
+# lays out the tokens line by line (a space is added before words, but not before punctuation) and returns
+# pages with lines of text and a (page, x0, y0, x1, y1) box for every token
+def layout_tokens(tokens):
+    pages = [[]]
+    boxes = []
+    line = ""
+    y = MARGIN
+    max_line_length = int((PAGE_WIDTH - 2 * MARGIN) / CHAR_WIDTH)
+
+    for text, is_word in tokens:
+        prefix = " " if is_word and line else ""
+        if len(line) + len(prefix) + len(text) > max_line_length:
+            pages[-1].append((y, line))
+            line, prefix = "", ""
+            y += LINE_HEIGHT
+            if y + LINE_HEIGHT > PAGE_HEIGHT - MARGIN:
+                pages.append([])
+                y = MARGIN
+
+        x0 = MARGIN + (len(line) + len(prefix)) * CHAR_WIDTH
+        boxes.append((len(pages) - 1, round(x0, 2), y, round(x0 + len(text) * CHAR_WIDTH, 2), y + FONT_SIZE))
+        line += prefix + text
+
+    pages[-1].append((y, line))
+    return pages, boxes
+
+
+def add_element(parent, tag, text=None, **attributes):
+    element = ET.SubElement(parent, "{" + TEI + "}" + tag, attributes)
+    element.text = text
+    return element
+
+
+# Generates a meeting with the given number of sentences. Returns the XML tree, PDF pages (see layout_tokens) and
+# the meeting dict as produced by the parser, with translation and lemmatization stubbed out (each sentence gets a
+# copy of the original as translation to the other language).
+def generate_meeting(meeting_index=0, number_of_sentences=1000, words_per_sentence=20, sentences_per_segment=5,
+                     with_coordinates=True, seed=0):
+    rng = random.Random(seed * 100003 + meeting_index)
+    day = meeting_index % 28 + 1
+    meeting_id = f"DezelniZborKranjski_1861-04-{day:02d}-{meeting_index:05d}"
+
+    root = ET.Element("{" + TEI + "}TEI", {XML_ID: meeting_id})
+    title_stmt = add_element(add_element(add_element(root, "teiHeader"), "fileDesc"), "titleStmt")
+    add_element(title_stmt, "title", f"Seja {meeting_index}", **{XML_LANG: "sl"})
+    add_element(title_stmt, "title", f"Sitzung {meeting_index}", **{XML_LANG: "de"})
+    debate_section = add_element(add_element(add_element(root, "text"), "body"), "div", type="debateSection")
+
+    # tokens in reading order: (text, is_word, element or None)
+    tokens = [(text, True, None) for text in SESSION_START_TEXT.split()]
+    add_element(debate_section, "note", SESSION_START_TEXT)
+    sentences = []
+
+    for segment_index in range(0, number_of_sentences, sentences_per_segment):
+        speaker = f"Poslanec {rng.randint(1, 40)}"
+        add_element(debate_section, "note", speaker, type="speaker")
+        tokens.extend((text, True, None) for text in speaker.split())
+
+        utterance = add_element(debate_section, "u")
+        segment_id = f"{meeting_id}.seg{segment_index // sentences_per_segment + 1}"
+        segment = add_element(utterance, "seg", **{XML_ID: segment_id})
+
+        for sentence_index in range(segment_index, min(segment_index + sentences_per_segment, number_of_sentences)):
+            lang = "sl" if rng.random() < 0.5 else "de"
+            sentence_id = f"{segment_id}.s{sentence_index + 1}"
+            xml_sentence = add_element(segment, "s", **{XML_ID: sentence_id, XML_LANG: lang})
+
+            words = []
+            for word_index in range(words_per_sentence):
+                is_last = word_index == words_per_sentence - 1
+                is_punctuation = is_last or rng.random() < 0.08
+                text = rng.choice(PUNCTUATION[-2:] if is_last else PUNCTUATION[:2]) if is_punctuation \
+                    else random_word(rng)
+                tag = "pc" if is_punctuation else "w"
+                upostag = "PUNCT" if is_punctuation else ("PROPN" if rng.random() < 0.05 else "NOUN")
+                word_id = f"{sentence_id}.{word_index + 1}"
+
+                element = add_element(xml_sentence, tag, text, **{XML_ID: word_id, "lemma": text.lower(),
+                                                                  "msd": f"UPosTag={upostag}|Case=Nom"})
+                # punctuation is joined to the previous word
+                if not is_last and rng.random() < 0.08:
+                    element.set("join", "right")
+                tokens.append((text, not is_punctuation, element))
+                words.append({"id": word_id, "type": tag, "lemma": text.lower(), "text": text,
+                              "join": element.get("join", "natural"), "propn": int(upostag == "PROPN")})
+
+            text = " ".join(word["text"] for word in words)
+            other_lang = "de" if lang == "sl" else "sl"
+            translated_words = [dict(word, id=f"{sentence_id}.{i + 1}.({other_lang})") for i, word in enumerate(words)]
+            sentences.append({
+                "id": sentence_id,
+                "segment_page": "0",
+                "segment_id": segment_id,
+                "speaker": speaker,
+                "original_language": lang,
+                "translations": [
+                    {"lang": lang, "speaker": speaker, "original": 1, "text": text, "words": words},
+                    {"lang": other_lang, "speaker": speaker, "original": 0, "text": text, "words": translated_words}
+                ]
+            })
+
+    add_element(debate_section, "note", SESSION_END_TEXT)
+    tokens.extend((text, True, None) for text in SESSION_END_TEXT.split())
+
+    pages, boxes = layout_tokens([(text, is_word) for text, is_word, _ in tokens])
+    if with_coordinates:
+        for (_, _, element), (page, x0, y0, x1, y1) in zip(tokens, boxes):
+            if element is not None:
+                element.attrib.update({"fromPage": str(page), "toPage": str(page), "x0": str(x0), "y0": str(y0),
+                                       "x1": str(x1), "y1": str(y1), "isBroken": "false"})
+
+    meeting = {
+        "id": meeting_id,
+        "date": f"{day:02d}.04.1861",
+        "titles": [{"title": f"Seja {meeting_index}", "lang": "sl"}, {"title": f"Sitzung {meeting_index}", "lang": "de"}],
+        "agendas": [],
+        "sentences": sentences,
+        "notes": [],
+        "corpus": "DZK"
+    }
+
+    return ET.ElementTree(root), pages, meeting
+
+
+def escape_pdf_text(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+# writes a minimal PDF (one Helvetica text line per layout line), readable by pdfplumber
+def write_pdf(pages, file_path):
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>"]
+    page_ids = []
+    for lines in pages:
+        content = "".join(f"BT /F1 {FONT_SIZE} Tf {MARGIN} {PAGE_HEIGHT - y - FONT_SIZE * 0.8:.2f} Td "
+                          f"({escape_pdf_text(line)}) Tj ET\n" for y, line in lines)
+        objects.append(f"<< /Length {len(content.encode('latin-1'))} >>\nstream\n{content}endstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        page_ids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(page_ids)} >>"
+
+    data = b"%PDF-1.4\n"
+    offsets = []
+    for i, obj in enumerate(objects):
+        offsets.append(len(data))
+        data += f"{i + 1} 0 obj\n{obj}\nendobj\n".encode("latin-1")
+
+    xref_offset = len(data)
+    data += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    data += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    data += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode("latin-1")
+
+    with open(file_path, "wb") as file:
+        file.write(data)
@@ -0,0 +1,110 @@
+# Benchmark of disk footprint and end-to-end parse→upload time of parsed JSONL files with different compressions.
+# Files from the source directory (output of `main.py parse`) are written with each compression the same way parse
+# does (save_to_jsonl), read back the same way the uploader does (open_jsonl, readlines) and uploaded with
+# upload_to_elasticsearch to a local mock of the Elasticsearch bulk endpoint. Without the elasticsearch package the
+# upload step only reads and decodes the files (json.loads). The total is the part of parse→upload time that depends on
+# the compression (writing, reading and uploading the files).
+# Usage: python -m benchmarks.jsonl_compression -s <directory with JSONL files> [-n <max files>]
+import argparse
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+from benchmarks.pipeline import start_mock_bulk_server
+from utils import JSONL_COMPRESSION_EXTENSIONS, open_jsonl, save_to_jsonl, strip_compression_extension, zstandard
+
+BENCHMARK_INDEX_NAME = "jsonl-compression-benchmark"
+
+
+def load_documents(source, max_files):
+    files = sorted(file for file in os.listdir(source) if strip_compression_extension(file).endswith(".jsonl"))
+    documents = {}
+    for file in files[:max_files]:
+        with open_jsonl(os.path.join(source, file), "rb") as jsonl_file:
+            documents[strip_compression_extension(file)] = [json.loads(line) for line in jsonl_file]
+
+    return documents
+
+
+# uploads the lines to the mock bulk endpoint, or only decodes them without elasticsearch (es is None)
+def upload_lines(es, lines, index_name):
+    if es is None:
+        for line in lines:
+            json.loads(line)
+        return
+
+    from uploader import upload_to_elasticsearch
+
+    # upload_to_elasticsearch prints a line per file
+    with redirect_stdout(io.StringIO()):
+        upload_to_elasticsearch(es, lines, index_name)
+
+
+def benchmark_compression(documents, compression, directory, es):
+    write_start = time.perf_counter()
+    paths = []
+    for file_name, elements in documents.items():
+        path = os.path.join(directory, file_name + JSONL_COMPRESSION_EXTENSIONS[compression])
+        save_to_jsonl(elements, path)
+        paths.append(path)
+    write_time = time.perf_counter() - write_start
+
+    disk_bytes = sum(os.path.getsize(path) for path in paths)
+
+    upload_start = time.perf_counter()
+    for path in paths:
+        with open_jsonl(path, "rb") as file:
+            lines = file.readlines()
+        upload_lines(es, lines, BENCHMARK_INDEX_NAME)
+    upload_time = time.perf_counter() - upload_start
+
+    return disk_bytes, write_time, upload_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of JSONL compression for parse and upload")
+    parser.add_argument('-s', '--source', type=str, required=True, help='Directory containing JSONL files')
+    parser.add_argument('-n', '--max-files', type=int, default=300, help='Maximum number of files to use')
+    args = parser.parse_args()
+
+    documents = load_documents(args.source, args.max_files)
+    compressions = [compression for compression in JSONL_COMPRESSION_EXTENSIONS
+                    if compression != "zstd" or zstandard is not None]
+
+    server = None
+    try:
+        from elasticsearch import Elasticsearch
+
+        server = start_mock_bulk_server()
+        es = Elasticsearch([{"host": "127.0.0.1", "port": server.server_address[1], "scheme": "http"}])
+    except ImportError as e:
+        print(f"elasticsearch could not be imported ({e}), files are only read and decoded instead of uploaded")
+        es = None
+
+    results = {}
+    try:
+        for compression in compressions:
+            directory = tempfile.mkdtemp(prefix=f"jsonl-{compression}-")
+            try:
+                results[compression] = benchmark_compression(documents, compression, directory, es)
+            finally:
+                shutil.rmtree(directory)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    plain_bytes = results["none"][0]
+    upload_column = "upload s" if es is not None else "read s"
+    print(f"\n{len(documents)} files, {sum(len(elements) for elements in documents.values())} documents")
+    print(f"{'compression':<12}{'disk MB':>10}{'ratio':>8}{'write s':>10}{upload_column:>10}{'total s':>10}")
+    for compression, (disk_bytes, write_time, upload_time) in results.items():
+        print(f"{compression:<12}{disk_bytes / 1024 / 1024:>10.2f}{plain_bytes / disk_bytes:>8.1f}"
+              f"{write_time:>10.2f}{upload_time:>10.2f}{write_time + upload_time:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
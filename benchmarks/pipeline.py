@@ -0,0 +1,213 @@
+# Benchmark of the parse, upload and add-coordinates stages in isolation on synthetic meetings (benchmarks/fixtures.py).
+# Translation and lemmatization are stubbed out (the fixture meeting already contains the stub translations), uploads
+# go to a local mock of the Elasticsearch bulk endpoint. Stages with missing dependencies are skipped and listed in
+# the results file, which can be compared between commits.
+# Usage: python -m benchmarks.pipeline [-n <sentences>] [-w <words per sentence>] [-r <repeat>] [-o <results.json>]
+import argparse
+import gzip
+import importlib.util
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ET
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.fixtures import generate_meeting, write_pdf
+from utils import build_coords_index, dump_jsonl_line, iter_transformed_words, save_meeting, \
+    transform_sentences_fast, transform_words_fast
+
+NAMESPACE_MAPPINGS = {"ns0": "http://www.tei-c.org/ns/1.0",
+                      "xml": "http://www.w3.org/XML/1998/namespace"}
+ADD_COORDINATES_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "add-coordinates",
+                                      "dzk-add-coordinates.py")
+
+
+# mock of the Elasticsearch bulk endpoint, every document is reported as created
+class BulkHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+
+        # every document has an action line and a source line
+        number_of_documents = len(body.splitlines()) // 2
+        items = [{"index": {"_id": str(i), "status": 201, "result": "created"}} for i in range(number_of_documents)]
+        self.send_json({"took": 1, "errors": False, "items": items})
+
+    # newer clients send bulk requests with PUT
+    do_PUT = do_POST
+
+    def do_GET(self):
+        self.send_json({"version": {"number": "8.0.0"}, "tagline": "You Know, for Search"})
+
+    def send_json(self, response):
+        data = json.dumps(response).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("X-Elastic-Product", "Elasticsearch")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_mock_bulk_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BulkHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# runs the function `repeat` times (output is suppressed) and returns timings of the stage
+def time_stage(function, repeat, number_of_items):
+    timings = []
+    for _ in range(repeat):
+        with redirect_stdout(io.StringIO()):
+            time_start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - time_start)
+
+    best_time = min(timings)
+    return {
+        "best_s": round(best_time, 6),
+        "mean_s": round(sum(timings) / len(timings), 6),
+        "repeat": repeat,
+        "items": number_of_items,
+        "items_per_s": round(number_of_items / max(best_time, 1e-9), 1)
+    }
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_add_coordinates_module():
+    spec = importlib.util.spec_from_file_location("dzk_add_coordinates", ADD_COORDINATES_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of pipeline stages on synthetic meetings")
+    parser.add_argument('-n', '--sentences', type=int, default=2000, help='Number of sentences in the meeting')
+    parser.add_argument('-w', '--words-per-sentence', type=int, default=20, help='Number of words per sentence')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Number of repetitions (best time is reported)')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='Seed of the synthetic meeting')
+    parser.add_argument('-o', '--output', type=str, default='benchmark_results.json', help='Results file (JSON)')
+    args = parser.parse_args()
+
+    xml_tree, pages, meeting = generate_meeting(number_of_sentences=args.sentences,
+                                                words_per_sentence=args.words_per_sentence, seed=args.seed)
+    number_of_sentences = len(meeting["sentences"])
+    number_of_words = sum(len(translation["words"]) for sentence in meeting["sentences"]
+                          for translation in sentence["translations"])
+
+    directory = tempfile.mkdtemp(prefix="benchmark-")
+    stages = {}
+    skipped = {}
+    try:
+        xml_path = os.path.join(directory, meeting["id"] + ".xml")
+        xml_tree.write(xml_path, encoding="utf-8")
+        xml_root = xml_tree.getroot()
+
+        stages["xml_parse"] = time_stage(lambda: ET.parse(xml_path), args.repeat, number_of_sentences)
+
+        # speech parsing is part of the parser, which needs spaCy models
+        try:
+            with redirect_stdout(io.StringIO()):
+                import parser_dzk
+            stages["speech_parse"] = time_stage(lambda: parser_dzk.parse_speeches(xml_root), args.repeat,
+                                                number_of_sentences)
+        except (ImportError, OSError) as e:
+            skipped["speech_parse"] = f"parser_dzk could not be imported: {e}"
+
+        coords_index = build_coords_index(xml_root, NAMESPACE_MAPPINGS)
+        stages["coords_index"] = time_stage(lambda: build_coords_index(xml_root, NAMESPACE_MAPPINGS), args.repeat,
+                                            len(coords_index))
+        stages["transform_sentences"] = time_stage(lambda: transform_sentences_fast(meeting, coords_index),
+                                                   args.repeat, number_of_sentences)
+        stages["transform_words"] = time_stage(lambda: transform_words_fast(meeting, coords_index), args.repeat,
+                                               number_of_words)
+
+        with redirect_stdout(io.StringIO()):
+            sentences = transform_sentences_fast(meeting, coords_index)
+        output_directory = os.path.join(directory, "output")
+        os.makedirs(output_directory)
+        stages["write"] = time_stage(
+            lambda: save_meeting(meeting, sentences, iter_transformed_words(meeting, coords_index), output_directory),
+            args.repeat, number_of_words)
+
+        # upload of words to the mock bulk endpoint
+        try:
+            from elasticsearch import Elasticsearch
+            from uploader import upload_to_elasticsearch
+
+            server = start_mock_bulk_server()
+            es = Elasticsearch([{"host": "127.0.0.1", "port": server.server_address[1], "scheme": "http"}])
+            words = [dump_jsonl_line(word) for word in iter_transformed_words(meeting, coords_index)]
+            stages["upload"] = time_stage(lambda: upload_to_elasticsearch(es, words, "words-index"), args.repeat,
+                                          len(words))
+            server.shutdown()
+        except ImportError as e:
+            skipped["upload"] = f"elasticsearch could not be imported: {e}"
+
+        # alignment of the XML without coordinates with the PDF (add-coordinates script)
+        try:
+            with redirect_stdout(io.StringIO()):
+                add_coordinates = load_add_coordinates_module()
+            add_coordinates.OUTPUT_FILE = output_directory
+            add_coordinates.VISUALIZE_COORDINATES_FROM_XML = False
+
+            plain_xml_tree, _, _ = generate_meeting(number_of_sentences=args.sentences,
+                                                    words_per_sentence=args.words_per_sentence,
+                                                    with_coordinates=False, seed=args.seed)
+            plain_xml_path = os.path.join(directory, "plain-" + meeting["id"] + ".xml")
+            plain_xml_tree.write(plain_xml_path, encoding="utf-8")
+            pdf_path = os.path.join(directory, meeting["id"] + ".pdf")
+            write_pdf(pages, pdf_path)
+
+            stages["add_coordinates"] = time_stage(lambda: add_coordinates.parse_record(plain_xml_path, pdf_path),
+                                                   args.repeat, len(coords_index))
+        except ImportError as e:
+            skipped["add_coordinates"] = f"add-coordinates dependencies could not be imported: {e}"
+    finally:
+        shutil.rmtree(directory)
+
+    results = {
+        "commit": get_git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "parameters": vars(args),
+        "sentences": number_of_sentences,
+        "words": number_of_words,
+        "stages": stages,
+        "skipped": skipped
+    }
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+
+    print(f"{number_of_sentences} sentences, {number_of_words} words (all translations)")
+    print(f"{'stage':<22}{'best s':>10}{'mean s':>10}{'items/s':>14}")
+    for name, stage in stages.items():
+        print(f"{name:<22}{stage['best_s']:>10.3f}{stage['mean_s']:>10.3f}{stage['items_per_s']:>14.1f}")
+    for name, reason in skipped.items():
+        print(f"{name:<22}skipped ({reason})")
+    print(f"results saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
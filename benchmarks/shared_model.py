@@ -0,0 +1,69 @@
+# Memory of parse worker processes with and without a shared translation model. In the "separate" mode every worker
+# loads its own model (as separate parse processes do), in the "shared" mode the model is loaded once before the
+# workers are forked (as `parse --workers`). Each worker translates the same sentences and reports RSS, PSS and private
+# memory, from which the number of workers that fit into the memory of a node is estimated.
+# Usage: python -m benchmarks.shared_model -m separate|shared [-w <workers>] [--node-memory-mb <MB>] [-o <results.json>]
+import argparse
+import json
+
+import instrumentation
+import parser_dzk
+from utils import prepare_model_for_workers, run_forked_workers, translate_sentences
+
+SENTENCES = [
+    "Die Sitzung ist eröffnet.",
+    "Der Herr Abgeordnete hat das Wort.",
+    "Ich bitte die Herren, welche dem Antrage zustimmen, sich zu erheben.",
+    "Der Antrag ist angenommen.",
+]
+
+
+# memory of the workers in the mode, the parent process is measured after the model is (or is not) loaded
+def measure_workers(mode, number_of_workers):
+    if mode == "shared":
+        prepare_model_for_workers(parser_dzk.translator)
+    parent_memory = instrumentation.get_memory_breakdown_mb()
+
+    def worker(worker_index):
+        translate_sentences(parser_dzk.translator, SENTENCES, "deu_Latn", "slv_Latn")
+        return instrumentation.get_memory_breakdown_mb()
+
+    return parent_memory, run_forked_workers(worker, number_of_workers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory of parse workers with and without a shared model")
+    parser.add_argument('-m', '--mode', type=str, required=True, choices=['separate', 'shared'],
+                        help='Model loading mode (run the modes in separate processes)')
+    parser.add_argument('-w', '--workers', type=int, default=3, help='Number of worker processes')
+    parser.add_argument('--node-memory-mb', type=int, default=16000, help='Memory of a node for the estimate')
+    parser.add_argument('-o', '--output', type=str, default=None, help='Results file (JSON)')
+    args = parser.parse_args()
+
+    parent_memory, workers_memory = measure_workers(args.mode, args.workers)
+    if parent_memory is None or None in workers_memory:
+        print("memory breakdown is not available (needs /proc/self/smaps_rollup)")
+        return
+
+    average_private = sum(memory["private_mb"] for memory in workers_memory) / len(workers_memory)
+    average_rss = sum(memory["rss_mb"] for memory in workers_memory) / len(workers_memory)
+    # shared pages are counted once (in the parent), each worker adds its private memory
+    if args.mode == "shared":
+        workers_per_node = int((args.node_memory_mb - parent_memory["rss_mb"]) // max(average_private, 1e-9))
+    else:
+        workers_per_node = int(args.node_memory_mb // max(average_rss, 1e-9))
+
+    print(f"mode: {args.mode}, parent: RSS {parent_memory['rss_mb']:.0f} MB")
+    print(f"{'worker':<8}{'RSS MB':>10}{'PSS MB':>10}{'private MB':>12}")
+    for worker_index, memory in enumerate(workers_memory):
+        print(f"{worker_index:<8}{memory['rss_mb']:>10.0f}{memory['pss_mb']:>10.0f}{memory['private_mb']:>12.0f}")
+    print(f"estimated workers per node with {args.node_memory_mb} MB: {workers_per_node}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({"mode": args.mode, "parameters": vars(args), "parent": parent_memory,
+                       "workers": workers_memory, "workers_per_node": workers_per_node}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
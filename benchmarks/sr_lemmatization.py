@@ -0,0 +1,88 @@
+# Comparison of Serbian lemmatization strategies of parser_yuparl (SR_LEMMATIZATION) on Serbian sentences from
+# yu1Parl XML files. Throughput is measured with batch_lemmatize on sentence texts (as in parse), accuracy is measured
+# on the tokens of the XML files against their lemmas (lemmas are compared in latin script, case insensitive).
+# Usage: python -m benchmarks.sr_lemmatization -s <directory with yu1Parl XML files> [-n <max sentences>]
+import argparse
+import os
+import time
+import xml.etree.ElementTree as ET
+
+import cyrtranslit
+from spacy.tokens import Doc
+
+import parser_yuparl
+from utils import parse_attribs, parse_tag
+
+STRATEGIES = ("transformer", "hr_transliterated")
+
+
+# returns texts and (token, lemma) pairs of Serbian sentences
+def load_serbian_sentences(source, max_sentences):
+    texts = []
+    tokens = []
+    for file in sorted(file for file in os.listdir(source) if file.endswith(".xml")):
+        for sentence in ET.parse(os.path.join(source, file)).getroot().iter("{http://www.tei-c.org/ns/1.0}s"):
+            if parse_attribs(sentence).get("lang") != "sr":
+                continue
+
+            words = [(word.text, parse_attribs(word).get("lemma", "")) for word in sentence
+                     if parse_tag(word) in ("w", "pc") and word.text]
+            texts.append(" ".join(text for text, _ in words))
+            tokens.append(words)
+
+            if len(texts) == max_sentences:
+                return texts, tokens
+
+    return texts, tokens
+
+
+def normalize_lemma(lemma):
+    return cyrtranslit.to_latin(lemma, "sr").lower()
+
+
+# lemmatizes the given tokens (tokenization of the XML is kept) with the strategy
+def lemmatize_tokens(words, strategy):
+    if strategy == "hr_transliterated":
+        nlp = parser_yuparl.nlp_hr
+        words = [cyrtranslit.to_latin(word, "sr") for word in words]
+    else:
+        parser_yuparl.ensure_sr_model_loaded()
+        nlp = parser_yuparl.nlp_sr
+
+    return [token.lemma_ for token in nlp(Doc(nlp.vocab, words=words))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Comparison of Serbian lemmatization strategies")
+    parser.add_argument('-s', '--source', type=str, required=True, help='Directory containing yu1Parl XML files')
+    parser.add_argument('-n', '--max-sentences', type=int, default=1000, help='Maximum number of sentences')
+    args = parser.parse_args()
+
+    texts, tokens = load_serbian_sentences(args.source, args.max_sentences)
+    number_of_tokens = sum(len(words) for words in tokens)
+    print(f"{len(texts)} Serbian sentences, {number_of_tokens} tokens")
+
+    results = {}
+    for strategy in STRATEGIES:
+        # models are loaded before measuring
+        lemmatize_tokens(["тест"], strategy)
+
+        time_start = time.perf_counter()
+        parser_yuparl.batch_lemmatize(texts, "sr", show_progress=False, sr_lemmatization=strategy)
+        elapsed_time = time.perf_counter() - time_start
+
+        correct = 0
+        for words in tokens:
+            lemmas = lemmatize_tokens([text for text, _ in words], strategy)
+            correct += sum(normalize_lemma(lemma) == normalize_lemma(gold_lemma)
+                           for lemma, (_, gold_lemma) in zip(lemmas, words))
+
+        results[strategy] = (elapsed_time, correct / max(number_of_tokens, 1))
+
+    print(f"{'strategy':<20}{'time s':>10}{'sentences/s':>14}{'lemma accuracy':>16}")
+    for strategy, (elapsed_time, accuracy) in results.items():
+        print(f"{strategy:<20}{elapsed_time:>10.2f}{len(texts) / max(elapsed_time, 1e-9):>14.1f}{accuracy:>16.1%}")
+
+
+if __name__ == '__main__':
+    main()
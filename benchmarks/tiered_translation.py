@@ -0,0 +1,84 @@
+# Speed of tiered translation (TIERED_TRANSLATION of parser_dzk) against translation with the large model only, on
+# sentences from DZK XML files. Both runs translate the same sentences (the translation cache is emptied before each
+# run), models are loaded before measuring. Reports the fraction of sentences escalated to the large model, the speedup
+# and the share of translations that differ from the large model.
+# Usage: python -m benchmarks.tiered_translation -s <directory with DZK XML files> [-n <max sentences>]
+import argparse
+import os
+import time
+import xml.etree.ElementTree as ET
+
+import instrumentation
+import parser_dzk
+from utils import ensure_fast_model_loaded, ensure_translation_model_loaded, parse_attribs, parse_tag, \
+    translate_sentences
+
+NLLB_TARGETS = {"de": ("deu_Latn", "slv_Latn"), "sl": ("slv_Latn", "deu_Latn")}
+
+
+# returns texts of sentences by language
+def load_sentences(source, max_sentences):
+    sentences = {lang: [] for lang in NLLB_TARGETS}
+    number_of_sentences = 0
+    for file in sorted(file for file in os.listdir(source) if file.endswith(".xml")):
+        for sentence in ET.parse(os.path.join(source, file)).getroot().iter("{http://www.tei-c.org/ns/1.0}s"):
+            lang = parse_attribs(sentence).get("lang")
+            if lang not in sentences:
+                continue
+
+            sentences[lang].append(" ".join(word.text for word in sentence
+                                            if parse_tag(word) in ("w", "pc") and word.text))
+            number_of_sentences += 1
+            if number_of_sentences == max_sentences:
+                return sentences
+
+    return sentences
+
+
+# translates all sentences, returns translations, time and counters of the run
+def run(sentences, tiered):
+    parser_dzk.translator["tiered"] = tiered
+    parser_dzk.translator["cache"].clear()
+    instrumentation.start_meeting("benchmark")
+
+    translations = []
+    time_start = time.perf_counter()
+    for lang, texts in sentences.items():
+        translations.extend(translate_sentences(parser_dzk.translator, texts, *NLLB_TARGETS[lang]))
+    elapsed_time = time.perf_counter() - time_start
+
+    counters = instrumentation.finish_meeting("benchmark")["counters"]
+    return translations, elapsed_time, counters
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiered translation against the large model only")
+    parser.add_argument('-s', '--source', type=str, required=True, help='Directory containing DZK XML files')
+    parser.add_argument('-n', '--max-sentences', type=int, default=500, help='Maximum number of sentences')
+    args = parser.parse_args()
+
+    sentences = load_sentences(args.source, args.max_sentences)
+    number_of_sentences = sum(len(texts) for texts in sentences.values())
+    print(f"{number_of_sentences} sentences")
+
+    # models are loaded before measuring
+    ensure_translation_model_loaded(parser_dzk.translator)
+    ensure_fast_model_loaded(parser_dzk.translator)
+
+    large_translations, large_time, _ = run(sentences, tiered=False)
+    tiered_translations, tiered_time, counters = run(sentences, tiered=True)
+
+    escalated = counters.get("escalated_sentences", 0)
+    fast_translated = counters.get("fast_translated_sentences", 0)
+    different = sum(large != tiered for large, tiered in zip(large_translations, tiered_translations))
+
+    print(f"{'mode':<14}{'time s':>10}{'sentences/s':>14}")
+    print(f"{'large only':<14}{large_time:>10.1f}{number_of_sentences / max(large_time, 1e-9):>14.1f}")
+    print(f"{'tiered':<14}{tiered_time:>10.1f}{number_of_sentences / max(tiered_time, 1e-9):>14.1f}")
+    print(f"escalated {escalated} of {fast_translated} sentences ({escalated / max(fast_translated, 1):.1%}), "
+          f"speedup {large_time / max(tiered_time, 1e-9):.2f}x, "
+          f"{different / max(number_of_sentences, 1):.1%} of translations differ from the large model")
+
+
+if __name__ == '__main__':
+    main()
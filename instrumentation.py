@@ -0,0 +1,220 @@
+import json
+import math
+import sys
+import time
+from contextlib import contextmanager
+
+# resource is not available on Windows
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Per-meeting timers and counters of the parse pipeline. Each meeting gets one record:
+# {"file": ..., "meeting_id": ..., "wall_time": ..., "peak_rss_mb": ..., "stages": {stage: seconds},
+#  "counters": {counter: value}}
+# Records are appended as JSON lines to the run log and summarized at the end of the run.
+
+current_record = None
+run_records = []
+
+
+# reads a value in kB (e.g. VmRSS, VmHWM) from /proc/self/status (Linux only)
+def read_proc_status_mb(key):
+    try:
+        with open("/proc/self/status", "r") as file:
+            for line in file:
+                if line.startswith(key + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def get_rss_mb():
+    return read_proc_status_mb("VmRSS")
+
+
+# RSS, PSS (shared pages are divided between the processes that share them) and private memory of the process in MB
+# from /proc/self/smaps_rollup (Linux only, None elsewhere), with forked workers PSS and private memory show how much
+# memory a worker really adds
+def get_memory_breakdown_mb():
+    values = {}
+    try:
+        with open("/proc/self/smaps_rollup", "r") as file:
+            for line in file:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    values[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    except OSError:
+        return None
+
+    return {
+        "rss_mb": values.get("Rss", 0.0),
+        "pss_mb": values.get("Pss", 0.0),
+        "private_mb": values.get("Private_Clean", 0.0) + values.get("Private_Dirty", 0.0)
+    }
+
+
+# peak RSS since the last reset_peak_rss() (on Linux), otherwise peak RSS of the whole process (None on Windows)
+def get_peak_rss_mb():
+    peak_rss = read_proc_status_mb("VmHWM")
+    if peak_rss is None and resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kB on Linux, bytes on macOS
+        peak_rss = max_rss / 1024 / 1024 if sys.platform == "darwin" else max_rss / 1024
+    return peak_rss
+
+
+# resets peak RSS (VmHWM) of the process, so it can be measured for each meeting (Linux only)
+def reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+    except OSError:
+        pass
+
+
+def start_meeting(file_name):
+    global current_record
+    reset_peak_rss()
+    current_record = {
+        "file": file_name,
+        "meeting_id": None,
+        "start_time": time.time(),
+        "stages": {},
+        "counters": {}
+    }
+
+
+# detaches the record of the current meeting (e.g. while it waits for translation together with other meetings),
+# time until resume_meeting() is not counted in its wall time
+def pause_meeting():
+    global current_record
+    record = current_record
+    if record is not None:
+        record["active_time"] = record.get("active_time", 0.0) + time.time() - record.pop("start_time")
+    current_record = None
+    return record
+
+
+def resume_meeting(record):
+    global current_record
+    record["start_time"] = time.time()
+    current_record = record
+
+
+# measures work shared by several meetings (e.g. translation of a group of meetings) in a separate record, its time,
+# stages and counters are then split between the records of the meetings in proportion to the weights
+@contextmanager
+def shared_work(records, weights):
+    global current_record
+    previous_record = current_record
+    shared_record = {"stages": {}, "counters": {}}
+    current_record = shared_record
+    time_start = time.time()
+    try:
+        yield
+    finally:
+        current_record = previous_record
+        wall_time = time.time() - time_start
+        total_weight = sum(weights)
+        for record, weight in zip(records, weights):
+            share = weight / total_weight if total_weight else 1 / len(records)
+            record["active_time"] = record.get("active_time", 0.0) + wall_time * share
+            for name, seconds in shared_record["stages"].items():
+                record["stages"][name] = record["stages"].get(name, 0.0) + seconds * share
+            for name, value in shared_record["counters"].items():
+                value = value * share if isinstance(value, float) else round(value * share)
+                record["counters"][name] = record["counters"].get(name, 0) + value
+
+
+# measures time of the stage (nested stages are measured separately and also counted in the outer stage)
+@contextmanager
+def stage(name):
+    time_start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if current_record is not None:
+            stages = current_record["stages"]
+            stages[name] = stages.get(name, 0.0) + time.perf_counter() - time_start
+
+
+# adds time to the stage (for stages measured elsewhere, e.g. in worker threads)
+def add_stage_time(name, seconds):
+    if current_record is not None:
+        stages = current_record["stages"]
+        stages[name] = stages.get(name, 0.0) + seconds
+
+
+def count(name, value=1):
+    if current_record is not None:
+        counters = current_record["counters"]
+        counters[name] = counters.get(name, 0) + value
+
+
+# closes the record of the current meeting and appends it to the run log (if given)
+def finish_meeting(meeting_id, run_log_path=None):
+    global current_record
+    if current_record is None:
+        return None
+
+    record = current_record
+    record["meeting_id"] = meeting_id
+    record["wall_time"] = record.pop("active_time", 0.0) + time.time() - record.pop("start_time")
+    record["peak_rss_mb"] = get_peak_rss_mb()
+    run_records.append(record)
+    current_record = None
+
+    if run_log_path:
+        with open(run_log_path, "a", encoding="utf-8") as file:
+            file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    return record
+
+
+# total of the counter over all meetings of the run
+def get_counter_total(name):
+    return sum(record["counters"].get(name, 0) for record in run_records)
+
+
+# nearest-rank percentile
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[max(math.ceil(p / 100 * len(values)) - 1, 0)]
+
+
+def print_summary():
+    if not run_records:
+        return
+
+    total_wall_time = sum(record["wall_time"] for record in run_records)
+    stage_names = []
+    for record in run_records:
+        stage_names.extend(name for name in record["stages"] if name not in stage_names)
+
+    print(f"\nRun summary: {len(run_records)} meetings in {total_wall_time:.1f} s")
+    print(f"{'stage':<16}{'total s':>10}{'share':>8}{'p50 s':>10}{'p95 s':>10}")
+    for name in stage_names:
+        values = [record["stages"].get(name, 0.0) for record in run_records]
+        print(f"{name:<16}{sum(values):>10.1f}{sum(values) / max(total_wall_time, 1e-9):>8.1%}"
+              f"{percentile(values, 50):>10.2f}{percentile(values, 95):>10.2f}")
+
+    peak_rss_values = [record["peak_rss_mb"] for record in run_records if record["peak_rss_mb"] is not None]
+    if peak_rss_values:
+        print(f"\npeak RSS per meeting: max {max(peak_rss_values):.0f} MB, p50 {percentile(peak_rss_values, 50):.0f} MB, "
+              f"p95 {percentile(peak_rss_values, 95):.0f} MB")
+
+    counter_names = []
+    for record in run_records:
+        counter_names.extend(name for name in record["counters"] if name not in counter_names)
+
+    print(f"\n{'counter':<24}{'total':>14}{'per s':>12}")
+    for name in counter_names:
+        total = sum(record["counters"].get(name, 0) for record in run_records)
+        total_text = f"{total:.1f}" if isinstance(total, float) else str(total)
+        print(f"{name:<24}{total_text:>14}{total / max(total_wall_time, 1e-9):>12.1f}")
+    print()
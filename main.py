@@ -1,11 +1,11 @@
 import argparse
 
 import optimizer
-#import parser_dzk
-#import parser_yuparl
+import profiler
 import renamer
 import thumbnailer
 import uploader
+from utils import parse_work_partition, plan_cpus, set_thread_environment
 
 
 def main():
@@ -14,6 +14,20 @@ def main():
         description='This program is used to prepare JSON, PDF and thumbnails data for ParlaVis.'
     )
 
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Run the subcommand under cProfile and save .prof and collapsed-stack files (one per run and per '
+             'worker process)'
+    )
+    parser.add_argument(
+        '--profile-dir',
+        type=str,
+        required=False,
+        help='Directory for profiles saved with --profile',
+        default='profiles'
+    )
+
     subparsers = parser.add_subparsers(dest='command', required=True, help='Subcommand to run')
 
     # -------------------------------
@@ -112,6 +126,21 @@ def main():
         help='Ending index for optimizing files',
         default=-1
     )
+    optimize_parser.add_argument(
+        '--shard',
+        type=parse_work_partition,
+        required=False,
+        help='Process only part i/N (0 <= i < N) of the files, used to split work between several machines',
+        default=None
+    )
+    optimize_parser.add_argument(
+        '--partition-by',
+        type=str,
+        required=False,
+        help='How files are split into parts: balanced by file size or by a stable hash of file name',
+        default='size',
+        choices=['size', 'hash']
+    )
 
     # -------------------------------
     # Subcommand: parse
@@ -150,6 +179,84 @@ def main():
         help='Ending index for parsing files',
         default=-1
     )
+    parse_parser.add_argument(
+        '--compress',
+        type=str,
+        required=False,
+        help='Compression of output JSONL files (zstd requires the zstandard package)',
+        default='none',
+        choices=['none', 'gzip', 'zstd']
+    )
+    parse_parser.add_argument(
+        '--output-shard-size',
+        type=int,
+        required=False,
+        help='Write all meetings into shards of about this many MB per document type (e.g. words-00042.jsonl) '
+             'instead of three files per meeting',
+        default=None
+    )
+    parse_parser.add_argument(
+        '--shard',
+        type=parse_work_partition,
+        required=False,
+        help='Process only part i/N (0 <= i < N) of the files, used to split work between several machines',
+        default=None
+    )
+    parse_parser.add_argument(
+        '--partition-by',
+        type=str,
+        required=False,
+        help='How files are split into parts: balanced by file size or by a stable hash of file name',
+        default='size',
+        choices=['size', 'hash']
+    )
+    parse_parser.add_argument(
+        '--run-log',
+        type=str,
+        required=False,
+        help='JSONL file to which stage timings and counters of every meeting are appended',
+        default='parse_run_log.jsonl'
+    )
+    parse_parser.add_argument(
+        '--max-memory-mb',
+        type=int,
+        required=False,
+        help='Memory-bounded mode: release intermediate data as soon as possible and translate and write meetings in '
+             'chunks of segments, which get smaller while memory use (RSS) is above this ceiling',
+        default=None
+    )
+    parse_parser.add_argument(
+        '--translation-group-sentences',
+        type=int,
+        required=False,
+        help='Translate consecutive meetings together until they have at least this many sentences, so translation '
+             'batches are full also for short meetings (not used with --max-memory-mb)',
+        default=None
+    )
+    parse_parser.add_argument(
+        '--workers',
+        type=int,
+        required=False,
+        help='Number of worker processes, forked after the translation model is loaded, so they share its weights',
+        default=1
+    )
+    parse_parser.add_argument(
+        '--decoding-profile',
+        type=str,
+        required=False,
+        help='Translation decoding profile: beam width and maximum output length grow with the source length '
+             '(default: balanced for DZK, quality for yu1Parl)',
+        default=None,
+        choices=['fast', 'balanced', 'quality']
+    )
+    parse_parser.add_argument(
+        '--cpus',
+        type=int,
+        required=False,
+        help='Number of CPUs to use, they are split between workers and within a worker between translation (torch) '
+             'and lemmatization threads (with several workers all CPUs are split by default)',
+        default=None
+    )
 
     # -------------------------------
     # Subcommand: upload
@@ -180,11 +287,33 @@ def main():
         help='Whether to delete existing indexes before upload',
         default=False
     )
+    upload_parser.add_argument(
+        '--shard',
+        type=parse_work_partition,
+        required=False,
+        help='Process only part i/N (0 <= i < N) of the files, used to split work between several machines',
+        default=None
+    )
+    upload_parser.add_argument(
+        '--partition-by',
+        type=str,
+        required=False,
+        help='How files are split into parts: balanced by file size or by a stable hash of file name',
+        default='size',
+        choices=['size', 'hash']
+    )
 
 
     args = parser.parse_args()
 
-    # Execute the appropriate function based on the subcommand
+    if args.profile:
+        profiler.run_profiled(run_command, args.profile_dir, args.command, args)
+    else:
+        run_command(args)
+
+
+# executes the appropriate function based on the subcommand
+def run_command(args):
     if args.command == 'rename':
         renamer.rename_files(args.source, args.destination, args.corpus)
     elif args.command == 'thumbnail':
@@ -196,15 +325,30 @@ def main():
             quality=args.quality,
             ghostscript_path=args.ghostscript_path,
             from_index=args.from_index,
-            to_index=args.to_index
+            to_index=args.to_index,
+            work_partition=args.shard,
+            partition_by=args.partition_by
         )
     elif args.command == 'parse':
+        # thread counts of native libraries have to be set before the parser (torch, spaCy) is imported, without
+        # --cpus all CPUs are split when there are several workers
+        cpu_plan = plan_cpus(args.cpus, args.workers) if args.cpus or args.workers > 1 else None
+        if cpu_plan is not None:
+            set_thread_environment(cpu_plan)
+
+        # parsers load spaCy models on import, so they are imported only when needed
         if args.corpus == 'dzk':
-            ...
-            # parser_dzk.parse(args.source, args.destination, args.from_index, args.to_index)
+            import parser_dzk
+            parser_dzk.parse(args.source, args.destination, args.from_index, args.to_index, args.compress,
+                              args.output_shard_size, args.shard, args.partition_by, args.run_log,
+                              args.max_memory_mb, args.translation_group_sentences, args.workers, cpu_plan,
+                              args.decoding_profile)
         elif args.corpus == 'yuparl':
-            ...
-            # parser_yuparl.parse(args.source, args.destination, args.from_index, args.to_index)
+            import parser_yuparl
+            parser_yuparl.parse(args.source, args.destination, args.from_index, args.to_index, args.compress,
+                                args.output_shard_size, args.shard, args.partition_by, args.run_log,
+                                args.max_memory_mb, args.translation_group_sentences, args.workers, cpu_plan,
+                                args.decoding_profile)
         else:
             raise NotImplementedError(f"Parsing for corpus '{args.corpus}' is not implemented.")
     elif args.command == 'upload':
@@ -212,7 +356,9 @@ def main():
             args.source,
             args.elasticsearch_host,
             args.elasticsearch_port,
-            delete_index_if_exists=args.delete_index
+            delete_index_if_exists=args.delete_index,
+            work_partition=args.shard,
+            partition_by=args.partition_by
         )
     else:
         raise NotImplementedError(f"Command '{args.command}' is not implemented.")
@@ -1,6 +1,8 @@
 import os
 import subprocess
 
+from utils import list_work_files
+
 
 def optimize_pdf(input_file, output_file, quality='ebook', ghostscript_path='gs'):
     quality_settings = {
@@ -82,10 +84,14 @@ def optimize_pdf(input_file, output_file, quality='ebook', ghostscript_path='gs'
             os.remove(temp_output)
 
 
-def optimize_pdfs(input_dir, output_dir, quality="ebook", ghostscript_path='gs', from_index=0, to_index=-1):
+def optimize_pdfs(input_dir, output_dir, quality="ebook", ghostscript_path='gs', from_index=0, to_index=-1,
+                  work_partition=None, partition_by="size"):
     print("Optimizing PDF files in directory:", input_dir)
 
-    for i, file in enumerate(os.listdir(input_dir)):
+    # sorted files (only the given part of them if work is partitioned between machines)
+    files = list_work_files(input_dir, lambda f: f.lower().endswith(".pdf"), work_partition, partition_by)
+
+    for i, file in enumerate(files):
 
         if i < from_index:
             continue
@@ -93,9 +99,6 @@ def optimize_pdfs(input_dir, output_dir, quality="ebook", ghostscript_path='gs',
         if to_index != -1 and i >= to_index:
             break
 
-        if not file.lower().endswith(".pdf"):
-            continue
-
         path = os.path.join(input_dir, file)
 
         optimized_file_path = os.path.join(output_dir, file)
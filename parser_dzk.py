@@ -1,15 +1,12 @@
 import json
-import os
 import re
 import time
-import xml.etree.ElementTree as ET
 
 import spacy
 from utils import *
+import instrumentation
 
 from alive_progress import alive_bar
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
-import torch
 import warnings
 
 
@@ -26,44 +23,28 @@ prop_nouns = set()
 nlp_sl = spacy.load("sl_core_news_md")
 nlp_de = spacy.load("de_core_news_md")
 
-# Model for translation
-tokenizer = None
-model = None
-device = "cuda" if torch.cuda.is_available() else "cpu"
-USE_FP16 = torch.cuda.is_available()
+# Tiered translation: everything is translated greedily with the fast model (FAST_TRANSLATION_MODEL in utils), only
+# translations with low mean token log-probability or unusual length (characters of translation / characters of
+# source) are translated again with the large model (with beam search)
+TIERED_TRANSLATION = False
 
+# Decoding profile (see DECODING_PROFILES in utils): beam width and max_new_tokens of a batch depend on the length of
+# its longest source, can be set with `parse --decoding-profile`
+DECODING_PROFILE = 'balanced'
 
-def ensure_translation_model_loaded(model_name="facebook/nllb-200-distilled-1.3B"):
-    global tokenizer, model, device, USE_FP16
-    if tokenizer is not None and model is not None:
-        return
+# Set to False if translations should be lemmatized only after the whole language direction is translated
+PIPELINE_TRANSLATION = True
 
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
-    model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
-    model.eval()
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    model.to(device)
-    if device == "cuda" and USE_FP16:
-        # convert model to fp16 for lower memory usage / faster inference on supported GPUs
-        try:
-            model.half()
-        except Exception:
-            print("Warning: could not convert model to fp16")
+NLLB_LANG_CODES = {"sl": "slv_Latn", "de": "deu_Latn"}
 
+# models, decoding settings and cache of translations (see create_translator in utils), with arguments of beam search
+translator = create_translator(DECODING_PROFILE, {"early_stopping": False, "length_penalty": 1.3},
+                               TIERED_TRANSLATION, PIPELINE_TRANSLATION)
 
-def translate_text(text, source_lang, target_lang):
-    ensure_translation_model_loaded()
-
-    translated_text = ""
-
-    tokenizer.src_lang = source_lang
-    with torch.no_grad():
-        encoded = tokenizer(text, textreturn_tensors="pt", padding=True, truncation=True, max_length=512).to(device)
-        generated_tokens = model.generate(**encoded, forced_bos_token_id=tokenizer.get_lang_id(target_lang))
-
-        translated_text = tokenizer.batch_decode(generated_tokens, skip_special_tokens=True)
 
-    return translated_text
+# translates a single text (NLLB language codes), agendas and sentences are translated with translate_sentences
+def translate_text(text, source_lang, target_lang):
+    return translate_sentences(translator, [text], source_lang, target_lang)[0]
 
 
 # finds all agendas and contents and returns them as a list of dictionaries
@@ -90,40 +71,30 @@ def parse_agendas(xml_root, meeting_id):
             }
         )
 
-    # get translations if necessary NOT WORKING
+    # translate the agenda to the other language (all items in one batch)
     if len(agendas) == 1:
-        if agendas[0]["lang"] == "de":
-            print("translating: ", meeting_id, " to sl")
-            agenda_sl = []
-            for item in agendas[0]["items"]:
-                agenda_sl.append({
-                    "n": item["n"],
-                    "text": translate_text(item["text"], "de", "sl")
-                })
-            agendas.append({
-                "lang": "sl",
-                "items": agenda_sl
-            })
-        elif agendas[0]["lang"] == "sl":
-            print("translating: ", meeting_id, " to de")
-            agenda_de = []
-            for item in agendas[0]["items"]:
-                agenda_de.append({
-                    "n": item["n"],
-                    "text": translate_text(item["text"], "sl", "de")
-                })
-            agendas.append({
-                "lang": "de",
-                "items": agenda_de
-            })
-        else:
-            print("parse_agendas(): language '" + agendas[0]["lang"] + "' not supported")
+        source_lang = agendas[0]["lang"]
+        target_lang = {"de": "sl", "sl": "de"}.get(source_lang)
+        if target_lang is None:
+            print("parse_agendas(): language '" + source_lang + "' not supported")
             return []
 
+        print("translating: ", meeting_id, " to " + target_lang)
+        items = agendas[0]["items"]
+        # empty items are not sent to the model, their translation is empty
+        translations = translate_non_empty(translator, [item["text"] for item in items],
+                                           NLLB_LANG_CODES[source_lang], NLLB_LANG_CODES[target_lang])
+        agendas.append({
+            "lang": target_lang,
+            "items": [{"n": item["n"], "text": translation} for item, translation in zip(items, translations)]
+        })
+
     return agendas
 
 
-def batch_lemmatize(texts, lang, sentence_ids=None, batch_size=64, n_process=1):
+# texts can be any iterable (e.g. translations as they are decoded), then number_of_texts has to be given
+def batch_lemmatize(texts, lang, sentence_ids=None, batch_size=64, n_process=1, number_of_texts=None,
+                    show_progress=True):
     if lang == "sl":
         nlp = nlp_sl
     elif lang == "de":
@@ -132,15 +103,20 @@ def batch_lemmatize(texts, lang, sentence_ids=None, batch_size=64, n_process=1):
         print(f"batch_lemmatize(): language '{lang}' not supported")
         return [[] for _ in texts]
 
+    if number_of_texts is None:
+        number_of_texts = len(texts)
+
     if sentence_ids is None:
-        sentence_ids = [f"0" for _ in texts]
+        sentence_ids = [f"0" for _ in range(number_of_texts)]
 
     results = []
+    instrumentation.count("lemmatized_sentences", number_of_texts)
 
     # Disable components not needed for lemmatization to save memory/CPU
     disable_comps = [c for c in ("parser") if c in nlp.pipe_names]
     with nlp.select_pipes(disable=disable_comps):
-        with alive_bar(len(texts), title=f"Lemmatizing ({lang})", force_tty=True) as bar:
+        with alive_bar(number_of_texts, title=f"Lemmatizing ({lang})", force_tty=True,
+                       disable=not show_progress) as bar:
             bar(0)
             for doc, sid in zip(nlp.pipe(texts, batch_size=batch_size, n_process=n_process), sentence_ids):
                 words = []
@@ -159,6 +135,7 @@ def batch_lemmatize(texts, lang, sentence_ids=None, batch_size=64, n_process=1):
 
                     words.append(word)
                 results.append(words)
+                instrumentation.count("lemmatized_tokens", len(words))
                 bar()
 
     return results
@@ -295,126 +272,60 @@ def parse_speeches(xml_root):
     return sentences, notes
 
 
-def translate_sentences(sentences, source_lang, target_lang, chunk_size=10, num_beams=3):
-    ensure_translation_model_loaded()
-
-    translations = []
-
-    tokenizer.src_lang = source_lang
-    with torch.no_grad():
-        with alive_bar(len(sentences), title=f"Translating {source_lang}→{target_lang}", force_tty=True) as bar:
-            bar(0)
-            for start in range(0, len(sentences), chunk_size):
-                end = start + chunk_size
-                chunk = sentences[start:end]
-
-                encoded = tokenizer(chunk, return_tensors="pt", padding=True, truncation=True, max_length=512).to(device)
-                generated_tokens = model.generate(
-                    **encoded,
-                    forced_bos_token_id=get_lang_id(tokenizer, target_lang),
-                    num_beams=num_beams,
-                    early_stopping=False,
-                    length_penalty=1.3,
-                    max_new_tokens=512,
-                )
-
-                decoded = tokenizer.batch_decode(generated_tokens, skip_special_tokens=True)
-                translations.extend(decoded)
-
-                # free intermediate tensors and clear cached GPU memory
-                if device == "cuda":
-                    del encoded, generated_tokens
-                    torch.cuda.empty_cache()
-
-                bar(len(chunk))
-
-    return translations
-
-# translates the sentences and agendas in a meeting
-def translate_meeting(meeting):
+# translates the sentences of the meetings, sentences of all meetings are translated together, so batches are full
+# also when meetings are short (translations are appended to their sentences)
+def translate_meetings(meetings):
     start_time = time.time()
 
-    # init lists for sentences
-    de_sentence_ids = []
-    de_translations_list = []
-
-    sl_sentence_ids = []
-    sl_translations_list = []
-
-    # get all sentences in the meeting and put them in lists according to their language, also get their ids
-    for sentence in meeting["sentences"]:
-        if sentence["translations"][0]["lang"] == "de":
-            de_sentence_ids.append(sentence["id"])
-            de_translations_list.append(sentence["translations"][0]["text"])
-        elif sentence["translations"][0]["lang"] == "sl":
-            sl_sentence_ids.append(sentence["id"])
-            sl_translations_list.append(sentence["translations"][0]["text"])
-
-    # translate german to slovene
-    translations_sl = translate_sentences(de_translations_list, 'deu_Latn', 'slv_Latn')
-    mid_time1 = time.time()
-    print("translating to sl took " + str(mid_time1 - start_time) + " seconds")
-
-    # lemmatize slovene translations
-    lemmatizations_sl = batch_lemmatize(translations_sl, 'sl', de_sentence_ids)
-    mid_time2 = time.time()
-    print("lemmatizing sl took " + str(mid_time2 - mid_time1) + " seconds")
-
-
-    for i, (translated_text, lemmatization) in enumerate(zip(translations_sl, lemmatizations_sl)):
-        sentence_id = de_sentence_ids[i]
-        sentence_index = next((idx for (idx, d) in enumerate(meeting["sentences"]) if d["id"] == sentence_id), None)
-        if sentence_index is None:
-            continue
-
-        translation_entry = {
-            "lang": "sl",
-            "original": 0,
-            "speaker": meeting["sentences"][sentence_index]["speaker"],
-            "text": translated_text,
-            "words": lemmatization
-        }
-
-        meeting["sentences"][sentence_index]["translations"].append(translation_entry)
-
-    # translate slovene to german
-    translations_de = translate_sentences(sl_translations_list,'slv_Latn', 'deu_Latn')
-    mid_time3 = time.time()
-    print("translating to de took " + str(mid_time3 - mid_time2) + " seconds")
-
-    # lemmatize german translations
-    lemmatizations_de = batch_lemmatize(translations_de, 'de', sl_sentence_ids)
-    mid_time4 = time.time()
-    print("lemmatizing de took " + str(mid_time4 - mid_time3) + " seconds")
-
-    for i, (translated_text, lemmatization) in enumerate(zip(translations_de, lemmatizations_de)):
-        sentence_id = sl_sentence_ids[i]
-        sentence_index = next((idx for (idx, d) in enumerate(meeting["sentences"]) if d["id"] == sentence_id), None)
-        if sentence_index is None:
-            continue
-
-        translation_entry = {
-            "lang": "de",
-            "original": 0,
-            "speaker": meeting["sentences"][sentence_index]["speaker"],
-            "text": translated_text,
-            "words": lemmatization
-        }
-
-        meeting["sentences"][sentence_index]["translations"].append(translation_entry)
-
+    # sentences of all meetings by their language, sentences without translatable words (numbers, names, ...) are
+    # copied into the other language without translation and lemmatization
+    sentences_by_lang = {"de": [], "sl": []}
+    for meeting in meetings:
+        number_of_bypassed = 0
+        for sentence in meeting["sentences"]:
+            lang = sentence["translations"][0]["lang"]
+            if lang not in sentences_by_lang:
+                continue
+
+            if is_translation_bypassed(sentence["translations"][0]["words"]):
+                sentence["translations"].append(copy_translation(sentence, "sl" if lang == "de" else "de"))
+                number_of_bypassed += 1
+            else:
+                sentences_by_lang[lang].append(sentence)
+
+        instrumentation.count("bypassed_sentences", number_of_bypassed)
+        print(f"translate_meetings(): {meeting['id']}: {number_of_bypassed} of {len(meeting['sentences'])} sentences "
+              f"copied without translation")
+
+    # translate german to slovene and slovene to german and lemmatize the translations
+    for source_lang, target_lang in (("de", "sl"), ("sl", "de")):
+        sentences = sentences_by_lang[source_lang]
+        translations, lemmatizations = translate_and_lemmatize(
+            translator, batch_lemmatize, [sentence["translations"][0]["text"] for sentence in sentences],
+            NLLB_LANG_CODES[source_lang], NLLB_LANG_CODES[target_lang], target_lang,
+            [sentence["id"] for sentence in sentences])
+
+        for sentence, translated_text, lemmatization in zip(sentences, translations, lemmatizations):
+            sentence["translations"].append({
+                "lang": target_lang,
+                "original": 0,
+                "speaker": sentence["speaker"],
+                "text": translated_text,
+                "words": lemmatization
+            })
 
     end_time = time.time()
-    print(
-        "translate_meeting(): translated " + str(len(de_sentence_ids) + len(sl_sentence_ids)) + " sentences in " + str(
-            end_time - start_time) + " seconds")
+    print("translate_meetings(): translated " + str(len(sentences_by_lang["de"]) + len(sentences_by_lang["sl"])) +
+          " sentences of " + str(len(meetings)) + " meetings in " + str(end_time - start_time) + " seconds")
 
-    return
 
+# translates the sentences in a meeting
+def translate_meeting(meeting):
+    translate_meetings([meeting])
 
-def parse_zapisnik(xml_root):
-    meeting_parse_start_time = time.time()
 
+# parses the meeting without translations, returns the meeting and coordinates of its words
+def read_zapisnik(xml_root, coords_sidecar_path=None):
     meeting = {}
 
     # get the meeting id
@@ -427,21 +338,33 @@ def parse_zapisnik(xml_root):
     meeting["titles"] = parse_titles(xml_root, NAMESPACE_MAPPINGS)
 
     # get agendas
-    meeting["agendas"] = parse_agendas(xml_root, meeting["id"])
+    with instrumentation.stage("agendas"):
+        meeting["agendas"] = parse_agendas(xml_root, meeting["id"])
 
     # get speeches
-    meeting["sentences"], meeting["notes"] = parse_speeches(xml_root)
-
-    # translate meeting
-    translate_meeting(meeting)
+    with instrumentation.stage("speech_parse"):
+        meeting["sentences"], meeting["notes"] = parse_speeches(xml_root)
+    instrumentation.count("sentences", len(meeting["sentences"]))
+    instrumentation.count("tokens", sum(len(sentence["translations"][0]["words"]) for sentence in meeting["sentences"]))
 
     # set corpus
     meeting["corpus"] = CORPUS_NAME
 
-    # gather data about sentences and words
-    coords_index = build_coords_index(xml_root, NAMESPACE_MAPPINGS)
-    transformed_sentences = transform_sentences_fast(meeting, coords_index=coords_index)
-    transformed_words = transform_words_fast(meeting, coords_index=coords_index)
+    with instrumentation.stage("coords_index"):
+        coords_index = build_coords_index(xml_root, NAMESPACE_MAPPINGS, coords_sidecar_path)
+
+    return meeting, coords_index
+
+
+def parse_zapisnik(xml_root, coords_sidecar_path=None):
+    meeting_parse_start_time = time.time()
+
+    meeting, coords_index = read_zapisnik(xml_root, coords_sidecar_path)
+
+    # translate meeting
+    translate_meeting(meeting)
+
+    transformed_sentences, transformed_words = transform_meeting(meeting, coords_index)
 
     meeting_parse_end_time = time.time()
     print("parse_zapisnik(): parsed meeting in " + str(meeting_parse_end_time - meeting_parse_start_time) + " seconds")
@@ -449,37 +372,76 @@ def parse_zapisnik(xml_root):
     return meeting, transformed_sentences, transformed_words
 
 
-def parse(source, destination, from_idx=0, to_idx=-1):
-    files = os.listdir(source)
-    for i, file in enumerate(files):
+# memory-bounded parse_zapisnik and save_meeting: XML is released as soon as speeches and coordinates are read, then
+# sentences are translated, transformed and written in chunks of segments, returns the meeting (without sentences)
+# and number of bytes written
+def parse_and_save_zapisnik_bounded(xml_root, coords_sidecar_path, destination, compression="none", shards=None,
+                                    max_memory_mb=None):
+    meeting_parse_start_time = time.time()
 
-        if i < from_idx:
-            continue
+    meeting = {}
+    meeting["id"] = xml_root.attrib["{http://www.w3.org/XML/1998/namespace}id"]
+    meeting["date"] = parse_date_from_id(meeting["id"])
+    meeting["titles"] = parse_titles(xml_root, NAMESPACE_MAPPINGS)
+
+    with instrumentation.stage("agendas"):
+        meeting["agendas"] = parse_agendas(xml_root, meeting["id"])
 
-        if i >= to_idx and to_idx != -1:
-            break
+    with instrumentation.stage("speech_parse"):
+        sentences, notes = parse_speeches(xml_root)
+    instrumentation.count("sentences", len(sentences))
+    instrumentation.count("tokens", sum(len(sentence["translations"][0]["words"]) for sentence in sentences))
 
-        if not file.endswith(".xml") or not file.startswith("DezelniZborKranjski"):
-            continue
+    # sentences are written into the meeting document chunk by chunk (same order of keys as in parse_zapisnik)
+    meeting["sentences"] = []
+    meeting["notes"] = notes
+    meeting["corpus"] = CORPUS_NAME
 
-        path = os.path.join(source, file)
+    with instrumentation.stage("coords_index"):
+        coords_index = build_coords_index(xml_root, NAMESPACE_MAPPINGS, coords_sidecar_path)
 
-        xml_tree = ET.parse(path)
-        xml_root = xml_tree.getroot()
+    # XML tree is not needed anymore
+    xml_root.clear()
+
+    with instrumentation.stage("write"):
+        writer = open_meeting_writer(meeting, destination, compression, shards)
+
+    for chunk in iter_sentence_chunks(sentences, max_memory_mb):
+        chunk_meeting = {"id": meeting["id"], "sentences": chunk}
+        translate_meeting(chunk_meeting)
+
+        with instrumentation.stage("transform"):
+            transformed_sentences = transform_sentences_fast(chunk_meeting, coords_index=coords_index)
+        with instrumentation.stage("write"):
+            write_meeting_chunk(writer, chunk_meeting["sentences"], transformed_sentences,
+                                iter_transformed_words(chunk_meeting, coords_index))
+
+    with instrumentation.stage("write"):
+        written_bytes = close_meeting_writer(writer)
+
+    meeting_parse_end_time = time.time()
+    print("parse_and_save_zapisnik_bounded(): parsed and saved meeting in " +
+          str(meeting_parse_end_time - meeting_parse_start_time) + " seconds")
 
-        print("parse(): processing file " + file)
+    return meeting, written_bytes
 
-        # initialize parser
-        zapisnik, povedi, besede = parse_zapisnik(xml_root)
 
-        # save data to jsonl files
-        file_path = os.path.join(destination, zapisnik["id"] + "_meeting.jsonl")
-        save_to_jsonl([zapisnik], file_path)
+# corpus specific steps of the parse pipeline (see parse_files in utils)
+CORPUS = {
+    "translator": translator,
+    "read_meeting": read_zapisnik,
+    "parse_meeting": parse_zapisnik,
+    "parse_and_save_meeting_bounded": parse_and_save_zapisnik_bounded,
+    "translate_meetings": translate_meetings,
+}
 
-        file_path = os.path.join(destination, zapisnik["id"] + "_sentences.jsonl")
-        save_to_jsonl(povedi, file_path)
 
-        file_path = os.path.join(destination, zapisnik["id"] + "_words.jsonl")
-        save_to_jsonl(besede, file_path)
+def parse(source, destination, from_idx=0, to_idx=-1, compression="none", shard_size_mb=None, work_partition=None,
+          partition_by="size", run_log_path=None, max_memory_mb=None, translation_group_sentences=None, workers=1,
+          cpu_plan=None, decoding_profile=None):
+    if decoding_profile is not None:
+        translator["decoding_profile"] = decoding_profile
 
-        print(f"parse(): {i+1}/{len(files)} files processed\n")
\ No newline at end of file
+    parse_corpus(CORPUS, source, destination, lambda f: f.endswith(".xml") and f.startswith("DezelniZborKranjski"),
+                 from_idx, to_idx, compression, shard_size_mb, work_partition, partition_by, run_log_path,
+                 max_memory_mb, translation_group_sentences, workers, cpu_plan)
@@ -1,18 +1,17 @@
-import xml.etree.ElementTree as ET
+import json
 import time
-import os
+import random
 import re
 
 import requests
 import spacy
 import spacy_transformers
 import cyrtranslit
-import torch
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
 from alive_progress import alive_bar
 from huggingface_hub import snapshot_download
 
 from utils import *
+import instrumentation
 
 # Text is either in Slovene or Serbo-Croatian. We consider that the text is in Croatian, if Serbo-Croatian is
 # written with latinic characters and in Serbian if it is written in cyrillic. Since Libretranslate
@@ -30,46 +29,60 @@ proper_nouns = set()
 
 nlp_sl = spacy.load('sl_core_news_md')
 nlp_hr = spacy.load('hr_core_news_md')
-nlp_sr = spacy.load(snapshot_download(repo_id="Tanor/sr_Spacy_Serbian_Model_SrpKor4Tagging_BERTICOVO"))
-
-# Model for translation
-tokenizer = None
-model = None
-device = "cuda" if torch.cuda.is_available() else "cpu"
-USE_FP16 = torch.cuda.is_available()
-
-
-def ensure_translation_model_loaded(model_name="facebook/nllb-200-distilled-1.3B"):
-    global tokenizer, model, device, USE_FP16
-    if tokenizer is not None and model is not None:
-        return
-
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
-    model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
-    model.eval()
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    model.to(device)
-    if device == "cuda" and USE_FP16:
-        # convert model to fp16 for lower memory usage / faster inference on supported GPUs
-        try:
-            model.half()
-        except Exception:
-            print("Warning: could not convert model to fp16")
-
-
+# serbian transformer model is loaded only if it is used (see SR_LEMMATIZATION)
+nlp_sr = None
+SR_TRANSFORMER_MODEL = "Tanor/sr_Spacy_Serbian_Model_SrpKor4Tagging_BERTICOVO"
+
+# How Serbian is lemmatized: 'transformer' (SR_TRANSFORMER_MODEL, accurate but slow on CPU) or 'hr_transliterated'
+# (text is transliterated to latin, lemmatized with the croatian pipeline and words are transliterated back to
+# cyrillic, much faster), compare them with `python -m benchmarks.sr_lemmatization`
+SR_LEMMATIZATION = 'transformer'
+
+# Tiered translation: everything is translated greedily with the fast model (FAST_TRANSLATION_MODEL in utils), only
+# translations with low mean token log-probability or unusual length (characters of translation / characters of
+# source) are translated again with the large model (with beam search)
+TIERED_TRANSLATION = False
+
+# Decoding profile (see DECODING_PROFILES in utils): beam width and max_new_tokens of a batch depend on the length of
+# its longest source, can be set with `parse --decoding-profile`
+DECODING_PROFILE = 'quality'
+
+# Set to False if translations should be lemmatized only after the whole language direction is translated
+PIPELINE_TRANSLATION = True
+
+NLLB_LANG_CODES = {'sl': 'slv_Latn', 'hr': 'hrv_Latn', 'sr': 'srp_Cyrl'}
+
+# How translations (source, target) are made: 'nllb' or 'transliterate'. Croatian and Serbian are treated as script
+# variants (as in parse_agendas), so the other variant is made with cyrtranslit: from the original for hr and sr
+# sentences and from the NLLB translation into the other variant for sl sentences (sl -> hr must then be 'nllb').
+TRANSLATION_PLAN = {
+    ('hr', 'sl'): 'nllb',
+    ('hr', 'sr'): 'transliterate',
+    ('sr', 'sl'): 'nllb',
+    ('sr', 'hr'): 'transliterate',
+    ('sl', 'hr'): 'nllb',
+    ('sl', 'sr'): 'transliterate',
+}
+
+# Set to number of sentences per transliterated direction that are also translated with NLLB and saved side by side
+# into TRANSLATION_QUALITY_SAMPLE_FILE (for comparing transliteration with translation)
+TRANSLATION_QUALITY_SAMPLE_SIZE = 0
+TRANSLATION_QUALITY_SAMPLE_FILE = "translation_quality_sample.jsonl"
+
+# models, decoding settings and cache of translations (see create_translator in utils), with arguments of beam search
+translator = create_translator(DECODING_PROFILE, {"early_stopping": True, "length_penalty": 1.2},
+                               TIERED_TRANSLATION, PIPELINE_TRANSLATION)
+
+
+def ensure_sr_model_loaded():
+    global nlp_sr
+    if nlp_sr is None:
+        nlp_sr = spacy.load(snapshot_download(repo_id=SR_TRANSFORMER_MODEL))
+
+
+# translates a single text (NLLB language codes), agendas and sentences are translated with translate_sentences
 def translate_text(text, source_lang, target_lang):
-    ensure_translation_model_loaded()
-
-    translated_text = ""
-
-    tokenizer.src_lang = source_lang
-    with torch.no_grad():
-        encoded = tokenizer(text, textreturn_tensors="pt", padding=True, truncation=True, max_length=512).to(device)
-        generated_tokens = model.generate(**encoded, forced_bos_token_id=tokenizer.get_lang_id(target_lang))
-
-        translated_text = tokenizer.batch_decode(generated_tokens, skip_special_tokens=True)
-
-    return translated_text
+    return translate_sentences(translator, [text], source_lang, target_lang)[0]
 
 
 def parse_agendas(xml_root):
@@ -95,14 +108,17 @@ def parse_agendas(xml_root):
             'items': agenda_items
         })
 
-    # translate if necessary
+    # translate if necessary (all items of the agenda in one batch), empty items get an empty translation and
+    # transliteration
     if len(agendas) == 1:
+        texts = [(item['text'] or '').strip() for item in agendas[0]["items"]]
         if agendas[0]['lang'] == 'sl':
             agenda_hr = []
             agenda_sr = []
-            for item in agendas[0]["items"]:
-                serbo_croatian_latinic = translate_text(item['text'], 'sl', 'sr')
-                serbo_croatian_cyrilic = cyrtranslit.to_cyrillic(serbo_croatian_latinic)
+            translations = translate_non_empty(translator, texts, NLLB_LANG_CODES['sl'], NLLB_LANG_CODES['hr'])
+            for item, serbo_croatian_latinic in zip(agendas[0]["items"], translations):
+                serbo_croatian_cyrilic = cyrtranslit.to_cyrillic(serbo_croatian_latinic) if serbo_croatian_latinic \
+                    else ''
                 agenda_hr.append({
                     'n': item['n'],
                     'text': serbo_croatian_latinic
@@ -123,9 +139,9 @@ def parse_agendas(xml_root):
         elif agendas[0]['lang'] == 'hr':
             agenda_sl = []
             agenda_sr = []
-            for item in agendas[0]["items"]:
-                serbo_croatian_cyrilic = cyrtranslit.to_cyrillic(item['text'])
-                slovene = translate_text(item['text'], 'sr', 'sl')
+            translations = translate_non_empty(translator, texts, NLLB_LANG_CODES['hr'], NLLB_LANG_CODES['sl'])
+            for item, text, slovene in zip(agendas[0]["items"], texts, translations):
+                serbo_croatian_cyrilic = cyrtranslit.to_cyrillic(text) if text else ''
                 agenda_sl.append({
                     'n': item['n'],
                     'text': slovene
@@ -148,9 +164,9 @@ def parse_agendas(xml_root):
                 print(f"Invalid language: {agendas[0]['lang']}")
             agenda_sl = []
             agenda_hr = []
-            for item in agendas[0]["items"]:
-                serbo_croatian_latinic = cyrtranslit.to_latin(item['text'])
-                slovene = translate_text(serbo_croatian_latinic, 'sr', 'sl')
+            translations = translate_non_empty(translator, texts, NLLB_LANG_CODES['sr'], NLLB_LANG_CODES['sl'])
+            for item, text, slovene in zip(agendas[0]["items"], texts, translations):
+                serbo_croatian_latinic = cyrtranslit.to_latin(text) if text else ''
                 agenda_sl.append({
                     'n': item['n'],
                     'text': slovene
@@ -175,8 +191,9 @@ def parse_agendas(xml_root):
 
         if hr_agenda is not None and sr_agenda is not None and sl_agenda is None:
             sl_agenda = []
-            for item in hr_agenda['items']:
-                slovene = translate_text(item['text'], 'sr', 'sl')
+            translations = translate_non_empty(translator, [item['text'] for item in hr_agenda['items']],
+                                               NLLB_LANG_CODES['hr'], NLLB_LANG_CODES['sl'])
+            for item, slovene in zip(hr_agenda['items'], translations):
                 sl_agenda.append({
                     'n': item['n'],
                     'text': slovene
@@ -190,7 +207,7 @@ def parse_agendas(xml_root):
         elif hr_agenda is not None and sl_agenda is not None and sr_agenda is None:
             sr_agenda = []
             for item in hr_agenda['items']:
-                serbo_croatian_cyrilic = cyrtranslit.to_cyrillic(item['text'])
+                serbo_croatian_cyrilic = cyrtranslit.to_cyrillic(item['text']) if (item['text'] or '').strip() else ''
                 sr_agenda.append({
                     'n': item['n'],
                     'text': serbo_croatian_cyrilic
@@ -204,7 +221,7 @@ def parse_agendas(xml_root):
         elif sl_agenda is not None and sr_agenda is not None and hr_agenda is None:
             hr_agenda = []
             for item in sl_agenda['items']:
-                serbo_croatian_latinic = cyrtranslit.to_latin(item['text'])
+                serbo_croatian_latinic = cyrtranslit.to_latin(item['text']) if (item['text'] or '').strip() else ''
                 hr_agenda.append({
                     'n': item['n'],
                     'text': serbo_croatian_latinic
@@ -224,27 +241,41 @@ def parse_agendas(xml_root):
 
 
 
-def batch_lemmatize(texts, lang, sentence_ids=None, batch_size=64, n_process=1):
+# texts can be any iterable (e.g. translations as they are decoded), then number_of_texts has to be given
+def batch_lemmatize(texts, lang, sentence_ids=None, batch_size=64, n_process=1, number_of_texts=None,
+                    show_progress=True, sr_lemmatization=None):
     global proper_nouns
 
+    # serbian text lemmatized with the croatian pipeline
+    is_transliterated = lang == 'sr' and (sr_lemmatization or SR_LEMMATIZATION) == 'hr_transliterated'
+
     if lang == 'sl':
         nlp = nlp_sl
-    elif lang == 'hr':
+    elif lang == 'hr' or is_transliterated:
         nlp = nlp_hr
     elif lang == 'sr':
+        ensure_sr_model_loaded()
         nlp = nlp_sr
     else:
         print(f"batch_lemmatize(): language '{lang}' not supported")
         return [[] for _ in texts]
 
+    if number_of_texts is None:
+        number_of_texts = len(texts)
+
+    if is_transliterated:
+        texts = (cyrtranslit.to_latin(text, 'sr') for text in texts)
+
     if sentence_ids is None:
-        sentence_ids = [f"0" for _ in texts]
+        sentence_ids = [f"0" for _ in range(number_of_texts)]
 
     results = []
+    instrumentation.count("lemmatized_sentences", number_of_texts)
 
     disable_comps = [c for c in ("parser") if c in nlp.pipe_names]
     with nlp.select_pipes(disable=disable_comps):
-        with alive_bar(len(texts), title=f"Lemmatizing ({lang})", force_tty=True) as bar:
+        with alive_bar(number_of_texts, title=f"Lemmatizing ({lang})", force_tty=True,
+                       disable=not show_progress) as bar:
             bar(0)
             for doc, sid in zip(nlp.pipe(texts, batch_size=batch_size, n_process=n_process), sentence_ids):
                 words = []
@@ -256,6 +287,10 @@ def batch_lemmatize(texts, lang, sentence_ids=None, batch_size=64, n_process=1):
                     word["text"] = token.text
                     word["propn"] = 1 if token.pos_ == "PROPN" else 0
 
+                    if is_transliterated:
+                        word["lemma"] = cyrtranslit.to_cyrillic(word["lemma"], 'sr')
+                        word["text"] = cyrtranslit.to_cyrillic(word["text"], 'sr')
+
                     # Adjust join attribute (needed to reconstruct the original text)
                     word["join"] = "natural"
                     if i < len(doc) - 1 and not token.whitespace_:
@@ -264,9 +299,10 @@ def batch_lemmatize(texts, lang, sentence_ids=None, batch_size=64, n_process=1):
                     words.append(word)
 
                     if token.pos_ == "PROPN":
-                        proper_nouns.add(token.lemma_)
+                        proper_nouns.add(word["lemma"])
 
                 results.append(words)
+                instrumentation.count("lemmatized_tokens", len(words))
                 bar()
 
     return results
@@ -401,229 +437,254 @@ def parse_speeches(xml_root):
     return sentences, notes
 
 
-def translate_sentences(sentences, source_lang, target_lang, chunk_size=10, num_beams=5):
-    ensure_translation_model_loaded()
+def transliterate(text, target_lang):
+    return cyrtranslit.to_cyrillic(text, 'sr') if target_lang == 'sr' else cyrtranslit.to_latin(text, 'sr')
 
-    translations = []
 
-    tokenizer.src_lang = source_lang
-    with torch.no_grad():
-        with alive_bar(len(sentences), title=f"Translating {source_lang}→{target_lang}", force_tty=True) as bar:
-            bar(0)
-            for start in range(0, len(sentences), chunk_size):
-                end = start + chunk_size
-                chunk = sentences[start:end]
+# saves a random sample of transliterated sentences next to their NLLB translations
+def save_translation_quality_sample(texts, source_lang, target_lang, sentence_ids, transliterations):
+    sample = random.sample(range(len(texts)), min(TRANSLATION_QUALITY_SAMPLE_SIZE, len(texts)))
+    translations = translate_sentences(translator, [texts[i] for i in sample], NLLB_LANG_CODES[source_lang],
+                                       NLLB_LANG_CODES[target_lang])
 
-                encoded = tokenizer(chunk, return_tensors="pt", padding=True, truncation=True, max_length=512).to(device)
-                generated_tokens = model.generate(
-                    **encoded,
-                    forced_bos_token_id=get_lang_id(tokenizer, target_lang),
-                    num_beams=num_beams,
-                    early_stopping=True,
-                    length_penalty=1.2,
-                    max_new_tokens=128,
-                )
+    with open(TRANSLATION_QUALITY_SAMPLE_FILE, 'a', encoding='utf-8') as file:
+        for i, translation in zip(sample, translations):
+            file.write(json.dumps({
+                'sentence_id': sentence_ids[i],
+                'direction': f"{source_lang}->{target_lang}",
+                'source': texts[i],
+                'transliteration': transliterations[i],
+                'nllb': translation
+            }, ensure_ascii=False) + "\n")
 
-                decoded = tokenizer.batch_decode(generated_tokens, skip_special_tokens=True)
-                translations.extend(decoded)
 
-                # free intermediate tensors and clear cached GPU memory
-                if device == "cuda":
-                    del encoded, generated_tokens
-                    torch.cuda.empty_cache()
+# translates (or transliterates, see TRANSLATION_PLAN) the sentences and lemmatizes the translations,
+# variant_translations are translations of sl sentences into the other script variant (hr for sr and vice versa)
+def translate_or_transliterate(texts, source_lang, target_lang, sentence_ids, variant_translations=None):
+    plan = TRANSLATION_PLAN.get((source_lang, target_lang), 'nllb')
+    if plan != 'transliterate' or (source_lang == 'sl' and variant_translations is None):
+        return translate_and_lemmatize(translator, batch_lemmatize, texts, NLLB_LANG_CODES[source_lang],
+                                       NLLB_LANG_CODES[target_lang], target_lang, sentence_ids)
 
-                bar(len(chunk))
+    transliterations = [transliterate(text, target_lang)
+                        for text in (texts if variant_translations is None else variant_translations)]
+    instrumentation.count("transliterated_sentences", len(transliterations))
 
-    return translations
+    if TRANSLATION_QUALITY_SAMPLE_SIZE > 0:
+        save_translation_quality_sample(texts, source_lang, target_lang, sentence_ids, transliterations)
 
+    with instrumentation.stage("lemmatize"):
+        lemmatizations = batch_lemmatize(transliterations, target_lang, sentence_ids)
 
-def translate_meeting(meeting):
-    start_time = time.time()
+    return transliterations, lemmatizations
 
-    # lists for sentence ids and texts by language
-    hr_ids, hr_texts = [], []
-    sr_ids, sr_texts = [], []
-    sl_ids, sl_texts = [], []
+
+# translations of sentences in the original language are appended in this order
+TRANSLATION_TARGETS = {'hr': ('sl', 'sr'), 'sr': ('hr', 'sl'), 'sl': ('hr', 'sr')}
+
+
+# translates the sentences of the meetings, sentences of all meetings are translated together, so batches are full
+# also when meetings are short, and NLLB directions with the same target language (e.g. hr -> sl and sr -> sl) share
+# batches (translations are appended to their sentences)
+def translate_meetings(meetings):
+    start_time = time.time()
 
     # filter out none sentences
-    meeting['sentences'] = [sentence for sentence in meeting['sentences'] if sentence is not None]
-
-    for sentence in meeting['sentences']:
-        if sentence['original_language'] == 'hr':
-            hr_ids.append(sentence['id'])
-            hr_texts.append(sentence['translations'][0]['text'])
-        elif sentence['original_language'] == 'sr':
-            sr_ids.append(sentence['id'])
-            sr_texts.append(sentence['translations'][0]['text'])
-        elif sentence['original_language'] == 'sl':
-            sl_ids.append(sentence['id'])
-            sl_texts.append(sentence['translations'][0]['text'])
-
-    # HR -> SL, SR
-    if len(hr_texts) > 0:
-        hr2sl = translate_sentences(hr_texts, 'hrv_Latn', 'slv_Latn')
-        hr2sr = translate_sentences(hr_texts, 'hrv_Latn', 'srp_Cyrl')
-
-        lemm_sl = batch_lemmatize(hr2sl, 'sl', hr_ids)
-        lemm_sr = batch_lemmatize(hr2sr, 'sr', hr_ids)
-
-        for i, sid in enumerate(hr_ids):
-            sentence_index = next((index for (index, d) in enumerate(meeting['sentences']) if d['id'] == sid), None)
-            if sentence_index is None:
+    for meeting in meetings:
+        meeting['sentences'] = [sentence for sentence in meeting['sentences'] if sentence is not None]
+
+    # sentences of all meetings by their language, sentences without translatable words (numbers, names, ...) are
+    # copied into the other languages (transliterated where the script differs) without translation and lemmatization
+    sentences_by_lang = {lang: [] for lang in TRANSLATION_TARGETS}
+    for meeting in meetings:
+        number_of_bypassed = 0
+        for sentence in meeting['sentences']:
+            source_lang = sentence['original_language']
+            if source_lang not in sentences_by_lang:
                 continue
 
-            translation_sl = {
-                'lang': 'sl',
-                'original': 0,
-                'speaker': meeting['sentences'][sentence_index]['speaker'],
-                'text': hr2sl[i],
-                'words': lemm_sl[i]
-            }
-            translation_sr = {
-                'lang': 'sr',
-                'original': 0,
-                'speaker': meeting['sentences'][sentence_index]['speaker'],
-                'text': hr2sr[i],
-                'words': lemm_sr[i]
-            }
+            if is_translation_bypassed(sentence['translations'][0]['words']):
+                for target_lang in TRANSLATION_TARGETS[source_lang]:
+                    convert_text = (lambda text, lang=target_lang: transliterate(text, lang)) \
+                        if (source_lang == 'sr') != (target_lang == 'sr') else None
+                    sentence['translations'].append(copy_translation(sentence, target_lang, convert_text))
+                number_of_bypassed += 1
+            else:
+                sentences_by_lang[source_lang].append(sentence)
+
+        instrumentation.count("bypassed_sentences", number_of_bypassed)
+        print(f"Copied {number_of_bypassed} of {len(meeting['sentences'])} sentences of {meeting['id']} without "
+              f"translation")
+
+    directions = [(source_lang, target_lang) for source_lang, target_langs in TRANSLATION_TARGETS.items()
+                  for target_lang in target_langs if sentences_by_lang[source_lang]]
+
+    # translations and lemmatizations by direction
+    results = {}
+
+    # directions translated with NLLB, sentences of all source languages with the same target language together
+    for target_lang in TRANSLATION_TARGETS:
+        source_langs = [source_lang for source_lang, lang in directions
+                        if lang == target_lang and TRANSLATION_PLAN.get((source_lang, target_lang), 'nllb') == 'nllb']
+        if not source_langs:
+            continue
 
-            meeting['sentences'][sentence_index]['translations'].append(translation_sl)
-            meeting['sentences'][sentence_index]['translations'].append(translation_sr)
+        sentences = [sentence for source_lang in source_langs for sentence in sentences_by_lang[source_lang]]
+        translations, lemmatizations = translate_and_lemmatize(
+            translator, batch_lemmatize, [sentence['translations'][0]['text'] for sentence in sentences],
+            [NLLB_LANG_CODES[sentence['original_language']] for sentence in sentences],
+            NLLB_LANG_CODES[target_lang], target_lang, [sentence['id'] for sentence in sentences])
+
+        start = 0
+        for source_lang in source_langs:
+            end = start + len(sentences_by_lang[source_lang])
+            results[(source_lang, target_lang)] = (translations[start:end], lemmatizations[start:end])
+            start = end
+
+    # transliterated directions, serbian (croatian) translation of sl sentences is transliterated from the croatian
+    # (serbian) one
+    for source_lang, target_lang in directions:
+        if (source_lang, target_lang) in results:
+            continue
 
-    hr_time = time.time()
-    print(f"Translating HR to SL & SR sentences in {hr_time - start_time} seconds")
+        sentences = sentences_by_lang[source_lang]
+        variant_lang = 'hr' if target_lang == 'sr' else 'sr'
+        variant_translations = results.get((source_lang, variant_lang), (None, None))[0] if source_lang == 'sl' \
+            else None
+        results[(source_lang, target_lang)] = translate_or_transliterate(
+            [sentence['translations'][0]['text'] for sentence in sentences], source_lang, target_lang,
+            [sentence['id'] for sentence in sentences], variant_translations=variant_translations)
+
+    for source_lang, target_lang in directions:
+        translations, lemmatizations = results[(source_lang, target_lang)]
+        for sentence, translated_text, lemmatization in zip(sentences_by_lang[source_lang], translations,
+                                                            lemmatizations):
+            sentence['translations'].append({
+                'lang': target_lang,
+                'original': 0,
+                'speaker': sentence['speaker'],
+                'text': translated_text,
+                'words': lemmatization
+            })
 
-    # SR -> HR (latinic) and SL
-    if len(sr_texts) > 0:
-        sr2sl = translate_sentences(sr_texts, 'srp_Cyrl', 'slv_Latn')
-        sr2hr = translate_sentences(sr_texts, 'srp_Cyrl', 'hrv_Latn')
+    end_time = time.time()
+    number_of_sentences = sum(len(sentences) for sentences in sentences_by_lang.values())
+    print(f"Translated {number_of_sentences} sentences of {len(meetings)} meetings in {end_time - start_time} seconds")
 
-        lemm_hr = batch_lemmatize(sr2hr, 'hr', sr_ids)
-        lemm_sl = batch_lemmatize(sr2sl, 'sl', sr_ids)
 
-        for i, sid in enumerate(sr_ids):
-            sentence_index = next((index for (index, d) in enumerate(meeting['sentences']) if d['id'] == sid), None)
-            if sentence_index is None:
-                continue
+def translate_meeting(meeting):
+    translate_meetings([meeting])
 
-            translation_hr = {
-                'lang': 'hr',
-                'original': 0,
-                'speaker': meeting['sentences'][sentence_index]['speaker'],
-                'text': sr2hr[i],
-                'words': lemm_hr[i]
-            }
-            translation_sl = {
-                'lang': 'sl',
-                'original': 0,
-                'speaker': meeting['sentences'][sentence_index]['speaker'],
-                'text': sr2sl[i],
-                'words': lemm_sl[i]
-            }
 
-            meeting['sentences'][sentence_index]['translations'].append(translation_hr)
-            meeting['sentences'][sentence_index]['translations'].append(translation_sl)
+# parses the meeting without translations, returns the meeting and coordinates of its words
+def read_zapisnik(xml_root, coords_sidecar_path=None):
+    meeting_id = xml_root.attrib['{http://www.w3.org/XML/1998/namespace}id']
+    with instrumentation.stage("speech_parse"):
+        sentences, notes = parse_speeches(xml_root)
+    with instrumentation.stage("agendas"):
+        agendas = parse_agendas(xml_root)
 
-    sr_time = time.time()
-    print(f"Translating SR to HR & SL sentences in {sr_time - hr_time} seconds")
+    meeting = {
+        'id': meeting_id,
+        'date': parse_date_from_id(meeting_id),
+        'titles': parse_titles(xml_root, NAMESPACE_MAPPINGS),
+        'agendas': agendas,
+        'sentences': [sentence for sentence in sentences if sentence is not None],
+        'notes': notes,
+        'corpus': CORPUS_NAME
+    }
+    instrumentation.count("sentences", len(meeting['sentences']))
+    instrumentation.count("tokens", sum(len(sentence['translations'][0]['words']) for sentence in meeting['sentences']))
 
-    # SL -> HR (latin) and SR (cyrillic)
-    if len(sl_texts) > 0:
-        sl2hr = translate_sentences(sl_texts, 'slv_Latn', 'hrv_Latn')
-        sl2sr = translate_sentences(sl_texts, 'slv_Latn', 'srp_Cyrl')
+    with instrumentation.stage("coords_index"):
+        coords_index = build_coords_index(xml_root, NAMESPACE_MAPPINGS, coords_sidecar_path)
 
-        lemm_hr = batch_lemmatize(sl2hr, 'hr', sl_ids)
-        lemm_sr = batch_lemmatize(sl2sr, 'sr', sl_ids)
+    return meeting, coords_index
 
-        for i, sid in enumerate(sl_ids):
-            sentence_index = next((index for (index, d) in enumerate(meeting['sentences']) if d['id'] == sid), None)
-            if sentence_index is None:
-                continue
 
-            translation_hr = {
-                'lang': 'hr',
-                'original': 0,
-                'speaker': meeting['sentences'][sentence_index]['speaker'],
-                'text': sl2hr[i],
-                'words': lemm_hr[i]
-            }
-            translation_sr = {
-                'lang': 'sr',
-                'original': 0,
-                'speaker': meeting['sentences'][sentence_index]['speaker'],
-                'text': sl2sr[i],
-                'words': lemm_sr[i]
-            }
+def parse_zapisnik(xml_root, coords_sidecar_path=None):
+    start_time = time.time()
 
-            meeting['sentences'][sentence_index]['translations'].append(translation_hr)
-            meeting['sentences'][sentence_index]['translations'].append(translation_sr)
+    meeting, coords_index = read_zapisnik(xml_root, coords_sidecar_path)
+    translate_meeting(meeting)
+    transformed_sentences, transformed_words = transform_meeting(meeting, coords_index)
 
-    end_time = time.time()
-    print(f"Translating SL to HR & SR sentences in {end_time - sr_time} seconds")
-    print(f"Translated meeting in {end_time - start_time} seconds")
+    mid_time = time.time()
+    print(f"Parsed meeting in {mid_time - start_time} seconds")
 
-    return
+    return meeting, transformed_sentences, transformed_words
 
 
-def parse_zapisnik(xml_root):
+# memory-bounded parse_zapisnik and save_meeting: XML is released as soon as speeches and coordinates are read, then
+# sentences are translated, transformed and written in chunks of segments, returns the meeting (without sentences)
+# and number of bytes written
+def parse_and_save_zapisnik_bounded(xml_root, coords_sidecar_path, destination, compression="none", shards=None,
+                                    max_memory_mb=None):
     start_time = time.time()
     meeting_id = xml_root.attrib['{http://www.w3.org/XML/1998/namespace}id']
-    sentences, notes = parse_speeches(xml_root)
+    with instrumentation.stage("speech_parse"):
+        sentences, notes = parse_speeches(xml_root)
+    with instrumentation.stage("agendas"):
+        agendas = parse_agendas(xml_root)
 
+    # sentences are written into the meeting document chunk by chunk
     meeting = {
         'id': meeting_id,
         'date': parse_date_from_id(meeting_id),
         'titles': parse_titles(xml_root, NAMESPACE_MAPPINGS),
-        'agendas': parse_agendas(xml_root),
-        'sentences': sentences,
+        'agendas': agendas,
+        'sentences': [],
         'notes': notes,
         'corpus': CORPUS_NAME
     }
 
-    translate_meeting(meeting)
-
-    # gather data about sentences and words
-    coords_index = build_coords_index(xml_root, NAMESPACE_MAPPINGS)
-    transformed_sentences = transform_sentences_fast(meeting, coords_index=coords_index)
-    transformed_words = transform_words_fast(meeting, coords_index=coords_index)
+    with instrumentation.stage("coords_index"):
+        coords_index = build_coords_index(xml_root, NAMESPACE_MAPPINGS, coords_sidecar_path)
 
-    mid_time = time.time()
-    print(f"Parsed meeting in {mid_time - start_time} seconds")
+    # XML tree is not needed anymore
+    xml_root.clear()
 
-    return meeting, transformed_sentences, transformed_words
+    with instrumentation.stage("write"):
+        writer = open_meeting_writer(meeting, destination, compression, shards)
 
+    for chunk in iter_sentence_chunks(sentences, max_memory_mb):
+        chunk_meeting = {'id': meeting_id, 'sentences': chunk}
+        translate_meeting(chunk_meeting)
+        instrumentation.count("sentences", len(chunk_meeting['sentences']))
+        instrumentation.count("tokens", sum(len(sentence['translations'][0]['words'])
+                                            for sentence in chunk_meeting['sentences']))
 
-def parse(source, destination, from_idx=0, to_idx=-1):
-    files = os.listdir(source)
-    for i, file in enumerate(files):
-
-        if i < from_idx:
-            continue
+        with instrumentation.stage("transform"):
+            transformed_sentences = transform_sentences_fast(chunk_meeting, coords_index=coords_index)
+        with instrumentation.stage("write"):
+            write_meeting_chunk(writer, chunk_meeting['sentences'], transformed_sentences,
+                                iter_transformed_words(chunk_meeting, coords_index))
 
-        if i >= to_idx and to_idx != -1:
-            break
+    with instrumentation.stage("write"):
+        written_bytes = close_meeting_writer(writer)
 
-        if not file.endswith(".xml") or not file.startswith("DezelniZborKranjski"):
-            continue
-
-        path = os.path.join(source, file)
-
-        xml_tree = ET.parse(path)
-        xml_root = xml_tree.getroot()
+    end_time = time.time()
+    print(f"Parsed and saved meeting in {end_time - start_time} seconds")
 
-        print("parse(): processing file " + file)
+    return meeting, written_bytes
 
-        # initialize parser
-        zapisnik, povedi, besede = parse_zapisnik(xml_root)
 
-        # save data to jsonl files
-        file_path = os.path.join(destination, zapisnik["id"] + "_meeting.jsonl")
-        save_to_jsonl([zapisnik], file_path)
+# corpus specific steps of the parse pipeline (see parse_files in utils)
+CORPUS = {
+    "translator": translator,
+    "read_meeting": read_zapisnik,
+    "parse_meeting": parse_zapisnik,
+    "parse_and_save_meeting_bounded": parse_and_save_zapisnik_bounded,
+    "translate_meetings": translate_meetings,
+}
 
-        file_path = os.path.join(destination, zapisnik["id"] + "_sentences.jsonl")
-        save_to_jsonl(povedi, file_path)
 
-        file_path = os.path.join(destination, zapisnik["id"] + "_words.jsonl")
-        save_to_jsonl(besede, file_path)
+def parse(source, destination, from_idx=0, to_idx=-1, compression="none", shard_size_mb=None, work_partition=None,
+          partition_by="size", run_log_path=None, max_memory_mb=None, translation_group_sentences=None, workers=1,
+          cpu_plan=None, decoding_profile=None):
+    if decoding_profile is not None:
+        translator["decoding_profile"] = decoding_profile
 
-        print(f"parse(): {i+1}/{len(files)} files processed\n")
\ No newline at end of file
+    parse_corpus(CORPUS, source, destination, is_yuparl_meeting_file, from_idx, to_idx, compression, shard_size_mb,
+                 work_partition, partition_by, run_log_path, max_memory_mb, translation_group_sentences, workers,
+                 cpu_plan)
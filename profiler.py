@@ -0,0 +1,68 @@
+import cProfile
+import functools
+import os
+import pstats
+import time
+
+# directory for profiles of the current run, also read by worker processes (they inherit the environment)
+PROFILE_DIR_ENV = "PARLAVIS_PROFILE_DIR"
+
+# profile that is enabled in this process, forked worker processes inherit it from their parent
+active_profile = None
+
+
+def get_profile_path(profile_dir, name):
+    return os.path.join(profile_dir, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+
+
+# writes caller;callee edges with the callee's own time (in microseconds) in the collapsed-stack format
+# (cProfile does not keep whole stacks, so the flame graph is two frames deep)
+def save_collapsed_stacks(profile, file_path):
+    stats = pstats.Stats(profile).stats
+
+    def frame_name(function):
+        file_name, line, function_name = function
+        return f"{function_name} ({os.path.basename(file_name)}:{line})"
+
+    with open(file_path, "w", encoding="utf-8") as file:
+        for function, (_, _, total_time, _, callers) in stats.items():
+            if not callers:
+                file.write(f"{frame_name(function)} {round(total_time * 1e6)}\n")
+            for caller, (_, _, caller_total_time, _) in callers.items():
+                file.write(f"{frame_name(caller)};{frame_name(function)} {round(caller_total_time * 1e6)}\n")
+
+
+# runs the function under cProfile and saves .prof (for snakeviz, pstats, ...) and .collapsed
+# (for flamegraph.pl, speedscope, ...) files
+def run_profiled(function, profile_dir, name, *args, **kwargs):
+    global active_profile
+    os.makedirs(profile_dir, exist_ok=True)
+    os.environ[PROFILE_DIR_ENV] = os.path.abspath(profile_dir)
+
+    # only one profiler can be active in a process (on Python 3.12+ enabling a second one raises an error), so a
+    # worker disables the profile inherited from its parent before it starts its own, the parent is not affected
+    if active_profile is not None:
+        active_profile.disable()
+
+    profile = cProfile.Profile()
+    active_profile = profile
+    try:
+        return profile.runcall(function, *args, **kwargs)
+    finally:
+        active_profile = None
+        profile_path = get_profile_path(profile_dir, name)
+        profile.dump_stats(profile_path + ".prof")
+        save_collapsed_stacks(profile, profile_path + ".collapsed")
+        print(f"run_profiled(): saved profile to {profile_path}.prof and {profile_path}.collapsed")
+
+
+# decorator for functions that run in worker processes, profiles them only when the run is profiled
+def profile_worker(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        profile_dir = os.environ.get(PROFILE_DIR_ENV)
+        if not profile_dir:
+            return function(*args, **kwargs)
+        return run_profiled(function, profile_dir, f"worker-{function.__name__}", *args, **kwargs)
+
+    return wrapper
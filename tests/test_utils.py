@@ -0,0 +1,110 @@
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import utils
+from utils import (UNTRANSLATABLE_TOKEN_PATTERN, XML_ID, build_coords_index, copy_translation, get_escalated_indices,
+                   get_mean_token_scores, is_translation_bypassed, is_yuparl_meeting_file, list_work_files,
+                   translate_non_empty, write_coords_sidecar)
+
+NAMESPACE_MAPPINGS = {"ns0": "http://www.tei-c.org/ns/1.0"}
+
+
+def make_words(*texts, propn=0):
+    return [{"text": text, "lemma": text, "propn": propn} for text in texts]
+
+
+@pytest.mark.parametrize("text", ["II", "XII.", "IV", "MCMXIV", "V.", "12.", "3,5", "a)", "§", "–"])
+def test_untranslatable_tokens(text):
+    assert UNTRANSLATABLE_TOKEN_PATTERN.match(text)
+
+
+@pytest.mark.parametrize("text", ["CIVIL", "MIL", "DIM", "VID", "MILD", "IIII", "V", "I"])
+def test_words_are_not_roman_numerals(text):
+    assert not UNTRANSLATABLE_TOKEN_PATTERN.match(text)
+
+
+def test_sentence_of_numerals_is_bypassed():
+    assert is_translation_bypassed(make_words("XII.", "12.", "."))
+
+
+def test_sentence_of_capitalized_words_is_translated():
+    assert not is_translation_bypassed(make_words("CIVIL", "MILD", "."))
+
+
+def test_sentence_of_proper_nouns_is_bypassed():
+    assert is_translation_bypassed(make_words("Ivan", "Hribar", propn=1))
+
+
+def test_empty_sentence_is_copied_as_empty_translation():
+    sentence = {"id": "s1", "speaker": "Predsednik", "translations": [{"lang": "sl", "text": "", "words": []}]}
+
+    assert is_translation_bypassed(sentence["translations"][0]["words"])
+    translation = copy_translation(sentence, "de")
+    assert translation["text"] == "" and translation["words"] == []
+
+
+def test_forced_language_token_does_not_hide_weak_translation():
+    torch = pytest.importorskip("torch")
+    # transition scores of greedy decoding: the forced target language token has log-probability 0, the second
+    # translation is shorter and padded (pad token 1)
+    token_scores = torch.tensor([[0.0, -1.2, -1.0, -0.8], [0.0, -0.1, -0.3, float("-inf")]])
+    generated_tokens = torch.tensor([[256162, 1180, 2491, 2], [256162, 7730, 2, 1]])
+
+    scores = get_mean_token_scores(token_scores, generated_tokens, 1)
+
+    assert scores == pytest.approx([-1.0, -0.2])
+    # with the language token the first mean would be -0.75, above the threshold
+    assert get_escalated_indices(["Seja je odprta.", "Ja."], ["Die Sitzung ist eröffnet.", "Ja."], scores, -0.9,
+                                 (0.5, 2.0)) == [0]
+
+
+def make_sidecar_xml(count):
+    root = ET.Element("{%s}TEI" % NAMESPACE_MAPPINGS["ns0"])
+    for i in range(count):
+        word = ET.SubElement(root, "{%s}w" % NAMESPACE_MAPPINGS["ns0"], {"fromPage": "0", "toPage": "0"})
+        word.set(XML_ID, f"w{i}")
+    return root
+
+
+def test_coords_sidecar_is_used(tmp_path, capsys):
+    sidecar_path = str(tmp_path / "meeting.coords.bin")
+    write_coords_sidecar({"w0": [(0, 1, 2, 3, 4)], "w1": [(0, 5, 6, 7, 8)]}, sidecar_path)
+
+    assert build_coords_index(make_sidecar_xml(2), NAMESPACE_MAPPINGS, sidecar_path)["w1"] == [(0, 5, 6, 7, 8)]
+    assert "warning" not in capsys.readouterr().out
+
+
+def test_stale_coords_sidecar_is_reported(tmp_path, capsys):
+    sidecar_path = str(tmp_path / "meeting.coords.bin")
+    write_coords_sidecar({"w0": [(0, 1, 2, 3, 4)]}, sidecar_path)
+
+    build_coords_index(make_sidecar_xml(2), NAMESPACE_MAPPINGS, sidecar_path)
+    assert "warning" in capsys.readouterr().out
+
+
+def test_missing_coords_sidecar_is_reported(tmp_path, capsys):
+    assert build_coords_index(make_sidecar_xml(2), NAMESPACE_MAPPINGS, str(tmp_path / "meeting.coords.bin")) == {}
+    assert "warning" in capsys.readouterr().out
+
+
+def test_empty_agenda_items_are_not_translated(monkeypatch):
+    inputs = []
+
+    def translate_sentences(translator, sentences, source_lang, target_lang):
+        inputs.extend(sentences)
+        return [sentence.upper() for sentence in sentences]
+
+    monkeypatch.setattr(utils, "translate_sentences", translate_sentences)
+
+    assert translate_non_empty(None, ["Dnevni red", None, " ", "Volitve "], "slv_Latn", "deu_Latn") == \
+        ["DNEVNI RED", "", "", "VOLITVE"]
+    assert inputs == ["Dnevni red", "Volitve"]
+
+
+def test_yuparl_meeting_files_are_selected(tmp_path):
+    for file in ["yu1Parl.xml", "yu1Parl.ana.xml", "yu1Parl-en.xml", "yu1Parl_1919-03-16_PP_1.xml",
+                 "yu1Parl_1919-03-16_PP_1.ana.xml", "yu1Parl_1919-03-16_PP_1-en.xml", "yu1Parl_1919-03-16_PP_1.pdf"]:
+        (tmp_path / file).write_text("<TEI/>")
+
+    assert list_work_files(str(tmp_path), is_yuparl_meeting_file) == ["yu1Parl_1919-03-16_PP_1.xml"]
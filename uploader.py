@@ -4,6 +4,9 @@ import time
 
 from elasticsearch import Elasticsearch, helpers
 
+from utils import get_partition_tag, get_shard_document_type, is_shards_index_file, list_work_files, open_jsonl, \
+    strip_compression_extension
+
 STATE_FILE = "uploader_state.json"
 
 
@@ -436,17 +439,17 @@ ATTENDEES_INDEX_SETTINGS = {
 }
 
 
-def load_progress():
-    if os.path.exists(STATE_FILE):
-        with open(STATE_FILE, 'r', encoding="utf-8") as file:
+def load_progress(state_file=STATE_FILE):
+    if os.path.exists(state_file):
+        with open(state_file, 'r', encoding="utf-8") as file:
             state = json.load(file)
             return state
 
     return dict()
 
 
-def save_progress(state):
-    with open(STATE_FILE, 'w', encoding="utf-8") as file:
+def save_progress(state, state_file=STATE_FILE):
+    with open(state_file, 'w', encoding="utf-8") as file:
         json.dump(state, file)
 
 
@@ -496,6 +499,33 @@ def upload_to_elasticsearch(es, elements, index_name):
     return failed_count == 0
 
 
+# Elasticsearch index for each document type of shards
+SHARD_INDEX_NAMES = {
+    "meetings": MEETINGS_INDEX_NAME,
+    "sentences": SENTENCES_INDEX_NAME,
+    "words": WORDS_INDEX_NAME,
+}
+SHARD_UPLOAD_CHUNK_SIZE = 10000
+
+
+# uploads a shard sequentially in chunks, so the whole shard is never held in memory
+def upload_shard(es, file_path, index_name):
+    is_uploaded = True
+
+    with open_jsonl(file_path, "rb") as file:
+        chunk = []
+        for line in file:
+            chunk.append(line)
+            if len(chunk) == SHARD_UPLOAD_CHUNK_SIZE:
+                is_uploaded = upload_to_elasticsearch(es, chunk, index_name) and is_uploaded
+                chunk = []
+
+        if chunk:
+            is_uploaded = upload_to_elasticsearch(es, chunk, index_name) and is_uploaded
+
+    return is_uploaded
+
+
 def create_index(es, index_name, settings, mappings, delete_index_if_exists):
     if not es.indices.exists(index=index_name):
         print("Creating index: " + index_name + "\n")
@@ -507,7 +537,8 @@ def create_index(es, index_name, settings, mappings, delete_index_if_exists):
         es.indices.create(index=index_name, settings=settings, mappings=mappings)
 
 
-def upload(source_dir, elasticsearch_host, elasticsearch_port, delete_index_if_exists=False):
+def upload(source_dir, elasticsearch_host, elasticsearch_port, delete_index_if_exists=False, work_partition=None,
+           partition_by="size"):
     # initialize the Elasticsearch client
     es = Elasticsearch(
         [{'host': elasticsearch_host, 'port': elasticsearch_port, 'scheme': 'http'}],
@@ -524,10 +555,15 @@ def upload(source_dir, elasticsearch_host, elasticsearch_port, delete_index_if_e
     create_index(es, PLACES_INDEX_NAME, PLACES_INDEX_SETTINGS, {}, delete_index_if_exists)
     create_index(es, ATTENDEES_INDEX_NAME, ATTENDEES_INDEX_SETTINGS, {}, delete_index_if_exists)
 
-    state = load_progress()
+    # each part of partitioned work keeps its own progress
+    state_file = STATE_FILE.replace(".json", f"-{get_partition_tag(work_partition)}.json") if work_partition else \
+        STATE_FILE
+    state = load_progress(state_file)
 
     # Upload the data to Elasticsearch
-    jsonl_files = os.listdir(source_dir)
+    # sorted files (only the given part of them if work is partitioned between machines), index of shards is not
+    # uploaded
+    jsonl_files = list_work_files(source_dir, lambda f: not is_shards_index_file(f), work_partition, partition_by)
     for i, jsonl_file in enumerate(jsonl_files):
 
         if jsonl_file in state and state[jsonl_file]["isDone"]:
@@ -542,24 +578,29 @@ def upload(source_dir, elasticsearch_host, elasticsearch_port, delete_index_if_e
         state[jsonl_file]["isDone"] = False
 
         file_path = os.path.join(source_dir, jsonl_file)
-        if jsonl_file.endswith("_meeting.jsonl"):
-            with open(file_path, "r", encoding="utf-8") as file:
+        # files can be compressed (.jsonl.gz, .jsonl.zst)
+        file_name = strip_compression_extension(jsonl_file)
+        shard_document_type = get_shard_document_type(jsonl_file)
+        if shard_document_type is not None:
+            state[jsonl_file]["isDone"] = upload_shard(es, file_path, SHARD_INDEX_NAMES[shard_document_type])
+        elif file_name.endswith("_meeting.jsonl"):
+            with open_jsonl(file_path, "rb") as file:
                 meetings = file.readlines()
                 state[jsonl_file]["isDone"] = upload_to_elasticsearch(es, meetings, MEETINGS_INDEX_NAME)
-        elif jsonl_file.endswith("_sentences.jsonl"):
-            with open(file_path, "r", encoding="utf-8") as file:
+        elif file_name.endswith("_sentences.jsonl"):
+            with open_jsonl(file_path, "rb") as file:
                 sentences = file.readlines()
                 state[jsonl_file]["isDone"] = upload_to_elasticsearch(es, sentences, SENTENCES_INDEX_NAME)
-        elif jsonl_file.endswith("_words.jsonl"):
-            with open(file_path, "r", encoding="utf-8") as file:
+        elif file_name.endswith("_words.jsonl"):
+            with open_jsonl(file_path, "rb") as file:
                 words = file.readlines()
                 state[jsonl_file]["isDone"] = upload_to_elasticsearch(es, words, WORDS_INDEX_NAME)
-        elif jsonl_file == "krajevna_imena.jsonl":
-            with open(file_path, "r", encoding="utf-8") as file:
+        elif file_name == "krajevna_imena.jsonl":
+            with open_jsonl(file_path, "rb") as file:
                 krajevna_imena = file.readlines()
                 state[jsonl_file]["isDone"] = upload_to_elasticsearch(es, krajevna_imena, PLACES_INDEX_NAME)
-        elif jsonl_file == "poslanci.jsonl":
-            with open(file_path, "r", encoding="utf-8") as file:
+        elif file_name == "poslanci.jsonl":
+            with open_jsonl(file_path, "rb") as file:
                 poslanci = file.readlines()
                 state[jsonl_file]["isDone"] = upload_to_elasticsearch(es, poslanci, ATTENDEES_INDEX_NAME)
         else:
@@ -569,7 +610,7 @@ def upload(source_dir, elasticsearch_host, elasticsearch_port, delete_index_if_e
         print("uploaded: " + jsonl_file)
         print(f"progress: {i}/{len(jsonl_files)}\n")
 
-        save_progress(state)
+        save_progress(state, state_file)
 
     set_refresh_interval(es, MEETINGS_INDEX_NAME)
     set_refresh_interval(es, SENTENCES_INDEX_NAME)
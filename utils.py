@@ -1,11 +1,524 @@
+import gc
+import gzip
+import io
 import json
+import mmap
+import multiprocessing
+import os
+import queue
+import re
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ET
+import zlib
 
+import instrumentation
+from instrumentation import get_rss_mb
+from profiler import profile_worker
 
+# orjson is optional, it is used for faster serialization if it is installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# zstandard is optional, it is needed only for .jsonl.zst files
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+JSONL_WRITE_BUFFER_SIZE = 1024 * 1024
+
+# Share of the CPUs of a parse worker used by translation (generation dominates the time), the rest is left to
+# lemmatization, which runs next to it
+TRANSLATION_CPU_SHARE = 0.75
+THREAD_ENVIRONMENT_VARIABLES = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+# file extensions of supported JSONL compressions
+JSONL_COMPRESSION_EXTENSIONS = {
+    "none": "",
+    "gzip": ".gz",
+    "zstd": ".zst",
+}
+GZIP_COMPRESSION_LEVEL = 6
+ZSTD_COMPRESSION_LEVEL = 3
+
+
+# returns the path of the JSONL file with the extension of the compression (e.g. _words.jsonl -> _words.jsonl.zst)
+def get_jsonl_path(file_path, compression="none"):
+    return file_path + JSONL_COMPRESSION_EXTENSIONS[compression]
+
+
+# removes the compression extension from the file name (e.g. _words.jsonl.zst -> _words.jsonl)
+def strip_compression_extension(file_name):
+    for extension in JSONL_COMPRESSION_EXTENSIONS.values():
+        if extension and file_name.endswith(extension):
+            return file_name[:-len(extension)]
+    return file_name
+
+
+# opens plain, gzip (.gz) or zstd (.zst) compressed file in binary mode ("rb" or "wb") based on its extension
+def open_jsonl(file_path, mode="rb"):
+    if file_path.endswith(JSONL_COMPRESSION_EXTENSIONS["gzip"]):
+        file = gzip.open(file_path, mode, compresslevel=GZIP_COMPRESSION_LEVEL)
+    elif file_path.endswith(JSONL_COMPRESSION_EXTENSIONS["zstd"]):
+        if zstandard is None:
+            raise ImportError("open_jsonl(): package 'zstandard' is required for '" + file_path + "'")
+        if "w" in mode:
+            file = zstandard.open(file_path, mode, cctx=zstandard.ZstdCompressor(level=ZSTD_COMPRESSION_LEVEL))
+        else:
+            file = zstandard.open(file_path, mode)
+    else:
+        return open(file_path, mode, buffering=JSONL_WRITE_BUFFER_SIZE)
+
+    # compressors are much faster with bigger writes than one line at a time
+    if "w" in mode:
+        return io.BufferedWriter(file, buffer_size=JSONL_WRITE_BUFFER_SIZE)
+    return io.BufferedReader(file, buffer_size=JSONL_WRITE_BUFFER_SIZE)
+
+
+# serializes an element into one JSONL line (utf-8 encoded)
+def dump_jsonl_line(element):
+    if orjson is not None:
+        return orjson.dumps(element, option=orjson.OPT_APPEND_NEWLINE)
+
+    return (json.dumps(element, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+# writes elements to an already opened binary file and returns number of elements and bytes written
+def write_jsonl(elements, file):
+    number_of_elements = 0
+    number_of_bytes = 0
+
+    for element in elements:
+        line = dump_jsonl_line(element)
+        file.write(line)
+        number_of_elements += 1
+        number_of_bytes += len(line)
+
+    return number_of_elements, number_of_bytes
+
+
+def print_write_throughput(number_of_elements, number_of_bytes, file_path, elapsed_time):
+    megabytes = number_of_bytes / 1024 / 1024
+    print("Saved " + str(number_of_elements) + " elements to " + file_path +
+          f" ({megabytes:.2f} MB in {elapsed_time:.2f} s, {megabytes / max(elapsed_time, 1e-9):.2f} MB/s)")
+
+
+# streams elements (list or generator) to the file and returns number of elements and (uncompressed) bytes written,
+# the file is compressed if its name ends with .gz or .zst
 def save_to_jsonl(elements, file_path):
-    with open(file_path, "w", encoding="utf-8") as file:
-        for element in elements:
-            file.write(json.dumps(element, ensure_ascii=False) + "\n")
-    print("Saved " + str(len(elements)) + " elements to " + file_path)
+    time_start = time.time()
+
+    with open_jsonl(file_path, "wb") as file:
+        number_of_elements, number_of_bytes = write_jsonl(elements, file)
+
+    print_write_throughput(number_of_elements, number_of_bytes, file_path, time.time() - time_start)
+
+    return number_of_elements, number_of_bytes
+
+
+# Shards contain documents of one type (meetings, sentences or words) of many meetings, e.g. words-00042.jsonl.zst.
+# A meeting is never split between two shards, a new shard is started when the current one exceeds max_bytes
+# (uncompressed). The index file maps each shard to the ids of meetings it contains.
+# When work is partitioned between machines, shard and index names contain the partition (e.g. words-1of4-00042.jsonl)
+SHARD_DOCUMENT_TYPES = ("meetings", "sentences", "words")
+SHARDS_INDEX_FILE_PATTERN = re.compile(r"^shards_index(-\d+of\d+)?\.json$")
+SHARD_FILE_PATTERN = re.compile(r"^(meetings|sentences|words)-(\d+of\d+-)?(\d{5})\.jsonl$")
+
+
+# returns document type of the shard file (meetings, sentences, words) or None if the file is not a shard
+def get_shard_document_type(file_name):
+    match = SHARD_FILE_PATTERN.match(strip_compression_extension(file_name))
+    return match.group(1) if match else None
+
+
+def is_shards_index_file(file_name):
+    return SHARDS_INDEX_FILE_PATTERN.match(file_name) is not None
+
+
+def get_partition_tag(work_partition):
+    return f"{work_partition[0]}of{work_partition[1]}" if work_partition else ""
+
+
+def open_shards(destination, compression="none", max_bytes=512 * 1024 * 1024, work_partition=None):
+    partition_tag = get_partition_tag(work_partition)
+    index_path = os.path.join(destination, f"shards_index-{partition_tag}.json" if partition_tag else
+                              "shards_index.json")
+    index = {}
+    if os.path.exists(index_path):
+        with open(index_path, "r", encoding="utf-8") as file:
+            index = json.load(file)
+
+    shards = {
+        "destination": destination,
+        "compression": compression,
+        "max_bytes": max_bytes,
+        "name_prefix": partition_tag + "-" if partition_tag else "",
+        "index_path": index_path,
+        "index": index,
+        "types": {}
+    }
+
+    # continue numbering after shards from previous runs, so they are not overwritten
+    for document_type in SHARD_DOCUMENT_TYPES:
+        numbers = [int(SHARD_FILE_PATTERN.match(strip_compression_extension(file_name)).group(3))
+                   for file_name in index if get_shard_document_type(file_name) == document_type]
+        shards["types"][document_type] = {
+            "number": max(numbers, default=-1),
+            "file": None,
+            "file_name": None,
+            "bytes": 0
+        }
+
+    return shards
+
+
+# returns the current shard of the document type, a new shard is started if the current one is full
+def get_current_shard(shards, document_type):
+    shard = shards["types"][document_type]
+
+    if shard["file"] is None or shard["bytes"] >= shards["max_bytes"]:
+        if shard["file"] is not None:
+            shard["file"].close()
+        shard["number"] += 1
+        shard["file_name"] = get_jsonl_path(f"{document_type}-{shards['name_prefix']}{shard['number']:05d}.jsonl",
+                                            shards["compression"])
+        shard["file"] = open_jsonl(os.path.join(shards["destination"], shard["file_name"]), "wb")
+        shard["bytes"] = 0
+        shards["index"][shard["file_name"]] = []
+
+    return shard
+
+
+# writes documents of one type of a meeting into the current shard of that type
+def write_to_shard(shards, document_type, meeting_id, elements):
+    shard = get_current_shard(shards, document_type)
+
+    time_start = time.time()
+    number_of_elements, number_of_bytes = write_jsonl(elements, shard["file"])
+    print_write_throughput(number_of_elements, number_of_bytes, shard["file_name"], time.time() - time_start)
+
+    shard["bytes"] += number_of_bytes
+    shards["index"][shard["file_name"]].append(meeting_id)
+
+    return number_of_elements, number_of_bytes
+
+
+# copies already serialized documents of one type of a meeting (temporary file) into the current shard of that type
+def copy_to_shard(shards, document_type, meeting_id, spool_file):
+    shard = get_current_shard(shards, document_type)
+
+    number_of_bytes = spool_file.tell()
+    spool_file.seek(0)
+    shutil.copyfileobj(spool_file, shard["file"], JSONL_WRITE_BUFFER_SIZE)
+
+    shard["bytes"] += number_of_bytes
+    shards["index"][shard["file_name"]].append(meeting_id)
+
+    return number_of_bytes
+
+
+def save_shards_index(shards):
+    with open(shards["index_path"], "w", encoding="utf-8") as file:
+        json.dump(shards["index"], file, indent=2)
+
+
+# saves documents of a meeting into three JSONL files (<id>_meeting, <id>_sentences, <id>_words) or into shards if
+# they are given, returns number of bytes written
+def save_meeting(meeting, sentences, words, destination, compression="none", shards=None):
+    if shards is not None:
+        written_bytes = write_to_shard(shards, "meetings", meeting["id"], [meeting])[1]
+        written_bytes += write_to_shard(shards, "sentences", meeting["id"], sentences)[1]
+        written_bytes += write_to_shard(shards, "words", meeting["id"], words)[1]
+        return written_bytes
+
+    file_path = get_jsonl_path(os.path.join(destination, meeting["id"] + "_meeting.jsonl"), compression)
+    written_bytes = save_to_jsonl([meeting], file_path)[1]
+
+    file_path = get_jsonl_path(os.path.join(destination, meeting["id"] + "_sentences.jsonl"), compression)
+    written_bytes += save_to_jsonl(sentences, file_path)[1]
+
+    file_path = get_jsonl_path(os.path.join(destination, meeting["id"] + "_words.jsonl"), compression)
+    written_bytes += save_to_jsonl(words, file_path)[1]
+
+    return written_bytes
+
+
+MEETING_FILE_SUFFIXES = {
+    "meetings": "_meeting.jsonl",
+    "sentences": "_sentences.jsonl",
+    "words": "_words.jsonl",
+}
+
+# separator of list items in lines written by dump_jsonl_line
+JSONL_LIST_SEPARATOR = b"," if orjson is not None else b", "
+
+
+# Memory-bounded saving of a meeting: sentences are written chunk by chunk as soon as they are translated, so only one
+# chunk of sentences is held in memory. The meeting document is written in pieces (everything before its list of
+# sentences, sentences of each chunk, everything after the list), so the files are the same as with save_meeting.
+# With shards, documents are spooled into temporary files and copied into shards when the writer is closed (a meeting
+# is never split between two shards). The meeting must contain an empty list of sentences.
+def open_meeting_writer(meeting, destination, compression="none", shards=None):
+    meeting_line = dump_jsonl_line(meeting)
+    sentences_list = re.search(rb'"sentences":\s*\[\]', meeting_line)
+
+    writer = {
+        "meeting_id": meeting["id"],
+        "shards": shards,
+        "files": {},
+        "meeting_tail": meeting_line[sentences_list.end() - 1:],
+        "number_of_sentences": 0,
+        "number_of_elements": {"meetings": 1, "sentences": 0, "words": 0},
+        "bytes": 0,
+        "start_time": time.time()
+    }
+
+    for document_type, suffix in MEETING_FILE_SUFFIXES.items():
+        if shards is None:
+            file_path = get_jsonl_path(os.path.join(destination, meeting["id"] + suffix), compression)
+            writer["files"][document_type] = open_jsonl(file_path, "wb")
+        else:
+            writer["files"][document_type] = tempfile.TemporaryFile()
+
+    meeting_head = meeting_line[:sentences_list.end() - 1]
+    writer["files"]["meetings"].write(meeting_head)
+    writer["bytes"] += len(meeting_head)
+
+    return writer
+
+
+# writes a chunk of sentences (into the meeting document) and their transformed sentences and words
+def write_meeting_chunk(writer, sentences, transformed_sentences, transformed_words):
+    meeting_file = writer["files"]["meetings"]
+    for sentence in sentences:
+        # line without the newline
+        sentence_json = dump_jsonl_line(sentence)[:-1]
+        if writer["number_of_sentences"] > 0:
+            sentence_json = JSONL_LIST_SEPARATOR + sentence_json
+        meeting_file.write(sentence_json)
+        writer["number_of_sentences"] += 1
+        writer["bytes"] += len(sentence_json)
+
+    for document_type, elements in (("sentences", transformed_sentences), ("words", transformed_words)):
+        number_of_elements, number_of_bytes = write_jsonl(elements, writer["files"][document_type])
+        writer["number_of_elements"][document_type] += number_of_elements
+        writer["bytes"] += number_of_bytes
+
+
+# finishes the meeting document, closes the files (or copies them into shards), returns number of bytes written
+def close_meeting_writer(writer):
+    writer["files"]["meetings"].write(writer["meeting_tail"])
+    writer["bytes"] += len(writer["meeting_tail"])
+
+    for document_type, file in writer["files"].items():
+        if writer["shards"] is not None:
+            copy_to_shard(writer["shards"], document_type, writer["meeting_id"], file)
+        file.close()
+
+    elapsed_time = time.time() - writer["start_time"]
+    print_write_throughput(sum(writer["number_of_elements"].values()), writer["bytes"],
+                           writer["meeting_id"] + " documents", elapsed_time)
+
+    return writer["bytes"]
+
+
+MEMORY_BOUNDED_CHUNK_SENTENCES = 1000
+
+
+# Yields chunks of sentences that end on segment boundaries (at least chunk_size sentences, unless the meeting ends).
+# References to sentences of a chunk are dropped once the chunk is processed, and the chunk size is halved whenever
+# RSS exceeds the memory ceiling.
+def iter_sentence_chunks(sentences, max_memory_mb=None, chunk_size=MEMORY_BOUNDED_CHUNK_SENTENCES):
+    def get_segment_id(index):
+        return sentences[index]["segment_id"] if sentences[index] else None
+
+    start = 0
+    while start < len(sentences):
+        end = min(start + chunk_size, len(sentences))
+        while end < len(sentences) and get_segment_id(end) is not None and \
+                get_segment_id(end) == get_segment_id(end - 1):
+            end += 1
+
+        yield sentences[start:end]
+
+        sentences[start:end] = [None] * (end - start)
+        start = end
+
+        rss = get_rss_mb()
+        if max_memory_mb and rss is not None and rss > max_memory_mb and chunk_size > 1:
+            chunk_size = max(chunk_size // 2, 1)
+            print(f"iter_sentence_chunks(): RSS {rss:.0f} MB is above the ceiling of {max_memory_mb} MB, "
+                  f"chunk size reduced to {chunk_size} sentences")
+
+
+def close_shards(shards):
+    for shard in shards["types"].values():
+        if shard["file"] is not None:
+            shard["file"].close()
+            shard["file"] = None
+
+    save_shards_index(shards)
+
+
+# parses work partition "i/N" (0 <= i < N) into tuple (i, N)
+def parse_work_partition(value):
+    if not value:
+        return None
+
+    match = re.match(r"^(\d+)/(\d+)$", value)
+    if not match or not 0 <= int(match.group(1)) < int(match.group(2)):
+        raise ValueError(f"Invalid work partition '{value}', expected i/N with 0 <= i < N")
+
+    return int(match.group(1)), int(match.group(2))
+
+
+# Lists files in the directory in a deterministic (sorted) order. If work partition (i, N) is given, only files of
+# the i-th of N parts are returned, so several machines can process the same directory without overlaps or gaps.
+# "size" balances parts by file bytes (largest files are assigned first to the part with the fewest bytes),
+# "hash" assigns each file by a stable hash of its name (assignment does not change when files are added).
+def list_work_files(directory, file_filter=None, work_partition=None, partition_by="size"):
+    files = sorted(file for file in os.listdir(directory) if file_filter is None or file_filter(file))
+    return partition_files(directory, files, work_partition, partition_by)
+
+
+# yu1Parl meetings: XML files except the corpus root (yu1Parl.xml) and the linguistically annotated (.ana) and English
+# (-en) variants
+YUPARL_CORPUS_ROOT = "yu1Parl"
+
+
+def is_yuparl_meeting_file(file):
+    name, extension = os.path.splitext(file)
+    return extension == ".xml" and name != YUPARL_CORPUS_ROOT and not name.endswith((".ana", "-en"))
+
+
+# returns files (in the directory) of the i-th of N parts, see list_work_files
+def partition_files(directory, files, work_partition=None, partition_by="size"):
+    if work_partition is None:
+        return files
+
+    part, number_of_parts = work_partition
+
+    if partition_by == "hash":
+        return [file for file in files if zlib.crc32(file.encode("utf-8")) % number_of_parts == part]
+
+    if partition_by != "size":
+        raise ValueError(f"Unknown partitioning '{partition_by}', expected 'size' or 'hash'")
+
+    sizes = {file: os.path.getsize(os.path.join(directory, file)) for file in files}
+    part_sizes = [0] * number_of_parts
+    part_files = [[] for _ in range(number_of_parts)]
+    for file in sorted(files, key=lambda f: (-sizes[f], f)):
+        smallest_part = min(range(number_of_parts), key=lambda p: (part_sizes[p], p))
+        part_sizes[smallest_part] += sizes[file]
+        part_files[smallest_part].append(file)
+
+    print(f"list_work_files(): part {part}/{number_of_parts} has {len(part_files[part])} files "
+          f"({part_sizes[part] / 1024 / 1024:.1f} MB of {sum(part_sizes) / 1024 / 1024:.1f} MB)")
+
+    return sorted(part_files[part])
+
+
+# Partition of the worker process within the work partition of the machine (or the whole work), e.g. worker 1 of 4 on
+# machine 0/2 gets 1/8, it is used to name shards of the worker.
+def get_worker_partition(work_partition, worker_index, number_of_workers):
+    part, number_of_parts = work_partition or (0, 1)
+    return part * number_of_workers + worker_index, number_of_parts * number_of_workers
+
+
+# Runs worker(worker_index) in number_of_workers processes forked from this one, waits for them and returns their
+# (small) return values. Forked processes share memory pages of the parent copy-on-write, so models loaded before the
+# fork are in memory only once. The parent must not run inference before the fork (thread pools of torch and OpenMP
+# do not survive fork).
+def run_forked_workers(worker, number_of_workers):
+    context = multiprocessing.get_context("fork")
+    results = context.SimpleQueue()
+
+    def run_worker(worker_index):
+        results.put((worker_index, worker(worker_index)))
+
+    processes = [context.Process(target=run_worker, args=(worker_index,)) for worker_index in range(number_of_workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    failed_workers = [worker_index for worker_index, process in enumerate(processes) if process.exitcode != 0]
+    if failed_workers:
+        raise RuntimeError(f"run_forked_workers(): workers {failed_workers} failed")
+
+    worker_results = [None] * number_of_workers
+    while not results.empty():
+        worker_index, result = results.get()
+        worker_results[worker_index] = result
+
+    return worker_results
+
+
+# CPUs this process may run on, ordered so that hyperthreads of the same physical core (and cores of the same socket)
+# are next to each other, contiguous slices of the list are then whole physical cores
+def get_available_cpus():
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+
+    def topology_key(cpu):
+        topology = {}
+        for name in ("physical_package_id", "core_id"):
+            try:
+                with open(f"/sys/devices/system/cpu/cpu{cpu}/topology/{name}", "r") as file:
+                    topology[name] = int(file.read())
+            except (OSError, ValueError):
+                topology[name] = cpu
+        return topology["physical_package_id"], topology["core_id"], cpu
+
+    return sorted(cpus, key=topology_key)
+
+
+# Splits CPUs between worker processes and, within a worker, threads between translation (torch) and lemmatization
+# (spaCy, which runs next to the translation and uses numpy BLAS threads). Each worker gets its own contiguous slice
+# of the CPUs (whole physical cores where possible).
+def plan_cpus(cpus=None, workers=1, translation_share=TRANSLATION_CPU_SHARE):
+    available_cpus = get_available_cpus()
+    cpus = min(cpus or len(available_cpus), len(available_cpus))
+    cpus_per_worker = max(cpus // workers, 1)
+    # threads of both never exceed the CPUs of the worker, with a single CPU lemmatization gets no threads of its own
+    # and runs in the calling thread
+    translation_threads = min(max(round(cpus_per_worker * translation_share), 1), max(cpus_per_worker - 1, 1))
+
+    return {
+        "cpus": cpus,
+        "workers": workers,
+        "cpus_per_worker": cpus_per_worker,
+        "translation_threads": translation_threads,
+        "lemmatization_threads": cpus_per_worker - translation_threads,
+        "worker_cpus": [available_cpus[(worker_index * cpus_per_worker) % cpus:][:cpus_per_worker]
+                        for worker_index in range(workers)]
+    }
+
+
+def format_cpu_plan(cpu_plan):
+    return (f"{cpu_plan['cpus']} CPUs, {cpu_plan['workers']} workers with {cpu_plan['cpus_per_worker']} CPUs "
+            f"({cpu_plan['translation_threads']} translation threads, {cpu_plan['lemmatization_threads']} "
+            f"lemmatization threads), CPUs of workers: {cpu_plan['worker_cpus']}")
+
+
+# Sets thread counts of native libraries (OpenMP, MKL, OpenBLAS, used by numpy for spaCy) to the lemmatization
+# threads of the plan. They are read when the libraries are loaded, so this has to be called before torch, numpy and
+# spaCy are imported, torch threads are then set with torch.set_num_threads.
+def set_thread_environment(cpu_plan):
+    for name in THREAD_ENVIRONMENT_VARIABLES:
+        # 1 means no pool, the work is done in the calling thread
+        os.environ[name] = str(max(cpu_plan["lemmatization_threads"], 1))
+
+
+# pins the process to the CPUs (Linux only)
+def set_cpu_affinity(cpus):
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
 
 
 def parse_attribs(elem):
@@ -43,47 +556,161 @@ def parse_titles(xml_root, namespace_mappings):
     return titles
 
 
-# parses the coordinates of an element
-def parse_coordinates(element):
-    coordinates = []
+XML_ID = "{http://www.w3.org/XML/1998/namespace}id"
 
+# order of values in coordinate tuples (page, x0, y0, x1, y1)
+COORDINATE_KEYS = ("page", "x0", "y0", "x1", "y1")
+
+
+# parses numbered x0/y0, x1/y1... attributes directly into (page, x0, y0, x1, y1) tuples
+def parse_coordinate_tuples(attrib):
+    from_page = attrib.get("fromPage")
+    to_page = attrib.get("toPage")
+    if from_page is None or to_page is None:
+        return []
+
+    coordinates = []
     try:
-        from_page = int(element.get("fromPage"))
-        to_page = int(element.get("toPage"))
-        x_coords = [float(element.attrib.get(key)) for key in element.attrib.keys() if key.startswith("x")]
-        y_coords = [float(element.attrib.get(key)) for key in element.attrib.keys() if key.startswith("y")]
-        coords = list(zip(x_coords, y_coords))
-
-        for i in range(0, len(coords), 2):
-            rect_coords = coords[i:i + 2]
-            x0, y0 = rect_coords[0]
-            x1, y1 = rect_coords[1]
-
-            coordinates.append({
-                "page": from_page if from_page == to_page else (from_page if i == 0 else to_page),
-                "x0": x0,
-                "y0": y0,
-                "x1": x1,
-                "y1": y1
-            })
-    except Exception as e:
-        # print("parse_coordinates(): error parsing coordinates: " + str(e))
-        # print(element.attrib)
+        from_page = int(from_page)
+        to_page = int(to_page)
+
+        n = 0
+        x0 = attrib.get("x0")
+        while x0 is not None:
+            y0 = attrib.get("y" + str(n))
+            x1 = attrib.get("x" + str(n + 1))
+            y1 = attrib.get("y" + str(n + 1))
+            if y0 is None or x1 is None or y1 is None:
+                return []
+
+            coordinates.append((from_page if n == 0 else to_page, float(x0), float(y0), float(x1), float(y1)))
+
+            n += 2
+            x0 = attrib.get("x" + str(n))
+    except ValueError:
         return []
 
     return coordinates
 
 
-def build_coords_index(xml_root, namespace_mappings):
+# converts coordinate tuples into dictionaries that are saved into JSONL files
+def coordinates_to_dicts(coordinates):
+    return [dict(zip(COORDINATE_KEYS, box)) for box in coordinates]
+
+
+# parses the coordinates of an element
+def parse_coordinates(element):
+    return coordinates_to_dicts(parse_coordinate_tuples(element.attrib))
+
+
+# Sidecar file with word coordinates, written by add-coordinates scripts instead of x0/y0/x1/y1... attributes.
+# Layout (little endian): header (magic, number of words, number of boxes, size of ids), table with cumulative end
+# offsets of each word id and its boxes, utf-8 encoded word ids and boxes (page, x0, y0, x1, y1)
+COORDS_SIDECAR_MAGIC = b"CVC1"
+COORDS_SIDECAR_HEADER = struct.Struct("<4sIII")
+COORDS_SIDECAR_ENTRY = struct.Struct("<II")
+COORDS_SIDECAR_BOX = struct.Struct("<i4f")
+
+
+def get_coords_sidecar_path(xml_path):
+    base_path = xml_path[:-len(".xml")] if xml_path.endswith(".xml") else xml_path
+    return base_path + ".coords.bin"
+
+
+# writes word boxes {word_id: [(page, x0, y0, x1, y1), ...]} to the sidecar file
+def write_coords_sidecar(word_boxes, file_path):
+    ids = bytearray()
+    table = bytearray()
+    boxes = bytearray()
+    number_of_boxes = 0
+
+    for word_id, boxes_of_word in word_boxes.items():
+        ids += word_id.encode("utf-8")
+        for box in boxes_of_word:
+            boxes += COORDS_SIDECAR_BOX.pack(*box)
+        number_of_boxes += len(boxes_of_word)
+        table += COORDS_SIDECAR_ENTRY.pack(len(ids), number_of_boxes)
+
+    with open(file_path, "wb") as file:
+        file.write(COORDS_SIDECAR_HEADER.pack(COORDS_SIDECAR_MAGIC, len(word_boxes), number_of_boxes, len(ids)))
+        file.write(table)
+        file.write(ids)
+        file.write(boxes)
+
+
+# memory-maps the sidecar file and returns the same index as build_coords_index (coordinate tuples)
+def read_coords_sidecar(file_path):
     id_to_coords = {}
-    for tag in ("w", "pc"):
-        for el in xml_root.findall(f".//ns0:{tag}", namespace_mappings):
-            eid = el.attrib.get("{http://www.w3.org/XML/1998/namespace}id") or el.attrib.get("id")
-            if not eid:
-                continue
-            coords = parse_coordinates(el)
-            if coords:
-                id_to_coords[eid] = coords
+
+    with open(file_path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        magic, number_of_words, number_of_boxes, ids_size = COORDS_SIDECAR_HEADER.unpack_from(buffer, 0)
+        if magic != COORDS_SIDECAR_MAGIC:
+            raise ValueError("read_coords_sidecar(): '" + file_path + "' is not a coordinates sidecar file")
+
+        table_offset = COORDS_SIDECAR_HEADER.size
+        ids_offset = table_offset + number_of_words * COORDS_SIDECAR_ENTRY.size
+        boxes_offset = ids_offset + ids_size
+
+        ids = buffer[ids_offset:boxes_offset]
+        boxes = list(COORDS_SIDECAR_BOX.iter_unpack(
+            buffer[boxes_offset:boxes_offset + number_of_boxes * COORDS_SIDECAR_BOX.size]))
+
+        id_start = 0
+        box_start = 0
+        for id_end, box_end in COORDS_SIDECAR_ENTRY.iter_unpack(buffer[table_offset:ids_offset]):
+            if box_end > box_start:
+                id_to_coords[ids[id_start:id_end].decode("utf-8")] = [
+                    (page, round(x0, 2), round(y0, 2), round(x1, 2), round(y1, 2))
+                    for page, x0, y0, x1, y1 in boxes[box_start:box_end]
+                ]
+            id_start = id_end
+            box_start = box_end
+
+    return id_to_coords
+
+
+# builds index {word_id: [(page, x0, y0, x1, y1), ...]} of all w and pc elements in a single traversal
+def build_coords_index(xml_root, namespace_mappings, coords_sidecar_path=None):
+    # use the sidecar file written by add-coordinates scripts if it exists
+    sidecar_index = None
+    if coords_sidecar_path and os.path.exists(coords_sidecar_path):
+        sidecar_index = read_coords_sidecar(coords_sidecar_path)
+
+    namespace = namespace_mappings["ns0"]
+    tags = {"{" + namespace + "}w", "{" + namespace + "}pc"}
+
+    id_to_coords = {}
+    # words with pages but without coordinate attributes have their coordinates in the sidecar file
+    sidecar_ids = []
+    for el in xml_root.iter():
+        if el.tag not in tags:
+            continue
+
+        attrib = el.attrib
+        if "x0" not in attrib:
+            if "fromPage" in attrib:
+                sidecar_ids.append(attrib.get(XML_ID) or attrib.get("id"))
+            continue
+
+        eid = attrib.get(XML_ID) or attrib.get("id")
+        if not eid:
+            continue
+
+        coords = parse_coordinate_tuples(attrib)
+        if coords:
+            id_to_coords[eid] = coords
+
+    if sidecar_index is not None:
+        missing = sum(1 for eid in sidecar_ids if eid not in sidecar_index)
+        if missing or len(sidecar_index) != len(sidecar_ids):
+            print(f"build_coords_index(): warning: sidecar file '{coords_sidecar_path}' does not match the XML "
+                  f"({len(sidecar_index)} words in the sidecar file, {len(sidecar_ids)} words with pages in the XML, "
+                  f"{missing} of them missing), it may be stale")
+        return sidecar_index
+
+    if sidecar_ids:
+        print(f"build_coords_index(): warning: {len(sidecar_ids)} words have pages but no coordinates and the sidecar "
+              f"file '{coords_sidecar_path}' is missing, their coordinates will be empty")
     return id_to_coords
 
 
@@ -91,7 +718,6 @@ def transform_sentences_fast(meeting, coords_index=None):
     if coords_index is None:
         raise ValueError("coords_index is required for transform_sentences_fast")
 
-    import time
     time_start = time.time()
 
     transformed_sentences = []
@@ -106,7 +732,7 @@ def transform_sentences_fast(meeting, coords_index=None):
                 if not wid:
                     continue
                 if wid in coords_index:
-                    coords.extend(coords_index[wid])
+                    coords.extend(coordinates_to_dicts(coords_index[wid]))
 
         transformed_sentences.append({
             "meeting_id": meeting.get("id"),
@@ -126,30 +752,27 @@ def transform_sentences_fast(meeting, coords_index=None):
     return transformed_sentences
 
 
-def transform_words_fast(meeting, coords_index=None):
-    if coords_index is None:
-        raise ValueError("coords_index is required for transform_words_fast")
-
-    import time
-    time_start = time.time()
-
-    transformed_words = []
+# yields transformed words one by one, so they can be streamed to disk without building a list
+def iter_transformed_words(meeting, coords_index):
+    meeting_id = meeting.get("id")
 
     for sentence in meeting.get("sentences", []):
         for translation in sentence.get("translations", []):
 
+            words = translation.get("words", [])
+            is_original = translation.get("original") == 1
             word_index = 0
-            for i, word in enumerate(translation.get("words", [])):
+            for i, word in enumerate(words):
                 # `word` is a dict produced by lemmanize_text or original parse,
                 # use its fields directly
-                prev_join = translation["words"][i - 1].get("join") if i > 0 else None
+                prev_join = words[i - 1].get("join") if i > 0 else None
                 word_index = word_index + 1 if i > 0 and prev_join != "right" else word_index
 
                 wid = word.get("id")
-                coordinates = coords_index.get(wid, []) if (translation.get("original") == 1 and wid) else []
+                coordinates = coordinates_to_dicts(coords_index.get(wid, ())) if (is_original and wid) else []
 
-                transformed_words.append({
-                    "meeting_id": meeting.get("id"),
+                yield {
+                    "meeting_id": meeting_id,
                     "sentence_id": sentence.get("id"),
                     "segment_id": sentence.get("segment_id"),
                     "word_id": wid,
@@ -164,7 +787,16 @@ def transform_words_fast(meeting, coords_index=None):
                     "lang": translation.get("lang"),
                     "original": translation.get("original"),
                     "propn": word.get("propn", 0)
-                })
+                }
+
+
+def transform_words_fast(meeting, coords_index=None):
+    if coords_index is None:
+        raise ValueError("coords_index is required for transform_words_fast")
+
+    time_start = time.time()
+
+    transformed_words = list(iter_transformed_words(meeting, coords_index))
 
     time_end = time.time()
     print("transform_words_fast(): transformed words in " + str(time_end - time_start) + " seconds")
@@ -178,3 +810,633 @@ def get_lang_id(tokenizer, lang_code):
     except AttributeError:
         return tokenizer.convert_tokens_to_ids(lang_code)
 
+
+# Tokens that are written the same in all languages: punctuation, numbers (also ordinals, e.g. "12.", and well-formed
+# roman numerals with at least two letters or a dot, so the preposition "V" and words like "CIVIL" are not ones) and
+# section markers
+UNTRANSLATABLE_TOKEN_PATTERN = re.compile(r"^([^\w\s]+|\d+([.,:/-]\d+)*\.?|[a-z]\)|"
+                                          r"(?=[IVXLCDM]{2}|[IVXLCDM]\.)M{0,3}(CM|CD|D?C{0,3})(XC|XL|L?X{0,3})"
+                                          r"(IX|IV|V?I{0,3})\.?)$")
+
+
+# Sentences that are copied into the other languages instead of translated: they consist only of punctuation, numbers,
+# section markers and proper nouns (propn of the parsed words, from msd), e.g. roll-call names or a single name.
+# Sentences without words are copied as well (an empty translation), the model makes up output for empty inputs.
+def is_translation_bypassed(words):
+    return all(word.get("type") == "pc" or word["propn"] == 1 or
+               UNTRANSLATABLE_TOKEN_PATTERN.match(word["text"] or "") for word in words)
+
+
+# Translation of a bypassed sentence: copy of the original text and words (text and lemmas converted with
+# convert_text, e.g. transliterated) with ids and fields of lemmatized translations
+def copy_translation(sentence, lang, convert_text=None):
+    convert_text = convert_text or (lambda text: text)
+    original = sentence["translations"][0]
+    words = []
+    for i, word in enumerate(original["words"]):
+        words.append({
+            "id": sentence["id"] + "." + str(i + 1) + ".(" + lang + ")",
+            "type": word.get("type", "w" if (word["text"] or "")[:1].isalnum() else "pc"),
+            "lemma": convert_text(word["lemma"]),
+            "text": convert_text(word["text"]),
+            "propn": word["propn"],
+            "join": word.get("join", "natural")
+        })
+
+    return {
+        "lang": lang,
+        "original": 0,
+        "speaker": sentence["speaker"],
+        "text": convert_text(original["text"]).strip(),
+        "words": words
+    }
+
+
+# Decoding profiles for translation. Batches whose longest source has at most short_source_tokens tokens are decoded
+# with short_beams, others with beams. max_new_tokens grows with the source length (length_factor * tokens +
+# length_offset) up to max_new_tokens, so degenerate outputs can not run away.
+DECODING_PROFILES = {
+    "fast": {"short_source_tokens": 16, "short_beams": 1, "beams": 2, "length_factor": 1.3, "length_offset": 10,
+             "max_new_tokens": 256},
+    "balanced": {"short_source_tokens": 16, "short_beams": 2, "beams": 3, "length_factor": 1.5, "length_offset": 16,
+                 "max_new_tokens": 384},
+    "quality": {"short_source_tokens": 16, "short_beams": 3, "beams": 5, "length_factor": 2.0, "length_offset": 16,
+                "max_new_tokens": 512},
+}
+
+
+# num_beams and max_new_tokens of the profile for a batch with the given longest source (in tokens)
+def get_decoding_arguments(profile_name, source_tokens):
+    profile = DECODING_PROFILES[profile_name]
+    return {
+        "num_beams": profile["short_beams"] if source_tokens <= profile["short_source_tokens"] else profile["beams"],
+        "max_new_tokens": min(int(profile["length_factor"] * source_tokens) + profile["length_offset"],
+                              profile["max_new_tokens"])
+    }
+
+
+# mean log-probability of the generated tokens (tensors of transition scores and tokens) of each translation, the first
+# token (target language, forced with forced_bos_token_id, so its probability is 1) and padding are not counted
+def get_mean_token_scores(token_scores, generated_tokens, pad_token_id):
+    mask = generated_tokens[:, 1:] != pad_token_id
+    token_scores = token_scores[:, 1:].masked_fill(~mask, 0)
+    return (token_scores.sum(dim=1) / mask.sum(dim=1).clamp(min=1)).tolist()
+
+
+# indices of translations that should be translated again with a better model: mean token log-probability is below
+# min_score or the length ratio (characters of translation / characters of source) is outside of length_ratio_range
+# (length is not checked for short sources, e.g. "Ja." -> "Da.", where the ratio says nothing)
+def get_escalated_indices(sources, translations, scores, min_score, length_ratio_range, min_source_length=10):
+    escalated = []
+    for i, (source, translation, score) in enumerate(zip(sources, translations, scores)):
+        length_ratio = len(translation) / max(len(source), 1)
+        is_length_unusual = len(source) >= min_source_length and \
+            not length_ratio_range[0] <= length_ratio <= length_ratio_range[1]
+        if score < min_score or is_length_unusual:
+            escalated.append(i)
+
+    return escalated
+
+
+QUEUE_END = object()
+
+
+# Runs the consumer (function that takes an iterator of items) in a worker thread, while items are produced in the
+# calling thread, so both can work at the same time (e.g. translation and lemmatization). At most queue_size items
+# wait between them. Returns the result of the consumer and timings: wall time and busy time (without waiting for
+# each other) of the producer and the consumer.
+def run_overlapped(producer, consumer, queue_size):
+    items = queue.Queue(maxsize=queue_size)
+    result = {}
+    timings = {"producer_wait": 0.0, "consumer_wait": 0.0, "consumer_time": 0.0}
+
+    def iter_queue():
+        while True:
+            time_start = time.perf_counter()
+            item = items.get()
+            timings["consumer_wait"] += time.perf_counter() - time_start
+            if item is QUEUE_END:
+                return
+            yield item
+
+    def consume():
+        time_start = time.perf_counter()
+        try:
+            result["value"] = consumer(iter_queue())
+        except BaseException as e:
+            result["error"] = e
+        timings["consumer_time"] = time.perf_counter() - time_start
+
+    # puts the item into the queue, unless the consumer stopped (because of an error)
+    def put(item):
+        time_start = time.perf_counter()
+        while worker.is_alive():
+            try:
+                items.put(item, timeout=1)
+                break
+            except queue.Full:
+                pass
+        timings["producer_wait"] += time.perf_counter() - time_start
+
+    worker = threading.Thread(target=consume, daemon=True)
+    time_start = time.perf_counter()
+    worker.start()
+    try:
+        for item in producer:
+            if not worker.is_alive():
+                break
+            put(item)
+        # waiting for the consumer to drain the queue is not work of the producer
+        producer_time = time.perf_counter() - time_start - timings["producer_wait"]
+    finally:
+        put(QUEUE_END)
+        worker.join()
+    wall_time = time.perf_counter() - time_start
+
+    if "error" in result:
+        raise result["error"]
+
+    consumer_time = timings["consumer_time"] - timings["consumer_wait"]
+    return result["value"], {
+        "wall_time": wall_time,
+        "producer_time": producer_time,
+        "consumer_time": consumer_time,
+        "saved_time": producer_time + consumer_time - wall_time
+    }
+
+
+# NLLB models for translation, the fast model (tiered translation) has the same tokenizer as the large one
+TRANSLATION_MODEL = "facebook/nllb-200-distilled-1.3B"
+FAST_TRANSLATION_MODEL = "facebook/nllb-200-distilled-600M"
+# translations of the fast model below this mean token log-probability or with a length ratio (characters of
+# translation / characters of source) outside of the range are translated again with the large model
+ESCALATION_MIN_SCORE = -0.9
+ESCALATION_LENGTH_RATIO = (0.5, 2.0)
+# the translation cache is emptied when it reaches this size
+TRANSLATION_CACHE_SIZE = 100000
+# texts are sorted by length within windows of this many batches
+LENGTH_SORT_WINDOW_BATCHES = 8
+# maximum number of translated sentences waiting for lemmatization
+TRANSLATION_QUEUE_SIZE = 256
+
+
+# Translator of a parser: models (loaded when they are first needed), decoding settings and translations of already
+# translated texts {(source_lang, target_lang, text): translation}, so repeated texts (agenda items, short
+# interjections, ...) are translated only once. beam_arguments are passed to generate of the large model. With tiered,
+# everything is translated greedily with the fast model and only weak translations again with the large model (beam
+# search). With pipeline, translations are lemmatized while the next ones are decoded. torch and transformers are
+# imported only by translation functions, so thread counts (set_thread_environment) can be set after utils is imported.
+def create_translator(decoding_profile, beam_arguments, tiered=False, pipeline=True):
+    import torch
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    return {
+        "device": device,
+        "use_fp16": device == "cuda",
+        "tokenizer": None,
+        "model": None,
+        "fast_model": None,
+        "decoding_profile": decoding_profile,
+        "beam_arguments": beam_arguments,
+        "tiered": tiered,
+        "pipeline": pipeline,
+        "cache": {}
+    }
+
+
+def load_translation_model(translator, model_name):
+    from transformers import AutoModelForSeq2SeqLM
+
+    translation_model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
+    translation_model.eval()
+    translation_model.to(translator["device"])
+    if translator["device"] == "cuda" and translator["use_fp16"]:
+        # convert model to fp16 for lower memory usage / faster inference on supported GPUs
+        try:
+            translation_model.half()
+        except Exception:
+            print("Warning: could not convert model to fp16")
+
+    return translation_model
+
+
+def ensure_translation_model_loaded(translator, model_name=TRANSLATION_MODEL):
+    if translator["tokenizer"] is not None and translator["model"] is not None:
+        return
+
+    from transformers import AutoTokenizer
+
+    translator["tokenizer"] = AutoTokenizer.from_pretrained(model_name)
+    translator["model"] = load_translation_model(translator, model_name)
+
+
+def ensure_fast_model_loaded(translator):
+    if translator["fast_model"] is not None:
+        return
+
+    from transformers import AutoTokenizer
+
+    if translator["tokenizer"] is None:
+        translator["tokenizer"] = AutoTokenizer.from_pretrained(FAST_TRANSLATION_MODEL)
+    translator["fast_model"] = load_translation_model(translator, FAST_TRANSLATION_MODEL)
+
+
+# frees intermediate tensors of a batch from cached GPU memory
+def empty_device_cache(translator):
+    import torch
+
+    if translator["device"] == "cuda":
+        torch.cuda.empty_cache()
+
+
+# name of the source language(s) for logs
+def get_source_name(source_lang):
+    return source_lang if isinstance(source_lang, str) else "+".join(dict.fromkeys(source_lang))
+
+
+# tokenizes (source language, text) pairs into one padded batch, each text gets the token of its own source language
+def encode_batch(translator, batch):
+    tokenizer = translator["tokenizer"]
+    input_ids = [None] * len(batch)
+    for source_lang in dict.fromkeys(lang for lang, _ in batch):
+        indices = [i for i, (lang, _) in enumerate(batch) if lang == source_lang]
+        tokenizer.src_lang = source_lang
+        encoded = tokenizer([batch[i][1] for i in indices], truncation=True, max_length=512)
+        for i, ids in zip(indices, encoded["input_ids"]):
+            input_ids[i] = ids
+
+    return tokenizer.pad({"input_ids": input_ids}, return_tensors="pt")
+
+
+# translates the batch of (source language, text) pairs with the (large) model
+def generate_batch(translator, batch, target_lang, num_beams=None):
+    encoded = encode_batch(translator, batch).to(translator["device"])
+    decoding_arguments = get_decoding_arguments(translator["decoding_profile"],
+                                                encoded["attention_mask"].sum(dim=1).max().item())
+    generated_tokens = translator["model"].generate(
+        **encoded,
+        forced_bos_token_id=get_lang_id(translator["tokenizer"], target_lang),
+        num_beams=num_beams or decoding_arguments["num_beams"],
+        max_new_tokens=decoding_arguments["max_new_tokens"],
+        **translator["beam_arguments"]
+    )
+
+    decoded = translator["tokenizer"].batch_decode(generated_tokens, skip_special_tokens=True)
+
+    del encoded, generated_tokens
+    empty_device_cache(translator)
+
+    return decoded
+
+
+# translates the batch greedily with the fast model, returns translations and their mean token log-probabilities
+def generate_fast_batch(translator, batch, target_lang):
+    encoded = encode_batch(translator, batch).to(translator["device"])
+    decoding_arguments = get_decoding_arguments(translator["decoding_profile"],
+                                                encoded["attention_mask"].sum(dim=1).max().item())
+    output = translator["fast_model"].generate(
+        **encoded,
+        forced_bos_token_id=get_lang_id(translator["tokenizer"], target_lang),
+        num_beams=1,
+        do_sample=False,
+        max_new_tokens=decoding_arguments["max_new_tokens"],
+        output_scores=True,
+        return_dict_in_generate=True,
+    )
+
+    # scores are given for the generated tokens (without the decoder start token)
+    token_scores = translator["fast_model"].compute_transition_scores(output.sequences, output.scores,
+                                                                      normalize_logits=True)
+    generated_tokens = output.sequences[:, -token_scores.shape[1]:]
+    scores = get_mean_token_scores(token_scores, generated_tokens, translator["tokenizer"].pad_token_id)
+
+    decoded = translator["tokenizer"].batch_decode(output.sequences, skip_special_tokens=True)
+
+    del encoded, output, token_scores, generated_tokens
+    empty_device_cache(translator)
+
+    return decoded, scores
+
+
+# translates the batch, with tiered translation weak translations of the fast model are translated again
+def translate_batch(translator, batch, target_lang, num_beams=None):
+    if not translator["tiered"]:
+        ensure_translation_model_loaded(translator)
+        return generate_batch(translator, batch, target_lang, num_beams)
+
+    ensure_fast_model_loaded(translator)
+    decoded, scores = generate_fast_batch(translator, batch, target_lang)
+    escalated = get_escalated_indices([text for _, text in batch], decoded, scores, ESCALATION_MIN_SCORE,
+                                      ESCALATION_LENGTH_RATIO)
+    instrumentation.count("fast_translated_sentences", len(batch))
+    instrumentation.count("escalated_sentences", len(escalated))
+
+    if escalated:
+        ensure_translation_model_loaded(translator)
+        for i, translation in zip(escalated, generate_batch(translator, [batch[i] for i in escalated], target_lang,
+                                                            num_beams)):
+            decoded[i] = translation
+
+    return decoded
+
+
+# yields translations of the sentences in order, as soon as they are decoded. source_lang is a language code or a list
+# of codes (one per sentence), so sentences from several source languages with the same target language share batches.
+# Repeated texts (in the sentences or already translated) are translated only once, so batches are always full.
+# num_beams overrides the beam width of the decoding profile.
+def iter_translated_chunks(translator, sentences, source_lang, target_lang, chunk_size=10, num_beams=None):
+    import torch
+    from alive_progress import alive_bar
+
+    instrumentation.count("translated_sentences", len(sentences))
+
+    translation_cache = translator["cache"]
+    source_langs = [source_lang] * len(sentences) if isinstance(source_lang, str) else source_lang
+    keys = list(zip(source_langs, sentences))
+    translations = {key: translation_cache[(key[0], target_lang, key[1])] for key in keys
+                    if (key[0], target_lang, key[1]) in translation_cache}
+    missing = [key for key in dict.fromkeys(keys) if key not in translations]
+    instrumentation.count("translation_cache_hits", len(keys) - len(missing))
+
+    # texts of similar length share batches (less padding, decoding arguments fit the whole batch), they are sorted
+    # only within windows of batches, so translations are still yielded soon
+    window_size = chunk_size * LENGTH_SORT_WINDOW_BATCHES
+    missing = [key for start in range(0, len(missing), window_size)
+               for key in sorted(missing[start:start + window_size], key=lambda key: len(key[1]))]
+
+    number_of_batches = 0
+    position = 0
+    with torch.no_grad():
+        with alive_bar(len(sentences), title=f"Translating {get_source_name(source_lang)}→{target_lang}",
+                       force_tty=True) as bar:
+            bar(0)
+            for start in range(0, len(missing), chunk_size):
+                batch = missing[start:start + chunk_size]
+
+                decoded = translate_batch(translator, batch, target_lang, num_beams)
+
+                number_of_batches += 1
+                translations.update(zip(batch, decoded))
+                if len(translation_cache) + len(batch) > TRANSLATION_CACHE_SIZE:
+                    translation_cache.clear()
+                translation_cache.update(((lang, target_lang, text), translation)
+                                         for (lang, text), translation in zip(batch, decoded))
+
+                # sentences up to the first one without translation
+                end = position
+                while end < len(keys) and keys[end] in translations:
+                    end += 1
+                if end > position:
+                    bar(end - position)
+                    yield [translations[key] for key in keys[position:end]]
+                    position = end
+
+            if position < len(keys):
+                bar(len(keys) - position)
+                yield [translations[key] for key in keys[position:]]
+
+    instrumentation.count("translation_batches", number_of_batches)
+    if number_of_batches:
+        print(f"iter_translated_chunks(): {len(missing)} texts in {number_of_batches} batches "
+              f"({len(missing) / (number_of_batches * chunk_size):.0%} batch fill)")
+
+
+def translate_sentences(translator, sentences, source_lang, target_lang, chunk_size=10, num_beams=None):
+    translations = []
+    for decoded in iter_translated_chunks(translator, sentences, source_lang, target_lang, chunk_size, num_beams):
+        translations.extend(decoded)
+
+    return translations
+
+
+# translates the texts like translate_sentences, but empty texts (None or only whitespace) are not sent to the model,
+# which makes up output for them, and get an empty translation
+def translate_non_empty(translator, texts, source_lang, target_lang):
+    texts = [(text or "").strip() for text in texts]
+    translated = iter(translate_sentences(translator, [text for text in texts if text], source_lang, target_lang))
+    return [next(translated) if text else "" for text in texts]
+
+
+# translates the sentences and lemmatizes the translations with lemmatize (batch_lemmatize of the parser), with
+# pipeline translation they are lemmatized in another thread as soon as they are decoded (so spaCy does not wait for
+# the whole translation and vice versa)
+def translate_and_lemmatize(translator, lemmatize, sentences, source_lang, target_lang, lang, sentence_ids):
+    if not translator["pipeline"]:
+        with instrumentation.stage("translate"):
+            translations = translate_sentences(translator, sentences, source_lang, target_lang)
+        with instrumentation.stage("lemmatize"):
+            lemmatizations = lemmatize(translations, lang, sentence_ids)
+        return translations, lemmatizations
+
+    translations = []
+
+    def produce_translations():
+        for decoded in iter_translated_chunks(translator, sentences, source_lang, target_lang):
+            translations.extend(decoded)
+            yield from decoded
+
+    lemmatizations, timings = run_overlapped(
+        produce_translations(),
+        lambda texts: lemmatize(texts, lang, sentence_ids, number_of_texts=len(sentences), show_progress=False),
+        TRANSLATION_QUEUE_SIZE
+    )
+
+    instrumentation.add_stage_time("translate", timings["producer_time"])
+    instrumentation.add_stage_time("lemmatize", timings["consumer_time"])
+    instrumentation.count("translation_overlap_saved_s", timings["saved_time"])
+    print(f"translate_and_lemmatize(): {get_source_name(source_lang)}→{target_lang} in {timings['wall_time']:.1f} s, "
+          f"overlapping translation and lemmatization saved {timings['saved_time']:.1f} s")
+
+    return translations, lemmatizations
+
+
+# gathers data about sentences and words of the translated meeting
+def transform_meeting(meeting, coords_index):
+    with instrumentation.stage("transform"):
+        transformed_sentences = transform_sentences_fast(meeting, coords_index=coords_index)
+    # words are transformed lazily while they are written to disk
+    transformed_words = iter_transformed_words(meeting, coords_index)
+
+    return transformed_sentences, transformed_words
+
+
+# saves data of the meeting to jsonl files (or shards), returns number of bytes written
+def save_parsed_meeting(meeting, sentences, words, destination, compression="none", shards=None):
+    # words are transformed while they are written, so their transform time is part of the write stage
+    write_start_time = time.time()
+    with instrumentation.stage("write"):
+        written_bytes = save_meeting(meeting, sentences, words, destination, compression, shards)
+
+    write_time = time.time() - write_start_time
+    written_megabytes = written_bytes / 1024 / 1024
+    print(f"parse(): wrote {written_megabytes:.2f} MB in {write_time:.2f} s "
+          f"({written_megabytes / max(write_time, 1e-9):.2f} MB/s)")
+
+    return written_bytes
+
+
+# Corpus specific steps of the parse pipeline are given by the parser in a dict (see CORPUS in parser_dzk):
+# translator, read_meeting(xml_root, coords_sidecar_path) -> meeting without translations and coords index,
+# translate_meetings(meetings), parse_meeting(xml_root, coords_sidecar_path) -> meeting, sentences and words, and
+# parse_and_save_meeting_bounded(xml_root, coords_sidecar_path, destination, compression, shards, max_memory_mb) ->
+# meeting and bytes written
+
+
+# translates a group of parsed meetings together and saves them, the group is a list of
+# (instrumentation record, meeting, coords index), time of the translation is split between the meetings
+def translate_and_save_group(corpus, group, destination, compression="none", shards=None, run_log_path=None):
+    meetings = [meeting for _, meeting, _ in group]
+    with instrumentation.shared_work([record for record, _, _ in group],
+                                     [len(meeting["sentences"]) for meeting in meetings]):
+        corpus["translate_meetings"](meetings)
+
+    for record, meeting, coords_index in group:
+        instrumentation.resume_meeting(record)
+        sentences, words = transform_meeting(meeting, coords_index)
+        written_bytes = save_parsed_meeting(meeting, sentences, words, destination, compression, shards)
+        instrumentation.count("bytes_written", written_bytes)
+        instrumentation.finish_meeting(meeting["id"], run_log_path)
+
+
+# parses the files and saves the meetings (into shards of the given work partition)
+def parse_files(corpus, source, destination, files, from_idx=0, to_idx=-1, compression="none", shard_size_mb=None,
+                work_partition=None, run_log_path=None, max_memory_mb=None, translation_group_sentences=None):
+    # write all meetings into size-bounded shards instead of three files per meeting
+    shards = open_shards(destination, compression, shard_size_mb * 1024 * 1024,
+                         work_partition) if shard_size_mb else None
+
+    # with translation_group_sentences, parsed meetings wait until they have together at least that many sentences and
+    # are then translated together (peak RSS of a meeting then includes the whole group)
+    group = []
+
+    try:
+        for i, file in enumerate(files):
+
+            if i < from_idx:
+                continue
+
+            if i >= to_idx and to_idx != -1:
+                break
+
+            path = os.path.join(source, file)
+
+            instrumentation.start_meeting(file)
+            with instrumentation.stage("xml_parse"):
+                xml_tree = ET.parse(path)
+            xml_root = xml_tree.getroot()
+
+            print("parse(): processing file " + file)
+
+            if max_memory_mb:
+                # meeting is translated and written in chunks, so memory stays bounded
+                meeting, written_bytes = corpus["parse_and_save_meeting_bounded"](
+                    xml_root, get_coords_sidecar_path(path), destination, compression, shards, max_memory_mb)
+                del xml_tree, xml_root
+            elif translation_group_sentences:
+                # meeting is translated later, together with the next meetings
+                meeting, coords_index = corpus["read_meeting"](xml_root, get_coords_sidecar_path(path))
+                del xml_tree, xml_root
+                group.append((instrumentation.pause_meeting(), meeting, coords_index))
+
+                if sum(len(meeting["sentences"]) for _, meeting, _ in group) >= translation_group_sentences:
+                    translate_and_save_group(corpus, group, destination, compression, shards, run_log_path)
+                    group = []
+                print(f"parse(): {i+1}/{len(files)} files processed\n")
+                continue
+            else:
+                meeting, sentences, words = corpus["parse_meeting"](xml_root, get_coords_sidecar_path(path))
+                del xml_tree, xml_root
+
+                written_bytes = save_parsed_meeting(meeting, sentences, words, destination, compression, shards)
+                del sentences, words
+            instrumentation.count("bytes_written", written_bytes)
+
+            instrumentation.finish_meeting(meeting["id"], run_log_path)
+            print(f"parse(): {i+1}/{len(files)} files processed\n")
+
+        # remaining meetings
+        if group:
+            translate_and_save_group(corpus, group, destination, compression, shards, run_log_path)
+    finally:
+        if shards is not None:
+            close_shards(shards)
+
+    instrumentation.print_summary()
+
+    if corpus["translator"]["tiered"]:
+        fast_translated = instrumentation.get_counter_total("fast_translated_sentences")
+        escalated = instrumentation.get_counter_total("escalated_sentences")
+        print(f"parse(): tiered translation escalated {escalated} of {fast_translated} sentences "
+              f"({escalated / max(fast_translated, 1):.1%}) to the large model")
+
+
+# sets torch threads and CPUs of the worker according to the plan (see plan_cpus)
+def apply_cpu_plan(cpu_plan, worker_index):
+    import torch
+
+    torch.set_num_threads(cpu_plan["translation_threads"])
+    set_cpu_affinity(cpu_plan["worker_cpus"][worker_index])
+
+
+def print_throughput(cpu_plan, number_of_sentences, elapsed_time):
+    layout = format_cpu_plan(cpu_plan) if cpu_plan is not None else "default threads"
+    print(f"parse(): {number_of_sentences} sentences in {elapsed_time:.1f} s "
+          f"({number_of_sentences / max(elapsed_time, 1e-9):.1f} sentences/s), {layout}")
+
+
+# Loads the translation model before worker processes are forked, so they share one copy of the weights (parameters
+# are moved to shared memory, objects of the parent are frozen, so the garbage collector of a worker does not write to
+# their pages and copy them). CUDA does not work in forked processes, so on GPU every worker loads its own model.
+def prepare_model_for_workers(translator):
+    if translator["device"] != "cpu":
+        print(f"prepare_model_for_workers(): model is not shared on {translator['device']}, every worker loads its own "
+              f"model")
+        return
+
+    if translator["tiered"]:
+        ensure_fast_model_loaded(translator)
+        translator["fast_model"].share_memory()
+    ensure_translation_model_loaded(translator)
+    translator["model"].share_memory()
+    gc.freeze()
+    print(f"prepare_model_for_workers(): model loaded before fork, memory: {instrumentation.get_memory_breakdown_mb()}")
+
+
+# parses the files of the corpus (file_filter files, only the given part of them if work is partitioned between
+# machines), with several workers the files are split between forked worker processes, each writes its own shards
+def parse_corpus(corpus, source, destination, file_filter, from_idx=0, to_idx=-1, compression="none",
+                 shard_size_mb=None, work_partition=None, partition_by="size", run_log_path=None, max_memory_mb=None,
+                 translation_group_sentences=None, workers=1, cpu_plan=None):
+    files = list_work_files(source, file_filter, work_partition, partition_by)
+
+    # the plan is made by the caller (main.py), before torch and spaCy are imported
+    if cpu_plan is not None:
+        print(f"parse(): CPU layout: {format_cpu_plan(cpu_plan)}")
+
+    start_time = time.time()
+
+    if workers <= 1:
+        if cpu_plan is not None:
+            apply_cpu_plan(cpu_plan, 0)
+        parse_files(corpus, source, destination, files, from_idx, to_idx, compression, shard_size_mb, work_partition,
+                    run_log_path, max_memory_mb, translation_group_sentences)
+        number_of_sentences = instrumentation.get_counter_total("sentences")
+        print_throughput(cpu_plan, number_of_sentences, time.time() - start_time)
+        return
+
+    files = files[from_idx:] if to_idx == -1 else files[from_idx:to_idx]
+    prepare_model_for_workers(corpus["translator"])
+
+    @profile_worker
+    def parse_worker(worker_index):
+        if cpu_plan is not None:
+            apply_cpu_plan(cpu_plan, worker_index)
+        worker_files = partition_files(source, files, (worker_index, workers), partition_by)
+        parse_files(corpus, source, destination, worker_files, 0, -1, compression, shard_size_mb,
+                    get_worker_partition(work_partition, worker_index, workers), run_log_path, max_memory_mb,
+                    translation_group_sentences)
+        print(f"parse(): worker {worker_index}/{workers} finished, memory: {instrumentation.get_memory_breakdown_mb()}")
+        return instrumentation.get_counter_total("sentences")
+
+    number_of_sentences = sum(run_forked_workers(parse_worker, workers))
+    print_throughput(cpu_plan, number_of_sentences, time.time() - start_time)